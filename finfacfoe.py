@@ -1,4 +1,9 @@
-from typing import Any
+import time
+from finfacfoe_startup import StartupTimer, SyncState, tree_fingerprint
+#started before the discord.py import so the report covers it
+startup = StartupTimer()
+from typing import Any, Literal
+import re
 import discord
 from discord.ext import tasks,commands
 from discord import app_commands
@@ -6,60 +11,260 @@ import logging
 from discord.interactions import Interaction
 from dotenv import load_dotenv
 import os
-import math
-from enum import Enum
-import numpy as np
-import logging
 import asyncio
-
-logging.basicConfig(level=logging.INFO)
+import functools
+import itertools
+import signal
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+from finfacfoe_engine import FinFacFoeState, MOVE, format_board
+from finfacfoe_edits import EditScheduler, SendPacer, ClickReply, BUCKETS
+from finfacfoe_sessions import SessionManager, SessionLimitError
+from finfacfoe_store import GameStore, COLUMNS as STORE_COLUMNS, decode_board
+from finfacfoe_config import ChannelConfig
+from finfacfoe_movelog import MoveLog
+from finfacfoe_tournament import Tournament, TournamentScheduler, TournamentError
+from finfacfoe_ai import AIPool, observe
+from finfacfoe_solver import open_table
+from finfacfoe_ratings import RatingBook
+from finfacfoe_render import render_key, render_rows, board_tiles, custom_id as render_custom_id, parse_custom_id
+from finfacfoe_logging import setup_logging, game_logger, Lazy
+import finfacfoe_metrics as metrics
 
 load_dotenv()
 
+#Logging, see finfacfoe_logging.py
+LOG_LEVEL = os.getenv("LOG_LEVEL","INFO").upper()
+GAME_LOG_LEVEL = os.getenv("GAME_LOG_LEVEL",LOG_LEVEL).upper()
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE",1.0))
+LOG_FORMAT = os.getenv("LOG_FORMAT","text")
+setup_logging(LOG_LEVEL,GAME_LOG_LEVEL,LOG_FORMAT,TRACE_SAMPLE_RATE)
+
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN2")
-DISCORD_GUILD = os.getenv("DISCORD_GUILD2")
-DISCORD_GUILD_ID = discord.Object(id=os.getenv("DISCORD_GUILD_ID2"))
+#Optional development guild, commands are synced there instantly on top of the global sync
+DISCORD_GUILD_ID = discord.Object(id=int(os.getenv("DISCORD_GUILD_ID2"))) if os.getenv("DISCORD_GUILD_ID2") else None
+#Single allowed channel of the old one-guild setup, used when there is no channel file
 VALID_CHANNEL_ID = os.getenv("VALID_CHANNEL_ID2")
 
+#Sharding, unset lets Discord recommend a shard count
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+
+#Per-guild allowed channels, reloaded when the file changes
+CHANNEL_CONFIG_PATH = os.getenv("CHANNEL_CONFIG_PATH","channels.json")
+CHANNEL_RELOAD_INTERVAL = float(os.getenv("CHANNEL_RELOAD_INTERVAL",10))
+
+#Point the HTTP client and gateway at a local fake Discord, see finfacfoe_fakegateway.py
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE")
+if DISCORD_API_BASE:
+    discord.http.Route.BASE = DISCORD_API_BASE
+
+#Command tree fingerprints of the last successful sync, FORCE_COMMAND_SYNC=1 syncs regardless
+COMMAND_SYNC_STATE = os.getenv("COMMAND_SYNC_STATE","finfacfoe_sync.json")
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC","0") == "1"
+
+#Running game limits
+MAX_GAMES_PER_GUILD = int(os.getenv("MAX_GAMES_PER_GUILD",100))
+MAX_GAMES_PER_USER = int(os.getenv("MAX_GAMES_PER_USER",3))
+GAME_IDLE_TTL = float(os.getenv("GAME_IDLE_TTL",600))
+
+#Local Prometheus endpoint, METRICS_PORT=0 turns it off
+METRICS_HOST = os.getenv("METRICS_HOST","127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT",9108))
+
+#In-flight game persistence
+GAME_STORE_PATH = os.getenv("GAME_STORE_PATH","finfacfoe_games.db")
+
+#Append-only log of finished games, see finfacfoe_movelog.py, empty turns it off
+MOVE_LOG_PATH = os.getenv("MOVE_LOG_PATH","finfacfoe_moves.fml")
+
+#Per-role Elo ratings behind /leaderboard
+RATINGS_PATH = os.getenv("RATINGS_PATH","finfacfoe_ratings.db")
+
+#Largest board /fin offers, boards past 5x5 take four messages per player, never past core.MAX_SIZE
+MAX_BOARD_SIZE = min(int(os.getenv("MAX_BOARD_SIZE",10)),core.MAX_SIZE)
+
+#Tournament games running at once per channel and over every tournament
+TOURNAMENT_MAX_PER_CHANNEL = int(os.getenv("TOURNAMENT_MAX_PER_CHANNEL",5))
+TOURNAMENT_MAX_GAMES = int(os.getenv("TOURNAMENT_MAX_GAMES",50))
+
+#AI opponent of /finbot, search processes (one per core by default) and seconds per move
+AI_WORKERS = int(os.getenv("AI_WORKERS")) if os.getenv("AI_WORKERS") else None
+AI_MOVE_BUDGET = float(os.getenv("AI_MOVE_BUDGET",1.0))
+#Perfect-play table the bot reads its 3x3 boardmaster moves from, solved on first start if missing
+SOLVED_TABLE_PATH = os.getenv("SOLVED_TABLE_PATH","finfacfoe_solved.bin")
+
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 intents.reactions = True
 
-#inherited commands.Bot class to include setup_hook to sync bot's commands to the server
-class BotClass(commands.Bot):
-    def __init__(self,*,command_prefix,intents: discord.Intents):
-        super().__init__(command_prefix=commands.when_mentioned_or(command_prefix),intents=intents)
+#inherited commands.AutoShardedBot class to include setup_hook to sync bot's commands
+class BotClass(commands.AutoShardedBot):
+    def __init__(self,*,command_prefix,intents: discord.Intents,shard_count=None):
+        super().__init__(command_prefix=commands.when_mentioned_or(command_prefix),intents=intents,shard_count=shard_count)
+        self.metrics_runner = None
+        self.loop_watcher = None
+        self.solved_table = None
 
     async def setup_hook(self):
-        self.tree.copy_global_to(guild=DISCORD_GUILD_ID)
-        await self.tree.sync(guild=DISCORD_GUILD_ID)
+        startup.mark("login")
+        if METRICS_PORT:
+            self.metrics_runner = await metrics.start_server(METRICS_HOST,METRICS_PORT)
+            self.loop_watcher = asyncio.create_task(metrics.watch_event_loop())
+        sessions.start()
+        await store.open()
+        await ratings.open()
+        if move_log is not None:
+            await move_log.open()
+        ai_pool.start()
+        if SOLVED_TABLE_PATH:
+            #memory-mapped, a few kilobytes solved in well under a second when the file is missing
+            self.solved_table = await asyncio.to_thread(open_table,SOLVED_TABLE_PATH)
+        #Stored games nobody clicks again within the idle TTL are dropped
+        store.expire_dormant(time.time()-GAME_IDLE_TTL)
+        self.loop.call_later(GAME_IDLE_TTL,store.expire_dormant,time.time())
+        channel_config.reload(force=True)
+        reload_channel_config.start()
+        startup.mark("setup")
+        synced = await self.sync_commands()
+        startup.mark("sync",f"synced {', '.join(synced)}" if synced else "unchanged, skipped")
+
+    async def sync_commands(self):
+        #Upload the command tree only for scopes whose fingerprint changed since the last sync
+        sync_state = SyncState(COMMAND_SYNC_STATE)
+        scopes = [None]
+        if DISCORD_GUILD_ID is not None:
+            self.tree.copy_global_to(guild=DISCORD_GUILD_ID)
+            scopes.append(DISCORD_GUILD_ID)
+        synced = []
+        for guild in scopes:
+            fingerprint = tree_fingerprint(self.tree,guild)
+            scope = sync_state.scope(self.application_id,guild)
+            if not FORCE_COMMAND_SYNC and sync_state.is_current(scope,fingerprint):
+                continue
+            await self.tree.sync(guild=guild)
+            sync_state.record(scope,fingerprint)
+            synced.append("global" if guild is None else f"guild {guild.id}")
+        return synced
+
+    async def before_identify_hook(self,shard_id,*,initial=False):
+        #The fake gateway has no identify rate limit to respect
+        if DISCORD_API_BASE:
+            return
+        await super().before_identify_hook(shard_id,initial=initial)
+
+    def dispatch(self,event_name,/,*args,**kwargs):
+        #Runs synchronously while the gateway event is parsed, so a stored game is back
+        #in the view store before the next click on it arrives
+        if event_name == "interaction":
+            #response times are measured from here
+            args[0].extras["received"] = time.perf_counter()
+            resume_stored_game(args[0])
+        super().dispatch(event_name,*args,**kwargs)
+
+    async def close(self):
+        await store.close()
+        await ratings.close()
+        if move_log is not None:
+            await move_log.close()
+        ai_pool.shutdown()
+        if self.solved_table is not None:
+            self.solved_table.close()
+            self.solved_table = None
+        if self.loop_watcher is not None:
+            self.loop_watcher.cancel()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+
+#running games, keyed by channel and player pair
+sessions = SessionManager(max_per_guild=MAX_GAMES_PER_GUILD,max_per_user=MAX_GAMES_PER_USER,idle_ttl=GAME_IDLE_TTL)
+
+#running games by game id and by board message id, and their write-behind store
+live_games = {}
+live_messages = {}
+store = GameStore(GAME_STORE_PATH)
+move_log = MoveLog(MOVE_LOG_PATH) if MOVE_LOG_PATH else None
+
+#searches for the AI's moves, see finfacfoe_ai.py
+ai_pool = AIPool(AI_WORKERS,AI_MOVE_BUDGET)
+metrics.REGISTRY.gauge("finfacfoe_ai_searches_pending","AI moves asked for and not answered yet",lambda: ai_pool.pending)
+
+metrics.REGISTRY.gauge("finfacfoe_active_games","Running games",lambda: len(sessions))
+metrics.REGISTRY.gauge("finfacfoe_rate_limit_buckets","Edit rate limit buckets held, idle ones are dropped",lambda: len(BUCKETS))
+metrics.REGISTRY.gauge("finfacfoe_dormant_games","Stored games not resumed since the restart",lambda: len(store.dormant))
+metrics.REGISTRY.gauge("finfacfoe_store_pending_writes","Games waiting for the next store flush",lambda: len(store.dirty))
+
+#ratings of every player, rated once a game ends
+ratings = RatingBook(RATINGS_PATH)
+metrics.REGISTRY.gauge("finfacfoe_rated_players","Players with a rating in either role",lambda: len(ratings["challenger"])+len(ratings["boardmaster"]))
+metrics.REGISTRY.gauge("finfacfoe_ratings_pending_writes","Rated games waiting for the next flush",lambda: len(ratings.pending))
+if move_log is not None:
+    metrics.REGISTRY.gauge("finfacfoe_move_log_pending","Finished games waiting for the next move log append",lambda: len(move_log.pending))
+
+#allowed channels per guild
+channel_config = ChannelConfig(CHANNEL_CONFIG_PATH)
+if DISCORD_GUILD_ID is not None and VALID_CHANNEL_ID:
+    channel_config.guilds = {DISCORD_GUILD_ID.id: frozenset({int(VALID_CHANNEL_ID)})}
+
+@tasks.loop(seconds=CHANNEL_RELOAD_INTERVAL)
+async def reload_channel_config():
+    channel_config.reload()
 
 #discord client created using commands extension
-client = BotClass(command_prefix = "h!", intents = intents)
+client = BotClass(command_prefix = "h!", intents = intents, shard_count = SHARD_COUNT)
+
+@client.event
+async def on_shard_ready(shard_id):
+    logging.info(f"Shard {shard_id} ready")
 
 @client.event
 async def on_ready():
     print(f'{client.user} has connected to Discord!')
+
+    #on_ready fires again after reconnects, only the first one is startup
+    if not startup.reported:
+        startup.mark("ready")
+        startup.reported = True
+        logging.info(startup.report())
+        #build the rule table now instead of on the first move
+        rules.get_table()
     
-    guild = discord.utils.get(client.guilds, name = DISCORD_GUILD)
-    
-    print(f"{client.user} is connected to: \n", f"{guild.name}(id: {guild.id})")
+    print(f"{client.user} is connected to {len(client.guilds)} guilds over {client.shard_count} shards")
     
     print("\n \n \n -------------")
 
 #------------------------------
 
-class FinFacFoeGame():
-    #CONSTANTS
-    X = -1 #Challenger
-    O = 1 #Boardmaster
-    TIE = 2
-    CONTINUE = 0
-    STATES = Enum("TRAP STATES",["FREE","FIXED","COL","ROW"])
-    CHECK = Enum("LINE CHECK",["ANY","COL","ROW"])
+def observe_first_response(interaction,kind):
+    #Time from the gateway event to the first response, Discord drops interactions left over 3 seconds
+    received = interaction.extras.get("received")
+    if received is None:
+        return
+    elapsed = time.perf_counter()-received
+    metrics.FIRST_RESPONSE.labels(kind).observe(elapsed)
+    if elapsed > 3.0:
+        metrics.DEADLINE_MISSED.labels(kind).inc()
+
+def observe_handled(interaction,kind):
+    received = interaction.extras.get("received")
+    if received is not None:
+        metrics.CALLBACK.labels(kind).observe(time.perf_counter()-received)
+
+#------------------------------
+
+class FinFacFoeGame(FinFacFoeState):
+
+    def __init__(self,player_challenger: discord.Member,player_boardmaster: discord.Member,game_id=None,guild_id=None,channel_id=None,application_id=None,token=None,size=core.SIZE,win_length=core.SIZE):
+        super().__init__(size,win_length)
+
+        #Identity, also what the store needs to re-attach to the messages after a restart
+        self.game_id = game_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.application_id = application_id
+        self.token = token
 
-    def __init__(self,player_challenger: discord.Member,player_boardmaster: discord.Member):
         #Public references
         self.public_view = None
         self.public_msg = None
@@ -68,6 +273,12 @@ class FinFacFoeGame():
         self.private_view = None
         self.private_msg = None
 
+        #Boards past 5x5 are split into tiles, the references above are the first tile and
+        #carry the status line, these are (view, message) of the other tiles
+        self.tiles = board_tiles(size)
+        self.public_tiles = []
+        self.private_tiles = []
+
         #win flag
         self.win_flag = False
 
@@ -75,243 +286,124 @@ class FinFacFoeGame():
         self.boardmaster = player_boardmaster
         self.challenger = player_challenger
 
-        #Board
-        self.board = [
-            [0, 0, 0],
-            [0, 0, 0],
-            [0, 0, 0],
-        ]
+        #Message edits for this game
+        self.edits = EditScheduler()
 
-        #Piece counter
-        self.count = 0
+        #Registry entry, set by SessionManager.open
+        self.session = None
 
-        #Current player
-        self.current_player = self.X
+        #O cells the challenger has found by clicking them
+        self.revealed = 0
 
-        #Col/Row locks
-        self.c = None
-        self.r = None
+        #Set once the game is over or expired, the boards then render disabled
+        self.finished = False
 
-        #Record current input coords
-        self.x = None
-        self.y = None
+        #Structured logger carrying this game's trace id
+        self.log = game_logger(game_id)
 
-        #Boardmaster current trap state
-        self.bm_state = self.STATES.FREE
-    
-    def get_current_turn(self):
-        return math.floor(self.count*0.5)+1
+        #Tournament match this game is a leg of, and the line naming it above the status
+        self.match = None
+        self.header = ""
+
+        #Piece the bot plays in a /finbot game, and the task playing its turn
+        self.ai_piece = None
+        self.ai_task = None
 
     def get_boardmaster_text(self):
-        return f"[O] {self.boardmaster.mention}\n"
+        return f"{self.header}[O] {self.boardmaster.mention}\n"
     
     def get_challenger_text(self):
-        return f"[X] {self.challenger.mention}\n"
-    
-    def save_input(self,x,y):
-        self.x = x
-        self.y = y
-    
-    def transfer_turn_to(self,piece):
-        self.count +=1
-        self.current_player = piece
-
-    def check_rule(self):
-        #Assume position is unoccupied
-
-        #Challenger turn
-        if self.current_player == self.X:
-            #first turn for Challenger
-            if self.count == 0:
-                logging.info("First X turn")    
-                if self.x == 1 and self.y == 1:
-                    #Invalid move
-                    logging.info("First X move must not be in center")
-                    return False
-                else:
-                    #No restriction in other places
-                    logging.info("Valid X move")
-                    return True
-            #any other turn
-            else:
-                #All places are valid as long as not occupied
-                logging.info("X moves are always valid after first turn if position is unoccupied")
-                return True
-        #Boardmaster turn
-        else:
-            if self.is_valid_bm_move():
-                return True
-            else:
-                return False
-
-    def is_valid_bm_move(self):
-        #first turn for BM, second turn overall
-        if self.count == 1:
-            logging.info("First O turn")
-            #Check if placed on middle
-            if self.x == 1 and self.y == 1:
-                #Invalid move
-                logging.info("First O move must not be in center")
-                return False 
-            else:
-                #lock bm
-                self.c = self.x
-                self.r = self.y
-                self.bm_state = self.STATES.FIXED
-                logging.info("Valid Free O move; state now FIXED")
-                return True
-        #Any other turn
+        return f"{self.header}[X] {self.challenger.mention}\n"
+
+    def boards(self):
+        #(view, message) of every board message, public first
+        return [(self.public_view,self.public_msg),*self.public_tiles,(self.private_view,self.private_msg),*self.private_tiles]
+
+    def disable_view(self):
+        #Both boards render every button disabled from now on
+        self.finished = True
+        self.log.debug("All views stopped")
+        for view, msg in self.boards():
+            if view is not None:
+                view.stop()
+
+    def refresh_tiles(self):
+        #Queue edits for the other tiles whose render changed since they were last sent
+        for view, msg in self.public_tiles+self.private_tiles:
+            if render_key(self,view.is_visible,view.tile) != view.sent_key:
+                self.edits.schedule(msg,view=view)
+
+    def play(self,piece,x,y):
+        #Timed and counted engine transition
+        start = time.perf_counter()
+        outcome = super().play(piece,x,y)
+        metrics.RULE_CHECK.observe(time.perf_counter()-start)
+        if outcome == MOVE.PLACED:
+            metrics.MOVES.labels("X" if piece == self.X else "O").inc()
+            metrics.MOVE_RATE.mark()
         else:
-            logging.info("Other O turn")
-            match self.bm_state:
-                #BM freely can place in the remaining spaces
-                case self.STATES.FREE:
-                    self.c = self.x
-                    self.r = self.y
-                    self.bm_state = self.STATES.FIXED
-                    logging.info("Valid Free O move; state now FIXED")
-                    return True
-
-                #BM will be fixed to an axis
-                case self.STATES.FIXED:
-                    if self.is_moves_available(self.CHECK.ANY):
-                        #BM gets fixed to an axis
-                        if self.c == self.x:
-                            self.bm_state = self.STATES.COL
-                            logging.info("Valid Fixed O move; state now COL")
-                            return True
-                        elif self.r == self.y:
-                            self.bm_state = self.STATES.ROW
-                            logging.info("Valid Fixed O move; state now ROW")
-                            return True
-                        #Violated rule
-                        else:
-                            logging.info("Invalid Fixed O move")
-                            return False
-                    #No available move, make BM free
-                    else:
-                        self.bm_state = self.STATES.FREE
-                        logging.info("Valid Released O move; state now FREE")
-                        return True
-
-                case self.STATES.COL:
-                    if self.is_moves_available(self.CHECK.COL):
-                        #If position escaped the saved column
-                        if self.x != self.c:
-                            logging.info("Invalid COL O move")
-                            return False
-                        else:
-                            logging.info("Valid COL O move; state remains COL")
-                            return True
-                    #No available move, make BM free
-                    else:
-                        logging.info("Valid Released O move; state now FREE")
-                        self.bm_state = self.STATES.FREE
-                        return True
-                
-                case self.STATES.ROW:
-                    if self.is_moves_available(self.CHECK.ROW):
-                        #If position escaped the saved row
-                        if self.y != self.r:
-                            logging.info("Invalid ROW O move")
-                            return False
-                        else:
-                            logging.info("Valid ROW O move; state remains ROW")
-                            return True
-                    #No available move, make BM free
-                    else:
-                        self.bm_state = self.STATES.FREE
-                        logging.info("Valid Released O move; state now FREE")
-                        return True
-
-        return False
-
-    def is_moves_available(self,check_axis):
-
-        board_array = np.array(self.board)
-
-        match check_axis:
-            case self.CHECK.ANY:
-                if 0 in board_array:
-                    return True
-                else:
-                    return False
-            case self.CHECK.COL:
-                if 0 in board_array[:,self.c]:
-                    return True
-                else:
-                    return False
-            case self.CHECK.ROW:
-                if 0 in board_array[self.r,:]:
-                    return True
-                else:
-                    return False
-
-    def is_won(self):
-        board_array = np.array(self.board)
-        #check horizontals
-        if 3 in np.sum(board_array,1):
-            return self.O
-        elif -3 in np.sum(board_array,1):
-            return self.X
-        #check verticals
-        if 3 in np.sum(board_array,0):
-            return self.O
-        elif -3 in np.sum(board_array,0):
-            return self.X
-        #check \ diagonal
-        if np.trace(board_array) == 3:
-            return self.O
-        elif np.trace(board_array) == -3:
-            return self.X
-        #check / diagonal
-        if np.trace(np.rot90(board_array)) == 3:
-            return self.O
-        elif np.trace(np.rot90(board_array)) == -3:
-            return self.X
-        #check tie
-        if not 0 in board_array:
-            return self.TIE
-        
-        #game continues
-        return self.CONTINUE
+            metrics.REJECTED.labels(outcome.name).inc()
+        return outcome
+
+    def message_of(self,view):
+        return next(msg for board_view, msg in self.boards() if board_view is view)
+
+    def queue_response(self,input,reply,**kwargs):
+        #Board edits answering a click, the clicked message is edited through the click's token
+        #A click on another tile re-renders that tile and the first tile is edited separately
+        if input.view is self.public_view or input.view is self.private_view:
+            self.edits.schedule(self.message_of(input.view),reply,**kwargs)
+            return
+        self.edits.schedule(self.message_of(input.view),reply,view=input.view)
+        self.edits.schedule(self.public_msg if input.view.is_visible else self.private_msg,**kwargs)
+
+    def schedule_result(self):
+        #Queue the end of game texts once a move finished the game
+        self.log.debug("Checking Win condition")
+        match self.result:
+            case self.CONTINUE:
+                self.log.debug("Continue game")
+                pass
+            case self.X:
+                self.log.info("X wins")
+                self.disable_view()
+
+                self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> ✨ You win ✨", view=self.public_view)
+                self.edits.schedule(self.private_msg,content=f"{self.get_boardmaster_text()}> [X] wins", view=self.private_view)
 
-    def update_board(self):
-        self.board[self.y][self.x] = self.current_player
+                pass
+            case self.O:
+                self.log.info("O wins")
+                self.disable_view()
 
-    def button_to_index(self,x,y):
-        return x*3+y
+                self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> [O] wins", view=self.public_view)
+                self.edits.schedule(self.private_msg,content=f"{self.get_boardmaster_text()}> ✨ You win ✨", view=self.private_view)
 
-    def disable_view(self):
-        logging.info("Disabling public buttons")
-        for button in self.public_view.children:
-            button.disabled = True
-
-        logging.info("Disabling private buttons")
-        for button in self.private_view.children:
-            button.disabled = True
-
-        logging.info("All views stopped")
-        self.public_view.stop()
-        self.private_view.stop()
-
-    def debug_board(self):
-        output_board = self.board
-        def replacer(elm):
-            if elm == self.X:
-                return "X"
-            elif elm == self.O:
-                return "O"
-            else:
-                return " "
-        output_board = [[replacer(elm) for elm in row] for row in output_board]
+                pass
+            case self.TIE:
+                self.log.info("TIE")
+                self.disable_view()
 
-        output = f"{output_board[0]}\n{output_board[1]}\n{output_board[2]}"
-        return output
+                self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> 🎈 TIE", view=self.public_view)
+                self.edits.schedule(self.private_msg,content=f"{self.get_boardmaster_text()}> 🎈 TIE", view=self.private_view)
 
-    async def on_update(self,input,interaction:discord.Interaction):
+    def on_expire(self):
+        #Called by the session manager under the game lock once the game has been idle past its TTL
+        #Returns the flush of the closing edits, which the manager awaits after releasing the lock
+        metrics.GAMES_FINISHED.labels("expired").inc()
+        end_game(self)
+        self.disable_view()
+        self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> ⌛ Game expired",view=self.public_view)
+        self.edits.schedule(self.private_msg,content=f"{self.get_boardmaster_text()}> ⌛ Game expired",view=self.private_view)
+        self.refresh_tiles()
+        return self.edits.flush()
 
-        logging.info(f"\nCurrent Player: {self.current_player}\nCurrent Count: {self.count}\nCurrent Board:\n{self.board}\nCurrent Inputted Button Coords: {input.x},{input.y}\nCurrent BM State: {self.bm_state}\nCurrent C R: {self.c},{self.r}\nCurrent View Used {'PUBLIC' if input.view.is_visible else 'PRIVATE'}\n\n")
+    def on_update(self,input,interaction:discord.Interaction):
+        #Play one click under the game lock without awaiting anything, returns the ClickReply
+        #that acknowledges it. The board edits are queued and sent after the acknowledgement
+        reply = ClickReply(interaction,self.message_of(input.view))
+
+        self.log.debug("Click %s,%s on %s view, player %s, count %s, BM state %s, C R %s,%s",input.x,input.y,"PUBLIC" if input.view.is_visible else "PRIVATE",self.current_player,self.count,self.bm_state,self.c,self.r)
 
         """
         if no winner (assume no winner if still clickable and receives callback)
@@ -335,101 +427,73 @@ class FinFacFoeGame():
 
         #PUBLIC
         if input.view.is_visible:
+            #PUBLIC should only be to challenger member, anyone else's click must not find a hidden O
+            if not self.challenger == interaction.user:
+                self.log.debug("silently ignore invalid player")
+                metrics.REJECTED.labels("WRONG_PLAYER").inc()
+                return reply.reject(f"This is not your board {interaction.user.mention} ⛔")
+
             #Check if button is clickable
-            button_state = self.board[input.y][input.x]
+            outcome = self.precheck(self.X,input.x,input.y)
             #Check if position is occupied
-            if button_state in (self.X,self.O):
+            if outcome == MOVE.OCCUPIED:
+                metrics.REJECTED.labels(outcome.name).inc()
+                self.revealed |= self.geometry.cell_bit(input.x,input.y)
                 content = f"{self.get_challenger_text()}> Occupied spot. Try again. ⛔"
-                self.public_view.children[self.button_to_index(input.x,input.y)].style = discord.ButtonStyle.gray
-                await interaction.response.edit_message(content=content, view=self.public_view)
-                return
+                self.queue_response(input,reply,content=content, view=self.public_view)
+                return reply
 
             #PUBLIC should only be for X
-            if self.current_player != self.X:
-                logging.info("silently ignore invalid turn")
-                content = f"{self.get_challenger_text()}> Not your turn ⏳"
-                await interaction.response.edit_message(content=content)
-                return
-            #PUBLIC should only be to challenger member
-            if not self.challenger == interaction.user:
-                logging.info("silently ignore invalid player")
-                await interaction.response.send_message(f"This is not your board {interaction.user.mention} ⛔", ephemeral=True,delete_after=3)
-                return
+            if outcome == MOVE.NOT_TURN:
+                metrics.REJECTED.labels(outcome.name).inc()
+                self.log.debug("silently ignore invalid turn")
+                return reply.reject("Not your turn ⏳")
 
-            #Save input
-            self.save_input(input.x,input.y)
+            #Check rules and play the move
+            self.log.debug("Checking rules")
+            if self.play(self.X,input.x,input.y) == MOVE.PLACED:
+                self.log.debug("Rule passed")
+                self.log.debug("Transfering turn to %s",self.O)
 
-            #Check rules
-            logging.info("Checking rules")
-            if self.check_rule():
-                logging.info("Rule passed")
-                self.update_board()
-                logging.info("Board updated")
-                self.transfer_turn_to(self.O)
-                logging.info(f"Transfering turn to {self.O}")
+                #Both views render from the board, the two edits go out concurrently
+                self.edits.schedule(self.private_msg,content = f"{self.get_boardmaster_text()}> It is [O] your turn ✅✅✅", view=self.private_view)
+                self.queue_response(input,reply,content=f"{self.get_challenger_text()}> It is [O]'s Turn ⏳",view=self.public_view)
 
-                index = self.button_to_index(self.x,self.y)
-
-                #Update Public View
-                self.public_view.children[index].style = discord.ButtonStyle.danger
-                self.public_view.children[index].label = "X"
-                self.public_view.children[index].disabled = True
-                await interaction.response.edit_message(content=f"{self.get_challenger_text()}> It is [O]'s Turn ⏳",view=self.public_view)
-
-                #Update Private View
-                self.private_view.children[index].style = discord.ButtonStyle.danger
-                self.private_view.children[index].label = "X"
-                self.private_view.children[index].disabled = True
-                await self.private_msg.edit(content = f"{self.get_boardmaster_text()}> It is [O] your turn ✅✅✅", view=self.private_view)
-
-                logging.info("UI updated")
+                self.log.debug("UI updated")
 
             else:
-                logging.info("Rule failed")
+                self.log.debug("Rule failed")
                 #only rule broken is no piece in middle at first turn
-                content = f"{self.get_challenger_text()}> Center position is prohibited on first turn. Try again. ⛔"
-                await interaction.response.edit_message(content=content)
-                return
+                return reply.reject("Center position is prohibited on first turn. Try again. ⛔")
 
         #PRIVATE
         else:
             #Occupied button already disabled
 
-            #PRIVATE should only be for O
-            if self.current_player != self.O:
-                logging.info("silently ignore invalid turn")
-                content = f"{self.get_challenger_text()}> Not your turn ⏳"
-                await interaction.response.edit_message(content=content)
-                return
             #PRIVATE is only visible to boardmaster
+            #Check rules and play the move
+            self.log.debug("Checking rules")
+            outcome = self.play(self.O,input.x,input.y)
 
-            #Save input
-            self.save_input(input.x,input.y)
-
-            #Check rules
-            logging.info("Checking rules")
-            if self.check_rule():
-                logging.info("Rule passed")
-                self.update_board()
-                logging.info("Board updated")
-                self.transfer_turn_to(self.X)
-                logging.info(f"Transfering turn to {self.X}")
-
-                index = self.button_to_index(self.x,self.y)
+            #PRIVATE should only be for O
+            if outcome == MOVE.NOT_TURN:
+                self.log.debug("silently ignore invalid turn")
+                return reply.reject("Not your turn ⏳")
 
-                #Update Public View
-                await self.public_msg.edit(content=f"{self.get_challenger_text()}> It is [X] your Turn ✅✅✅",view=self.public_view)
+            if outcome == MOVE.PLACED:
+                self.log.debug("Rule passed")
+                self.log.debug("Transfering turn to %s",self.X)
 
-                #Update Private View
-                self.private_view.children[index].style = discord.ButtonStyle.success
-                self.private_view.children[index].label = "O"
-                self.private_view.children[index].disabled = True
-                await interaction.response.edit_message(content = f"{self.get_boardmaster_text()}> It is [X]'s turn ⏳", view=self.private_view)
+                #Both views render from the board, the two edits go out concurrently
+                self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> It is [X] your Turn ✅✅✅",view=self.public_view)
+                self.queue_response(input,reply,content = f"{self.get_boardmaster_text()}> It is [X]'s turn ⏳", view=self.private_view)
 
-                logging.info("UI updated")
+                self.log.debug("UI updated")
 
             else:
-                logging.info("Rule failed")
+                self.log.debug("Rule failed")
+                if outcome == MOVE.CENTER:
+                    return reply.reject("Center position is prohibited on first turn. Try again. ⛔")
                 match self.bm_state:
                     case self.STATES.COL:
                         locked = "COL LOCKED"
@@ -437,109 +501,517 @@ class FinFacFoeGame():
                     case self.STATES.ROW:
                         locked = "ROW LOCKED"
                         locked2 = "horizontally ↔"
-                    case self.STATES.FIXED:
+                    case _:
                         locked = "AXIS LOCKED"
                         locked2 = "perpendiculary ➕"
-                    case self.STATES.FREE:
-                        content = f"{self.get_boardmaster_text()}> Center position is prohibited on first turn. Try again. ⛔"
-                        await interaction.response.edit_message(content=content)
-                        return
-                content = f"{self.get_boardmaster_text()}> You are {locked}. Stay {locked2}. Try again. ⛔"
-                await interaction.response.edit_message(content=content)
-                return
+                return reply.reject(f"You are {locked}. Stay {locked2}. Try again. ⛔")
         
         #check if winner
-        logging.info("Checking Win condition")
-        match self.is_won():
-            case self.CONTINUE:
-                logging.info("Continue game")
-                pass
-            case self.X:
-                logging.info("X wins")
-                self.disable_view()
-
-                await asyncio.sleep(0.5)
-
-                await self.public_msg.edit(content=f"{self.get_challenger_text()}> ✨ You win ✨", view=self.private_view)
-                await self.private_msg.edit(content=f"{self.get_boardmaster_text()}> [X] wins", view=self.private_view)
-                
-                pass
-            case self.O:
-                logging.info("O wins")
-                self.disable_view()
-
-                await asyncio.sleep(0.5)
-
-                await self.public_msg.edit(content=f"{self.get_challenger_text()}> [O] wins", view=self.private_view)
-                await self.private_msg.edit(content=f"{self.get_boardmaster_text()}> ✨ You win ✨", view=self.private_view)
-
-                pass
-            case self.TIE:
-                logging.info("TIE")
-                self.disable_view()
-
-                await asyncio.sleep(0.5)
-
-                await self.public_msg.edit(content=f"{self.get_challenger_text()}> 🎈 TIE", view=self.private_view)
-                await self.private_msg.edit(content=f"{self.get_boardmaster_text()}> 🎈 TIE", view=self.private_view)
-        
-        logging.info(f"\n{self.debug_board()}\n")
-
-        logging.info("---end of update function---\n\n")
+        self.schedule_result()
+
+        #The queued edits are merged, ordered and paced by the scheduler in the background
+        self.refresh_tiles()
+
+        self.log.debug("Board after move %s\n%s",self.count,Lazy(format_board,self.core.x_mask,self.core.o_mask,self.geometry.size))
+
+        self.log.debug("---end of update function---")
+        return reply
+
+    def start_ai_turn(self):
+        #Let the bot play if it is its turn, the search runs in the AI pool without holding the game lock
+        if self.ai_piece is None or self.current_player != self.ai_piece or self.finished:
+            return
+        if self.ai_task is None or self.ai_task.done():
+            self.ai_task = asyncio.create_task(self.ai_turn())
+
+    def solved_move(self):
+        #The boardmaster sees the whole board, so on 3x3 its perfect move is read from the solved table
+        if client.solved_table is None or self.ai_piece != self.O or not self.is_classic:
+            return None
+        value, move = client.solved_table.lookup_game(self)
+        return move
+
+    async def ai_turn(self):
+        while self.current_player == self.ai_piece and not self.finished:
+            try:
+                x, y = self.solved_move() or await ai_pool.choose_move(observe(self,self.ai_piece))
+            except Exception:
+                self.log.exception("AI search failed")
+                return
+            async with self.session.lock:
+                if self.finished or self.current_player != self.ai_piece:
+                    return
+                sessions.touch(self.session)
+                outcome = self.play(self.ai_piece,x,y)
+                if outcome == MOVE.OCCUPIED:
+                    #a hidden O, the AI challenger knows it from now on and searches again
+                    #The public board shows the find as it does for a human challenger
+                    self.revealed |= self.geometry.cell_bit(x,y)
+                    self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> Occupied spot. Try again. ⛔",view=self.public_view)
+                    self.refresh_tiles()
+                    continue
+                if outcome != MOVE.PLACED:
+                    self.log.warning("AI move %s,%s rejected: %s",x,y,outcome.name)
+                    return
+                self.log.debug("AI placed %s,%s",x,y)
+
+                if self.ai_piece == self.X:
+                    self.edits.schedule(self.private_msg,content=f"{self.get_boardmaster_text()}> It is [O] your turn ✅✅✅",view=self.private_view)
+                    self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> It is [O]'s Turn ⏳",view=self.public_view)
+                else:
+                    self.edits.schedule(self.public_msg,content=f"{self.get_challenger_text()}> It is [X] your Turn ✅✅✅",view=self.public_view)
+                    self.edits.schedule(self.private_msg,content=f"{self.get_boardmaster_text()}> It is [X]'s turn ⏳",view=self.private_view)
+                self.schedule_result()
+                self.refresh_tiles()
+                settle_game(self)
 
 #------------------------        
 
 #UI view
 class FinFacFoeView(discord.ui.View):
 
-    def __init__(self,gamestate,is_visible):
-        super().__init__()
+    def __init__(self,gamestate,is_visible,tile=None):
+        #no discord.py timeout, idle games are evicted by the session manager
+        super().__init__(timeout=None)
         self.is_visible = is_visible
         self.gamestate: FinFacFoeGame = gamestate
 
+        #(x0, y0, width, height) of the board cells on this message
+        self.tile = gamestate.tiles[0] if tile is None else tile
+        #render key of the last payload built for this view
+        self.sent_key = None
+
         #populate the view with buttons
-        for x in range(3):
-            for y in range(3):
-                self.add_item(FinFacFoeButton(x, y))
+        #custom ids are the same in every game, discord.py finds the view by message id
+        x0, y0, width, height = self.tile
+        for x in range(x0,x0+width):
+            for y in range(y0,y0+height):
+                self.add_item(FinFacFoeButton(x, y, render_custom_id(is_visible,x,y), row=y-y0))
+
+    def button_at(self,x,y):
+        x0, y0, width, height = self.tile
+        return self.children[(x-x0)*height+y-y0]
+
+    def to_components(self):
+        #The buttons only route clicks, what is sent is rendered from the game state
+        self.sent_key = render_key(self.gamestate,self.is_visible,self.tile)
+        return render_rows(self.sent_key)
 
 #Button
 class FinFacFoeButton(discord.ui.Button):
-    def __init__(self, x: int, y: int):
-        super().__init__(style=discord.ButtonStyle.blurple, label='\u200b', row=y)
+    def __init__(self, x: int, y: int, custom_id=None, row=None):
+        super().__init__(style=discord.ButtonStyle.blurple, label='\u200b', row=y if row is None else row, custom_id=custom_id)
         self.x = x
         self.y = y
     
     async def callback(self, interaction: discord.Interaction):
         assert self.view is not None
         view: FinFacFoeView = self.view
-        logging.info(f"Receiving interaction from {interaction.user.display_name}")
-        #let gamestate class handle the logic
-        await view.gamestate.on_update(self,interaction)
+        view.gamestate.log.debug("Receiving interaction from %s",interaction.user.id)
+        gamestate = view.gamestate
+        session = gamestate.session
+        #one click at a time per game
+        waiting = time.perf_counter()
+        async with session.lock:
+            metrics.LOCK_WAIT.observe(time.perf_counter()-waiting)
+            sessions.touch(session)
+            #let gamestate class handle the logic, nothing in it awaits
+            reply = gamestate.on_update(self,interaction)
+            settle_game(gamestate)
+        #acknowledged before any board edit is sent, however slow those are
+        await reply.send()
+        observe_first_response(interaction,"button")
+        gamestate.start_ai_turn()
+        observe_handled(interaction,"button")
+
+#------------------------------
+
+class StoredMember():
+    #Stand-in for a player of a resumed game who is not in the member cache
+    def __init__(self,id):
+        self.id = id
+        self.mention = f"<@{id}>"
+        self.display_name = self.mention
+
+    def __eq__(self,other):
+        return getattr(other,"id",None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class WebhookMessageRef():
+    #Editable handle on an interaction followup, rebuilt from the interaction token
+    #Discord only honours the token for 15 minutes after the /fin command
+    def __init__(self,webhook,id):
+        self.webhook = webhook
+        self.id = id
+
+    async def edit(self,**kwargs):
+        return await self.webhook.edit_message(self.id,**kwargs)
+
+def track_messages(gamestate):
+    for view, msg in gamestate.boards():
+        if msg is not None:
+            live_messages[msg.id] = gamestate
+
+def settle_game(gamestate):
+    #After a move: close the game once it is over, otherwise queue it for the store
+    if gamestate.result != gamestate.CONTINUE:
+        metrics.GAMES_FINISHED.labels({gamestate.X: "X",gamestate.O: "O",gamestate.TIE: "TIE"}[gamestate.result]).inc()
+        #expired games are not rated
+        ratings.record(gamestate.challenger.id,gamestate.boardmaster.id,gamestate.result)
+        sessions.close(gamestate.session)
+        end_game(gamestate)
+    elif gamestate.match is None:
+        #tournaments live in memory, their games are not stored either
+        store.mark_dirty(gamestate)
+
+def end_game(gamestate):
+    live_games.pop(gamestate.game_id,None)
+    if move_log is not None:
+        move_log.record(gamestate)
+    if gamestate.match is not None:
+        match, gamestate.match = gamestate.match, None
+        tournament_scheduler.game_over(match,leg_winner(gamestate))
+        if match.tournament.finished and tournaments.get(match.tournament.guild_id) is match.tournament:
+            del tournaments[match.tournament.guild_id]
+    for view, msg in gamestate.boards():
+        if msg is not None:
+            live_messages.pop(msg.id,None)
+    store.forget(gamestate.game_id)
+
+def restore_game(row):
+    data = dict(zip(STORE_COLUMNS,row))
+    guild = client.get_guild(data["guild_id"]) if data["guild_id"] else None
+    def member(id):
+        return (guild.get_member(id) if guild else None) or StoredMember(id)
+
+    gamestate = FinFacFoeGame(member(data["challenger_id"]),member(data["boardmaster_id"]),
+        game_id=data["game_id"],guild_id=data["guild_id"],channel_id=data["channel_id"],
+        application_id=data["application_id"],token=data["token"],size=data["size"],win_length=data["win_length"])
+    decode_board(data["board"],gamestate)
+    gamestate.revealed = data["revealed"]
+    gamestate.moves = bytearray(data["moves"] or b"")
+    #the bot is one of the players of a /finbot game, its turn is played after the resuming click
+    if client.user.id in (data["challenger_id"],data["boardmaster_id"]):
+        gamestate.ai_piece = gamestate.X if data["challenger_id"] == client.user.id else gamestate.O
+
+    channel = client.get_partial_messageable(data["channel_id"],guild_id=data["guild_id"])
+    gamestate.public_view = FinFacFoeView(gamestate,True)
+    gamestate.public_msg = channel.get_partial_message(data["public_msg_id"])
+    webhook = discord.Webhook.partial(data["application_id"],data["token"],client=client)
+    #an AI boardmaster has no private board
+    if data["private_msg_id"] is not None:
+        gamestate.private_view = FinFacFoeView(gamestate,False)
+        gamestate.private_msg = WebhookMessageRef(webhook,data["private_msg_id"])
+
+    public_ids, private_ids = store.tile_message_ids(row)
+    gamestate.public_tiles = [(FinFacFoeView(gamestate,True,tile),channel.get_partial_message(id)) for tile, id in zip(gamestate.tiles[1:],public_ids)]
+    gamestate.private_tiles = [(FinFacFoeView(gamestate,False,tile),WebhookMessageRef(webhook,id)) for tile, id in zip(gamestate.tiles[1:],private_ids)]
+
+    key = sessions.make_key(data["channel_id"],data["boardmaster_id"],data["challenger_id"])
+    user_ids = [id for id in (data["boardmaster_id"],data["challenger_id"]) if id != client.user.id]
+    sessions.open(key,data["guild_id"],user_ids,gamestate,enforce_limits=False)
+    for view, msg in gamestate.boards():
+        if msg is not None:
+            client.add_view(view,message_id=msg.id)
+    live_games[gamestate.game_id] = gamestate
+    track_messages(gamestate)
+    gamestate.log.info("Resumed stored game")
+    return gamestate
+
+def resume_stored_game(interaction: discord.Interaction):
+    #First click on a game stored before a restart, bring it back and hand it this click
+    if interaction.type != discord.InteractionType.component:
+        return
+    custom_id = interaction.data.get("custom_id","")
+    if not custom_id.startswith("fin:") or interaction.message is None:
+        return
+    if interaction.message.id in live_messages:
+        return
+
+    row = store.take_dormant(interaction.message.id)
+    if row is None:
+        asyncio.create_task(interaction.response.send_message("This game is over ⛔",ephemeral=True,delete_after=3))
+        return
+    gamestate = restore_game(row)
+    is_visible, x, y = parse_custom_id(custom_id)
+    view = next(view for view, msg in gamestate.boards() if msg is not None and msg.id == interaction.message.id)
+    asyncio.create_task(view.button_at(x,y).callback(interaction))
 
 #------------------------------
 
 def check_channel(interaction: discord.Interaction):
-    logging.info(f"{interaction.channel.id} {VALID_CHANNEL_ID}")
-    return interaction.channel.id == int(VALID_CHANNEL_ID)
+    return channel_config.allows(interaction.guild_id,interaction.channel_id)
+
+async def post_boards(gamestate,send_public,send_private):
+    #Send every board message, send_public and send_private take content and view
+    #send_private None leaves out the private board, for an AI boardmaster
+    gamestate.public_view = FinFacFoeView(gamestate,True)
+    gamestate.public_msg = await send_public(content=f'{gamestate.get_challenger_text()}> \u200b', view = gamestate.public_view)
+    for tile in gamestate.tiles[1:]:
+        view = FinFacFoeView(gamestate,True,tile)
+        gamestate.public_tiles.append((view,await send_public(view = view)))
+    if send_private is not None:
+        gamestate.private_view = FinFacFoeView(gamestate,False)
+        gamestate.private_msg = await send_private(content=f'{gamestate.get_boardmaster_text()}> \u200b', view = gamestate.private_view)
+        for tile in gamestate.tiles[1:]:
+            view = FinFacFoeView(gamestate,False,tile)
+            gamestate.private_tiles.append((view,await send_private(view = view)))
+    track_messages(gamestate)
+
+async def open_game(interaction,challenger,boardmaster,size,win_length,ai_piece=None):
+    #Start a game from a slash command, the boardmaster's private board goes to the command user
+    if win_length is None:
+        win_length = core.default_win_length(size)
+    if win_length > size:
+        await interaction.response.send_message(f"{win_length} in a row does not fit a {size}x{size} board ⛔",ephemeral=True)
+        observe_first_response(interaction,"command")
+        return
+
+    gamestate = FinFacFoeGame(challenger,boardmaster,game_id=interaction.id,guild_id=interaction.guild_id,
+        channel_id=interaction.channel_id,application_id=interaction.application_id,token=interaction.token,
+        size=size,win_length=win_length)
+    gamestate.ai_piece = ai_piece
+    key = sessions.make_key(interaction.channel_id,boardmaster.id,challenger.id)
+    #the bot is not held to the per-user game limit
+    user_ids = [player.id for player in (boardmaster,challenger) if player.id != client.user.id]
+    try:
+        session = sessions.open(key,interaction.guild_id,user_ids,gamestate)
+    except SessionLimitError as e:
+        await interaction.response.send_message(f"{e} ⛔",ephemeral=True)
+        observe_first_response(interaction,"command")
+        return
+    live_games[gamestate.game_id] = gamestate
+
+    #Hold the game lock until both boards exist
+    async with session.lock:
+        try:
+            variant = "" if size == 3 else f" ({size}x{size}, {win_length} in a row)"
+            await interaction.response.send_message(f"{gamestate.boardmaster.display_name} challenged {gamestate.challenger.display_name} to FinFacFoe{variant}.")
+            observe_first_response(interaction,"command")
+            send_private = None if ai_piece == gamestate.O else functools.partial(interaction.followup.send,ephemeral=True)
+            await post_boards(gamestate,interaction.followup.send,send_private)
+            store.mark_dirty(gamestate)
+            gamestate.log.info("Game started",extra={"guild_id": interaction.guild_id,"channel_id": interaction.channel_id})
+        except discord.HTTPException:
+            sessions.close(session)
+            end_game(gamestate)
+            gamestate.disable_view()
+            raise
+    #an AI challenger has the first move
+    gamestate.start_ai_turn()
+    observe_handled(interaction,"command")
 
 @client.tree.command()
 @app_commands.check(check_channel)
-async def fin(interaction: discord.Interaction, challenger: discord.Member):
+@app_commands.describe(size="Board width and height, 3 by default",win_length="Pieces in a row to win, up to the board size")
+async def fin(interaction: discord.Interaction, challenger: discord.Member, size: app_commands.Range[int,3,MAX_BOARD_SIZE] = 3, win_length: app_commands.Range[int,3,MAX_BOARD_SIZE] = None):
+    await open_game(interaction,challenger,interaction.user,size,win_length)
 
-    gamestate = FinFacFoeGame(challenger,interaction.user)
-    public_view = FinFacFoeView(gamestate,True)
-    private_view = FinFacFoeView(gamestate,False)
+@client.tree.command()
+@app_commands.check(check_channel)
+@app_commands.describe(play_as="Your side, the bot takes the other one",size="Board width and height, 3 by default",
+    win_length="Pieces in a row to win, up to the board size")
+async def finbot(interaction: discord.Interaction, play_as: Literal["challenger","boardmaster"] = "challenger",
+    size: app_commands.Range[int,3,MAX_BOARD_SIZE] = 3, win_length: app_commands.Range[int,3,MAX_BOARD_SIZE] = None):
+    #Play against the AI, which only sees what its side of the board shows
+    bot = (interaction.guild and interaction.guild.me) or client.user
+    if play_as == "challenger":
+        await open_game(interaction,interaction.user,bot,size,win_length,ai_piece=core.O)
+    else:
+        await open_game(interaction,bot,interaction.user,size,win_length,ai_piece=core.X)
 
-    await interaction.response.send_message(f"{gamestate.boardmaster.display_name} challenged {gamestate.challenger.display_name} to FinFacFoe.")
-    msg = await interaction.followup.send(f'{gamestate.get_challenger_text()}> \u200b', view = public_view)
-    gamestate.public_view = public_view
-    gamestate.public_msg = msg
-    hidden_msg = await interaction.followup.send(f'{gamestate.get_boardmaster_text()}> \u200b', view = private_view, ephemeral=True)
-    gamestate.private_view = private_view
-    gamestate.private_msg = hidden_msg
+@client.tree.command()
+@app_commands.check(check_channel)
+@app_commands.describe(role="Ratings as challenger or as boardmaster",player="Whose rank to show, yours by default")
+async def leaderboard(interaction: discord.Interaction, role: Literal["challenger","boardmaster"] = "challenger", player: discord.User = None):
+    #Served from the in-memory index, see finfacfoe_ratings.py
+    board = ratings[role]
+    player = player or interaction.user
+    lines = [f"🏆 Best {role}s, {len(board)} rated"]
+    lines.extend(f"{rank}. <@{player_id}> {entry.rating:.0f} ({entry.wins}W {entry.losses}L {entry.ties}T)" for rank, player_id, entry in board.top(10))
+    entry = board.get(player.id)
+    if entry is None:
+        lines.append(f"{player.mention} has no {role} games yet")
+    else:
+        lines.append(f"{player.mention} is #{board.rank(player.id)} with {entry.rating:.0f} over {entry.games} games")
+    await interaction.response.send_message("\n".join(lines),allowed_mentions=discord.AllowedMentions.none())
+    observe_first_response(interaction,"command")
 
 #------------------------------
+#Tournaments, see finfacfoe_tournament.py
+#One tournament per guild, kept in memory. Public boards go to the tournament's channels and
+#private boards to the boardmaster's DMs, both through the send pacer
+
+#guild id -> tournament not finished yet
+tournaments = {}
+pacer = SendPacer()
+
+def leg_winner(gamestate):
+    #Player id the leg goes to, None for a tie, an expired game goes against the player to move
+    match gamestate.result:
+        case gamestate.X:
+            return gamestate.challenger.id
+        case gamestate.O:
+            return gamestate.boardmaster.id
+        case gamestate.TIE:
+            return None
+    return gamestate.boardmaster.id if gamestate.current_player == gamestate.X else gamestate.challenger.id
+
+async def get_member(guild,user_id):
+    return guild.get_member(user_id) or await guild.fetch_member(user_id)
+
+async def start_tournament_game(tournament,match,boardmaster_id,challenger_id,channel_id):
+    guild = client.get_guild(tournament.guild_id)
+    channel = guild.get_channel(channel_id) if guild else None
+    if channel is None:
+        raise TournamentError(f"Channel {channel_id} is not available")
+    boardmaster = await get_member(guild,boardmaster_id)
+    challenger = await get_member(guild,challenger_id)
+
+    #time snowflake plus a counter, unique like the interaction ids of /fin games
+    game_id = discord.utils.time_snowflake(discord.utils.utcnow())+next(tournament_game_ids) % (1 << 22)
+    gamestate = FinFacFoeGame(challenger,boardmaster,game_id=game_id,guild_id=guild.id,channel_id=channel_id,
+        size=tournament.size,win_length=tournament.win_length)
+    gamestate.header = f"🏆 Round {match.round}, game {match.legs+1}\n"
+    key = sessions.make_key(channel_id,boardmaster_id,challenger_id)
+    session = sessions.open(key,guild.id,(boardmaster_id,challenger_id),gamestate,enforce_limits=False)
+    live_games[game_id] = gamestate
+
+    async with session.lock:
+        try:
+            dm = boardmaster.dm_channel or await boardmaster.create_dm()
+            await post_boards(gamestate,functools.partial(pacer.send,channel),functools.partial(pacer.send,dm))
+        except BaseException:
+            #the scheduler retries the leg, this game never happened
+            sessions.close(session)
+            end_game(gamestate)
+            gamestate.disable_view()
+            raise
+        gamestate.match = match
+        gamestate.log.info("Tournament game started",extra={"tournament": tournament.id,"match": match.id})
+
+async def announce_tournament(tournament,text):
+    channel = client.get_channel(tournament.channel_ids[0])
+    if channel is not None:
+        await pacer.send(channel,content=text)
+
+tournament_game_ids = itertools.count()
+tournament_scheduler = TournamentScheduler(start_tournament_game,TOURNAMENT_MAX_PER_CHANNEL,TOURNAMENT_MAX_GAMES,announce_tournament)
+metrics.REGISTRY.gauge("finfacfoe_tournament_games_active","Tournament games running",lambda: tournament_scheduler.active)
+
+tournament_commands = app_commands.Group(name="tournament",description="FinFacFoe brackets and round robins",guild_only=True)
+
+async def tournament_reply(interaction,text,ephemeral=True):
+    await interaction.response.send_message(text,ephemeral=ephemeral)
+    observe_first_response(interaction,"command")
+
+@tournament_commands.command(name="create")
+@app_commands.check(check_channel)
+@app_commands.describe(format="Single elimination bracket or everyone against everyone",channels="Channels to play in, this one by default",
+    size="Board width and height, 3 by default",win_length="Pieces in a row to win, up to the board size")
+async def tournament_create(interaction: discord.Interaction, format: Literal["bracket","roundrobin"] = "bracket", channels: str = None,
+    size: app_commands.Range[int,3,MAX_BOARD_SIZE] = 3, win_length: app_commands.Range[int,3,MAX_BOARD_SIZE] = None):
+    if interaction.guild_id in tournaments:
+        await tournament_reply(interaction,"This server already has a tournament ⛔")
+        return
+    win_length = core.default_win_length(size) if win_length is None else win_length
+    if win_length > size:
+        await tournament_reply(interaction,f"{win_length} in a row does not fit a {size}x{size} board ⛔")
+        return
+    #channel mentions or ids, only channels the bot is allowed in
+    channel_ids = [int(id) for id in re.findall(r"\d{15,}",channels or "")]
+    channel_ids = [id for id in channel_ids if interaction.guild.get_channel(id) and channel_config.allows(interaction.guild_id,id)] or [interaction.channel_id]
+    tournaments[interaction.guild_id] = Tournament(interaction.id,format,channel_ids,guild_id=interaction.guild_id,
+        creator_id=interaction.user.id,size=size,win_length=win_length)
+    where = " ".join(f"<#{id}>" for id in channel_ids)
+    await tournament_reply(interaction,f"{interaction.user.display_name} opened a FinFacFoe {format} in {where}. Sign up with /tournament join 🏆",ephemeral=False)
+
+@tournament_commands.command(name="join")
+@app_commands.check(check_channel)
+async def tournament_join(interaction: discord.Interaction):
+    tournament = tournaments.get(interaction.guild_id)
+    if tournament is None:
+        await tournament_reply(interaction,"There is no tournament to join ⛔")
+        return
+    try:
+        tournament.join(interaction.user.id)
+    except TournamentError as e:
+        await tournament_reply(interaction,f"{e} ⛔")
+        return
+    await tournament_reply(interaction,f"You are player {len(tournament.players)} ✅")
+
+@tournament_commands.command(name="leave")
+@app_commands.check(check_channel)
+async def tournament_leave(interaction: discord.Interaction):
+    tournament = tournaments.get(interaction.guild_id)
+    try:
+        if tournament is None:
+            raise TournamentError("There is no tournament to leave")
+        tournament.leave(interaction.user.id)
+    except TournamentError as e:
+        await tournament_reply(interaction,f"{e} ⛔")
+        return
+    await tournament_reply(interaction,"You left the tournament ✅")
+
+def may_run(interaction,tournament):
+    return interaction.user.id == tournament.creator_id or interaction.permissions.manage_guild
+
+@tournament_commands.command(name="start")
+@app_commands.check(check_channel)
+async def tournament_start(interaction: discord.Interaction):
+    tournament = tournaments.get(interaction.guild_id)
+    try:
+        if tournament is None:
+            raise TournamentError("There is no tournament to start")
+        if not may_run(interaction,tournament):
+            raise TournamentError("Only the organiser can start the tournament")
+        tournament.start()
+    except TournamentError as e:
+        await tournament_reply(interaction,f"{e} ⛔")
+        return
+    logging.info(f"Tournament {tournament.id} started with {len(tournament.players)} players",extra={"guild_id": interaction.guild_id})
+    await tournament_reply(interaction,f"The {tournament.kind} starts with {len(tournament.players)} players, "
+        f"{len(tournament.structure.matches)} matches to play 🏆",ephemeral=False)
+    tournament_scheduler.add(tournament)
+
+@tournament_commands.command(name="status")
+@app_commands.check(check_channel)
+async def tournament_status(interaction: discord.Interaction):
+    tournament = tournaments.get(interaction.guild_id)
+    if tournament is None:
+        await tournament_reply(interaction,"There is no tournament running")
+        return
+    if not tournament.started:
+        await tournament_reply(interaction,f"{len(tournament.players)} players signed up for the {tournament.kind}")
+        return
+    decided = sum(match.decided for match in tournament.structure.matches)
+    running = sum(match.running for match in tournament.structure.matches)
+    top = "\n".join(f"{i}. <@{player}> {score:g}" for i, (player, score) in enumerate(tournament.standings()[:10],1))
+    label = "round reached" if tournament.kind == "bracket" else "points"
+    await tournament_reply(interaction,f"{decided}/{len(tournament.structure.matches)} matches decided, {running} playing\nTop 10 ({label}):\n{top}")
+
+@tournament_commands.command(name="cancel")
+@app_commands.check(check_channel)
+async def tournament_cancel(interaction: discord.Interaction):
+    tournament = tournaments.get(interaction.guild_id)
+    if tournament is None or not may_run(interaction,tournament):
+        await tournament_reply(interaction,"There is no tournament you can cancel ⛔")
+        return
+    #games already running play out, their results are dropped
+    tournament_scheduler.remove(tournament)
+    del tournaments[interaction.guild_id]
+    await tournament_reply(interaction,"Tournament cancelled",ephemeral=False)
+
+client.tree.add_command(tournament_commands)
 
 #------------------------------
 
-client.run(DISCORD_TOKEN)
\ No newline at end of file
+startup.mark("import")
+
+if __name__ == "__main__":
+    #SIGTERM closes the bot as Ctrl+C does, so the store, the logs and the AI workers shut down
+    signal.signal(signal.SIGTERM,signal.default_int_handler)
+    #log_handler=None keeps discord.py on the queued root handler
+    client.run(DISCORD_TOKEN,log_handler=None)
\ No newline at end of file
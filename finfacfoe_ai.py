@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+from finfacfoe_core import X, O, TIE, CONTINUE, STATES
+from finfacfoe_metrics import AI_SEARCH, AI_ITERATIONS, AI_FALLBACKS
+
+#Information-set Monte Carlo tree search opponent
+#
+#The challenger never sees O's pieces, so an X player searches over the boards it can not tell
+#apart: every iteration samples one determinization, a full board with lock state consistent with
+#what X knows, and walks a single tree whose nodes are move sequences (single-observer ISMCTS).
+#A child is only eligible in the determinizations where its move is legal, UCB counts how often
+#it was available rather than how often its parent was visited
+#The boardmaster sees the whole board, its searches use the real position every iteration
+#
+#Determinizations for X are drawn by rejection sampling: X's own moves are replayed in order and
+#O's are drawn from the moves the lock rules allowed at that point, avoiding cells X played later.
+#Samples where someone already won or that miss an O cell X has found are rejected
+#
+#Searches run in a process pool with a time budget per move, the event loop only awaits the result
+
+EXPLORATION = 0.7
+
+#proposals per determinization before falling back to O pieces placed without their history
+SAMPLE_ATTEMPTS = 50
+
+#searches started after their deadline, because the pool was busy, still run this many iterations
+MIN_ITERATIONS = 200
+
+class Observation():
+    #What one player knows of a running game, built on the event loop and sent to a worker
+    #state is the lock state index (see rules.STATE_LIST), None for X who can not see it
+    __slots__ = ("size","win_length","piece","count","x_mask","o_mask","x_moves","state","c","r")
+
+    def __init__(self,size,win_length,piece,count,x_mask,o_mask,x_moves=b"",state=None,c=None,r=None):
+        self.size = size
+        self.win_length = win_length
+        self.piece = piece
+        self.count = count
+        self.x_mask = x_mask
+        #every O cell for O, the ones X found for X
+        self.o_mask = o_mask
+        #X's cells in the order they were played, empty for games stored without their history
+        self.x_moves = x_moves
+        self.state = state
+        self.c = c
+        self.r = r
+
+def observe(state,piece):
+    #Observation of a FinFacFoeState for the player of piece
+    geometry = state.geometry
+    if piece == O:
+        return Observation(geometry.size,geometry.win_length,O,state.count,state.core.x_mask,state.core.o_mask,
+            state=state.bm_state.value-1,c=state.c,r=state.r)
+    x_moves = bytes(state.moves[0::2]) if len(state.moves) == state.count else b""
+    return Observation(geometry.size,geometry.win_length,X,state.count,state.core.x_mask,
+        getattr(state,"revealed",0) & state.core.o_mask,x_moves)
+
+#------------------------------
+#Search position
+
+def random_bit(mask,rng):
+    #index of a uniformly chosen set bit of mask
+    for _ in range(rng.randrange(mask.bit_count())):
+        mask &= mask-1
+    return (mask & -mask).bit_length()-1
+
+class Position():
+    #Full board used inside a search, the player to move follows from the piece count
+    __slots__ = ("geometry","x_mask","o_mask","bm_state","c","r","count","result")
+
+    def __init__(self,geometry,x_mask=0,o_mask=0,bm_state=STATES.FREE,c=None,r=None,count=0,result=CONTINUE):
+        self.geometry = geometry
+        self.x_mask = x_mask
+        self.o_mask = o_mask
+        self.bm_state = bm_state
+        self.c = c
+        self.r = r
+        self.count = count
+        self.result = result
+
+    def copy(self):
+        return Position(self.geometry,self.x_mask,self.o_mask,self.bm_state,self.c,self.r,self.count,self.result)
+
+    def legal(self):
+        return rules.grid_legal_mask(self.geometry,self.x_mask | self.o_mask,self.bm_state,self.c,self.r)
+
+    def play(self,index):
+        #Places the piece to move on a legal cell
+        geometry = self.geometry
+        if self.count % 2:
+            x, y = index % geometry.size, index // geometry.size
+            self.bm_state, self.c, self.r = rules.grid_transition(geometry,self.x_mask | self.o_mask,self.bm_state,self.c,self.r,x,y)
+            self.o_mask |= 1 << index
+            mask, piece = self.o_mask, O
+        else:
+            self.x_mask |= 1 << index
+            mask, piece = self.x_mask, X
+        self.count += 1
+        windows = geometry.windows
+        for w in geometry.cell_windows[index]:
+            if mask & windows[w] == windows[w]:
+                self.result = piece
+                return
+        if self.count == geometry.cells:
+            self.result = TIE
+
+class Determinizer():
+    #Draws full positions consistent with an observation
+    def __init__(self,observation,rng):
+        self.observation = observation
+        self.rng = rng
+        self.geometry = core.geometry(observation.size,observation.win_length)
+        self.rejected = 0
+        self.fallbacks = 0
+        self.exact = None
+        if observation.piece == O:
+            self.exact = Position(self.geometry,observation.x_mask,observation.o_mask,rules.STATE_LIST[observation.state],
+                observation.c,observation.r,observation.count)
+
+    def sample(self):
+        if self.exact is not None:
+            return self.exact.copy()
+        if self.observation.x_moves:
+            for _ in range(SAMPLE_ATTEMPTS):
+                position = self._propose()
+                if position is not None:
+                    return position
+                self.rejected += 1
+        self.fallbacks += 1
+        return self._fallback()
+
+    def _propose(self):
+        #Replays X's moves with O moves drawn from the legal ones, None when the sample is rejected
+        observation, rng = self.observation, self.rng
+        position = Position(self.geometry)
+        x_moves = observation.x_moves
+        later_x = observation.x_mask
+        found = observation.o_mask
+        for turn in range(observation.count):
+            if turn % 2 == 0:
+                index = x_moves[turn//2]
+                later_x &= ~(1 << index)
+            else:
+                legal = position.legal() & ~later_x
+                if not legal:
+                    return None
+                #lean towards found O cells, every one of them has to be placed by the end
+                missing = found & ~position.o_mask
+                turns_left = (observation.count-turn+1)//2
+                if missing.bit_count() > turns_left:
+                    return None
+                if legal & missing and rng.random()*turns_left < missing.bit_count():
+                    legal &= missing
+                index = random_bit(legal,rng)
+            position.play(index)
+            if position.result != CONTINUE:
+                return None
+        if position.o_mask & found != found:
+            return None
+        return position
+
+    def _fallback(self):
+        #O pieces on the found cells and random open ones, lock released
+        observation, rng = self.observation, self.rng
+        o_mask = observation.o_mask
+        open_cells = self.geometry.full_mask & ~(observation.x_mask | o_mask)
+        for _ in range(min(observation.count//2-o_mask.bit_count(),open_cells.bit_count())):
+            bit = 1 << random_bit(open_cells,rng)
+            o_mask |= bit
+            open_cells &= ~bit
+        return Position(self.geometry,observation.x_mask,o_mask,STATES.FREE,None,None,observation.count)
+
+#------------------------------
+#Tree
+
+class Node():
+    __slots__ = ("move","parent","piece","children","tried","visits","reward","available")
+
+    def __init__(self,move,parent,piece):
+        self.move = move
+        self.parent = parent
+        #player who made move, rewards are from their side
+        self.piece = piece
+        self.children = {}
+        #mask of the moves in children
+        self.tried = 0
+        self.visits = 0
+        self.reward = 0.0
+        self.available = 1
+
+def playout(position,rng):
+    #Uniformly random legal moves to the end, returns the result
+    while position.result == CONTINUE:
+        position.play(random_bit(position.legal(),rng))
+    return position.result
+
+def search(observation,deadline,min_iterations=MIN_ITERATIONS,max_iterations=None,seed=None):
+    #Runs in a pool worker until the time.time() deadline, returns (cell index, stats)
+    rng = random.Random(seed)
+    sampler = Determinizer(observation,rng)
+    root = Node(None,None,-observation.piece)
+    iterations = 0
+    while iterations < min_iterations or time.time() < deadline:
+        if max_iterations is not None and iterations >= max_iterations:
+            break
+        iterations += 1
+        position = sampler.sample()
+        node = root
+
+        #Selection and expansion over the moves legal in this determinization
+        while position.result == CONTINUE:
+            legal = position.legal()
+            untried = legal & ~node.tried
+            if untried:
+                move = random_bit(untried,rng)
+                child = node.children[move] = Node(move,node,-node.piece)
+                node.tried |= 1 << move
+                position.play(move)
+                node = child
+                break
+            best, best_score = None, -1.0
+            for move, child in node.children.items():
+                if legal >> move & 1:
+                    child.available += 1
+                    score = child.reward/child.visits+EXPLORATION*math.sqrt(math.log(child.available)/child.visits)
+                    if score > best_score:
+                        best, best_score = child, score
+            position.play(best.move)
+            node = best
+
+        result = playout(position,rng)
+        while node is not None:
+            node.visits += 1
+            node.reward += 1.0 if result == node.piece else 0.5 if result == TIE else 0.0
+            node = node.parent
+
+    best = max(root.children.values(),key=lambda child: child.visits)
+    stats = {"iterations": iterations,"rejected": sampler.rejected,"fallbacks": sampler.fallbacks,
+        "visits": best.visits,"value": best.reward/best.visits}
+    return best.move, stats
+
+#------------------------------
+
+def _watch_parent(parent_pid):
+    #A bot killed by a signal never shuts the pool down, its workers leave once they are orphaned
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1.0)
+        os._exit(0)
+    threading.Thread(target=watch,daemon=True).start()
+
+class AIPool():
+    #Worker processes the searches run in, one task per AI move
+    #Workers are spawned, a fork would copy the bot's threads and locks mid-use, and all of them are
+    #started up front so the first searches do not pay for the imports. A pool broken by a killed
+    #worker is rebuilt for the next search
+    #A spawned process runs the parent's __main__ module again as __mp_main__, for the bot that is
+    #finfacfoe.py and its whole setup, so the workers are started with this module standing in for it
+    def __init__(self,workers=None,budget=1.0,min_iterations=MIN_ITERATIONS):
+        self.workers = workers or os.cpu_count() or 1
+        self.budget = budget
+        self.min_iterations = min_iterations
+        self.executor = None
+        #searches submitted and not answered yet
+        self.pending = 0
+
+    def start(self):
+        if self.executor is None:
+            main = sys.modules["__main__"]
+            sys.modules["__main__"] = sys.modules[__name__]
+            try:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_watch_parent,initargs=(os.getpid(),))
+                #a spawn pool starts a worker per task submitted while none is idle, in submit
+                for _ in range(self.workers):
+                    self.executor.submit(os.getpid)
+            finally:
+                sys.modules["__main__"] = main
+
+    async def choose_move(self,observation,budget=None):
+        #(x, y) to play, the budget runs from the call so time queued for a worker counts against it
+        start = time.perf_counter()
+        deadline = time.time()+(self.budget if budget is None else budget)
+        self.pending += 1
+        try:
+            for attempt in range(2):
+                self.start()
+                try:
+                    index, stats = await asyncio.get_running_loop().run_in_executor(self.executor,search,observation,deadline,self.min_iterations)
+                    break
+                except BrokenProcessPool:
+                    self.executor = None
+                    if attempt:
+                        raise
+        finally:
+            self.pending -= 1
+        AI_SEARCH.observe(time.perf_counter()-start)
+        AI_ITERATIONS.inc(stats["iterations"])
+        AI_FALLBACKS.inc(stats["fallbacks"])
+        return index % observation.size, index // observation.size
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False,cancel_futures=True)
+            self.executor = None
+
+#------------------------------
+
+async def bench(games=100,size=3,win_length=3,piece=X,budget=0.2,workers=None,concurrency=None):
+    #AI against uniformly random legal moves, concurrency games at once through one pool
+    from finfacfoe_engine import FinFacFoeState, MOVE
+    pool = AIPool(workers,budget)
+    concurrency = concurrency or pool.workers
+    results = {X: 0,O: 0,TIE: 0}
+    moves = 0
+    rng = random.Random(1)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def play_one():
+        nonlocal moves
+        async with gate:
+            state = FinFacFoeState(size,win_length)
+            state.revealed = 0
+            while state.result == CONTINUE:
+                if state.current_player == piece:
+                    x, y = await pool.choose_move(observe(state,piece))
+                    moves += 1
+                else:
+                    x, y = state.geometry.index_to_cell(random_bit(state.legal_moves(),rng))
+                if state.play(state.current_player,x,y) == MOVE.OCCUPIED:
+                    #X clicked a hidden O, which only reveals it
+                    state.revealed |= state.geometry.cell_bit(x,y)
+            results[state.result] += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(play_one() for _ in range(games)))
+    finally:
+        pool.shutdown()
+    elapsed = time.perf_counter()-start
+    name = "X" if piece == X else "O"
+    print(f"{games} games on {size}x{size} ({win_length} in a row), AI as {name}, {pool.workers} workers, {concurrency} at once")
+    print(f"AI won {results[piece]}, lost {results[-piece]}, tied {results[TIE]}")
+    print(f"{moves} AI moves in {elapsed:.1f}s, {moves/elapsed:.1f} moves/s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Play the FinFacFoe AI against random moves")
+    parser.add_argument("--games",type=int,default=100)
+    parser.add_argument("--size",type=int,default=3)
+    parser.add_argument("--win-length",type=int)
+    parser.add_argument("--piece",choices=("X","O"),default="X",help="side the AI plays")
+    parser.add_argument("--budget",type=float,default=0.2,help="seconds per AI move")
+    parser.add_argument("--workers",type=int,help="search processes, one per core by default")
+    parser.add_argument("--concurrency",type=int,help="games played at once, the worker count by default")
+    args = parser.parse_args()
+    win_length = args.win_length or (3 if args.size == 3 else 4 if args.size <= 6 else 5)
+    asyncio.run(bench(args.games,args.size,win_length,X if args.piece == "X" else O,args.budget,args.workers,args.concurrency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+from finfacfoe_engine import FinFacFoeState, MOVE
+from finfacfoe_logging import setup_logging, stop_logging
+
+#Benchmark suite for the move hot path
+#  headless: FinFacFoeState.play, moves per second and allocated bytes per move
+#  on_update: FinFacFoeGame.on_update driven by fake interaction/message stand-ins, p50/p99 latency
+#  up to the click's acknowledgement, views are real and rendered to component payloads as discord.py
+#  would before sending. The queued board edits are flushed at the end of each game
+#Each run is repeated with logging at WARNING, at INFO and with every game traced at DEBUG
+#Results are written as JSON and can be compared against an earlier run with --compare
+
+#metrics where a bigger number is better, everything else is treated as a cost
+HIGHER_IS_BETTER = ("moves_per_second",)
+
+#------------------------------
+#Fake Discord stand-ins, only the attributes on_update touches
+
+class FakeMember():
+    def __init__(self,id):
+        self.id = id
+        self.mention = f"<@{id}>"
+        self.display_name = f"player{id}"
+
+def serialize(kwargs):
+    #What discord.py does with a view before sending it
+    view = kwargs.get("view")
+    if view is not None:
+        view.to_components()
+
+class FakeResponse():
+    async def edit_message(self,**kwargs):
+        serialize(kwargs)
+
+    async def defer(self):
+        pass
+
+    async def send_message(self,*args,**kwargs):
+        pass
+
+class FakeInteraction():
+    def __init__(self,user):
+        self.user = user
+        self.response = FakeResponse()
+        self.extras = {}
+
+    async def edit_original_response(self,**kwargs):
+        serialize(kwargs)
+
+class FakeMessage():
+    async def edit(self,**kwargs):
+        serialize(kwargs)
+
+#------------------------------
+
+def pick_click(state,rng):
+    #Challenger clicks any cell they have not played, so hidden O pieces get probed
+    #Boardmaster only clicks cells the private view leaves enabled
+    if state.current_player == state.X:
+        cells = [i for i in range(9) if not state.core.x_mask >> i & 1]
+    else:
+        legal = state.legal_moves()
+        cells = [i for i in range(9) if legal >> i & 1]
+    return core.index_to_cell(rng.choice(cells))
+
+def percentile(samples,q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1,int(q*len(ordered)))]
+
+def bench_headless(games,seed):
+    rng = random.Random(seed)
+    moves = 0
+    start = time.perf_counter()
+    for _ in range(games):
+        state = FinFacFoeState()
+        while state.result == state.CONTINUE:
+            x, y = pick_click(state,rng)
+            if state.play(state.current_player,x,y) == MOVE.PLACED:
+                moves += 1
+    elapsed = time.perf_counter()-start
+
+    #Allocation pass, tracemalloc is too slow to leave on for the timed pass
+    rng = random.Random(seed)
+    tracemalloc.start()
+    allocated = 0
+    traced_moves = 0
+    for _ in range(min(games,2000)):
+        state = FinFacFoeState()
+        while state.result == state.CONTINUE:
+            x, y = pick_click(state,rng)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            if state.play(state.current_player,x,y) == MOVE.PLACED:
+                allocated += tracemalloc.get_traced_memory()[1]-before
+                traced_moves += 1
+    tracemalloc.stop()
+
+    return {
+        "moves": moves,
+        "moves_per_second": moves/elapsed,
+        "alloc_bytes_per_move": allocated/traced_moves,
+    }
+
+async def bench_on_update(games,seed,concurrency):
+    #Imported lazily, the bot module needs discord.py installed
+    from finfacfoe import FinFacFoeGame, FinFacFoeView
+    from finfacfoe_edits import EditScheduler, BucketRegistry
+    UNLIMITED = BucketRegistry(limit=sys.maxsize)
+
+    rng = random.Random(seed)
+    latencies = []
+    moves = 0
+
+    async def play_game():
+        nonlocal moves
+        challenger, boardmaster = FakeMember(1), FakeMember(2)
+        game = FinFacFoeGame(challenger,boardmaster)
+        game.public_view, game.private_view = FinFacFoeView(game,True), FinFacFoeView(game,False)
+        game.public_msg, game.private_msg = FakeMessage(), FakeMessage()
+        #Fake messages have no Discord rate limit to respect
+        game.edits = EditScheduler(UNLIMITED)
+        while game.result == game.CONTINUE:
+            x, y = pick_click(game,rng)
+            if game.current_player == game.X:
+                view, user = game.public_view, challenger
+            else:
+                view, user = game.private_view, boardmaster
+            count = game.count
+            start = time.perf_counter_ns()
+            await game.on_update(view.button_at(x,y),FakeInteraction(user)).send()
+            latencies.append(time.perf_counter_ns()-start)
+            moves += game.count-count
+        await game.edits.flush()
+
+    start = time.perf_counter()
+    remaining = games
+    while remaining > 0:
+        batch = min(concurrency,remaining)
+        await asyncio.gather(*(play_game() for _ in range(batch)))
+        remaining -= batch
+    elapsed = time.perf_counter()-start
+
+    return {
+        "moves": moves,
+        "moves_per_second": moves/elapsed,
+        "p50_ms": percentile(latencies,0.50)/1e6,
+        "p99_ms": percentile(latencies,0.99)/1e6,
+        "mean_ms": sum(latencies)/len(latencies)/1e6,
+    }
+
+def set_log_level(level):
+    #Log through the bot's queued handlers, but throw the output away
+    setup_logging(level,stream=io.TextIOWrapper(open(os.devnull,"wb"),write_through=True))
+
+def git_commit():
+    try:
+        return subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run_suite(games,seed,concurrency,skip_on_update=False):
+    results = {}
+    if not skip_on_update:
+        #The bot module sets up its own logging on import, load it before the levels below replace it
+        import finfacfoe
+    #The rule table is built on first use, build it here so no timed pass pays for it
+    rules.get_table()
+    for name, level in (("warning",logging.WARNING),("info",logging.INFO),("debug",logging.DEBUG)):
+        set_log_level(level)
+        results[f"headless_{name}"] = bench_headless(games,seed)
+        if not skip_on_update:
+            results[f"on_update_{name}"] = asyncio.run(bench_on_update(games,seed,concurrency))
+    stop_logging()
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "games": games,
+        "seed": seed,
+        "results": results,
+    }
+
+def compare(old,new,threshold):
+    #returns the list of regressions beyond threshold (fraction)
+    regressions = []
+    for name, metrics in new["results"].items():
+        if name not in old["results"]:
+            continue
+        for metric, value in metrics.items():
+            before = old["results"][name].get(metric)
+            if not before or metric == "moves":
+                continue
+            change = (value-before)/before
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = " REGRESSION" if worse > threshold else ""
+            print(f"{name}.{metric}: {before:.4g} -> {value:.4g} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FinFacFoe move path benchmarks")
+    parser.add_argument("--games",type=int,default=5000)
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--concurrency",type=int,default=1,help="on_update games run at once, latencies then include the other games")
+    parser.add_argument("--headless-only",action="store_true")
+    parser.add_argument("--output",default="bench_output.json")
+    parser.add_argument("--compare",help="earlier results file to compare against")
+    parser.add_argument("--threshold",type=float,default=0.15)
+    args = parser.parse_args()
+
+    report = run_suite(args.games,args.seed,args.concurrency,args.headless_only)
+    with open(args.output,"w") as f:
+        json.dump(report,f,indent=2)
+    for name, metrics in report["results"].items():
+        print(name, json.dumps(metrics))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f),report,args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
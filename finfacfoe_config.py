@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+
+#Per-guild allowed-channel configuration
+#
+#File format:
+#{
+#    "allow_unlisted": false,
+#    "guilds": {
+#        "<guild id>": [<channel id>, ...],
+#        "<guild id>": "*"
+#    }
+#}
+#A guild mapped to "*" may play in every channel, guilds missing from the file follow allow_unlisted
+#The file is parsed into one dict of frozensets that is swapped in whole on reload
+
+ALL_CHANNELS = None
+
+class ChannelConfig():
+    def __init__(self,path=None,allow_unlisted=False):
+        self.path = path
+        self.allow_unlisted = allow_unlisted
+        #guild id -> frozenset of channel ids, or ALL_CHANNELS
+        self.guilds = {}
+        self.mtime = None
+
+    @classmethod
+    def from_mapping(cls,mapping,allow_unlisted=False):
+        config = cls(allow_unlisted=allow_unlisted)
+        config.guilds = cls.parse({"guilds": mapping,"allow_unlisted": allow_unlisted})[0]
+        return config
+
+    @staticmethod
+    def parse(data):
+        guilds = {}
+        for guild_id, channels in data.get("guilds",{}).items():
+            if channels == "*":
+                guilds[int(guild_id)] = ALL_CHANNELS
+            else:
+                guilds[int(guild_id)] = frozenset(int(channel_id) for channel_id in channels)
+        return guilds, bool(data.get("allow_unlisted",False))
+
+    def allows(self,guild_id,channel_id):
+        try:
+            channels = self.guilds[guild_id]
+        except KeyError:
+            return self.allow_unlisted
+        return channels is ALL_CHANNELS or channel_id in channels
+
+    def reload(self,force=False):
+        #Reload the file when it changed, returns True if a new configuration was swapped in
+        #A broken file keeps the previous configuration
+        if self.path is None:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if not force and mtime == self.mtime:
+            return False
+        try:
+            with open(self.path) as f:
+                guilds, allow_unlisted = self.parse(json.load(f))
+        except (OSError,ValueError,TypeError,AttributeError) as e:
+            logging.error(f"Keeping previous channel configuration, {self.path} is invalid: {e}")
+            self.mtime = mtime
+            return False
+        self.guilds, self.allow_unlisted = guilds, allow_unlisted
+        self.mtime = mtime
+        logging.info(f"Loaded channel configuration for {len(guilds)} guilds from {self.path}")
+        return True
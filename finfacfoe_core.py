@@ -0,0 +1,240 @@
+from enum import Enum
+from functools import lru_cache
+
+#Discord-free FinFacFoe game core
+#X and O are kept as two 9-bit masks, bit (y*3+x) is board[y][x]
+#Larger boards use GridBoard, bit (y*size+x), with k-in-a-row win detection
+
+#CONSTANTS
+X = -1 #Challenger
+O = 1 #Boardmaster
+TIE = 2
+CONTINUE = 0
+STATES = Enum("TRAP STATES",["FREE","FIXED","COL","ROW"])
+CHECK = Enum("LINE CHECK",["ANY","COL","ROW"])
+
+SIZE = 3
+FULL_MASK = (1 << SIZE*SIZE) - 1
+CENTER_MASK = 1 << (SIZE*SIZE)//2
+
+ROW_MASKS = tuple(0b111 << (SIZE*y) for y in range(SIZE))
+COL_MASKS = tuple(0b001001001 << x for x in range(SIZE))
+DIAG_MASKS = (0b100010001, 0b001010100)
+LINE_MASKS = ROW_MASKS + COL_MASKS + DIAG_MASKS
+
+#WINNING[mask] is True when mask covers a full line
+WINNING = tuple(any(mask & line == line for line in LINE_MASKS) for mask in range(FULL_MASK+1))
+
+def cell_index(x,y):
+    return y*SIZE+x
+
+def cell_bit(x,y):
+    return 1 << (y*SIZE+x)
+
+def index_to_cell(index):
+    #returns (x,y)
+    return index % SIZE, index // SIZE
+
+class BitBoard():
+    __slots__ = ("x_mask","o_mask")
+
+    def __init__(self,x_mask=0,o_mask=0):
+        self.x_mask = x_mask
+        self.o_mask = o_mask
+
+    @property
+    def occupied(self):
+        return self.x_mask | self.o_mask
+
+    def open_mask(self):
+        return FULL_MASK & ~(self.x_mask | self.o_mask)
+
+    def is_open(self,x,y):
+        return not (self.x_mask | self.o_mask) & cell_bit(x,y)
+
+    def piece_at(self,x,y):
+        bit = cell_bit(x,y)
+        if self.x_mask & bit:
+            return X
+        if self.o_mask & bit:
+            return O
+        return 0
+
+    def place(self,piece,x,y):
+        if piece == X:
+            self.x_mask |= cell_bit(x,y)
+        else:
+            self.o_mask |= cell_bit(x,y)
+
+    def has_open(self):
+        return (self.x_mask | self.o_mask) != FULL_MASK
+
+    def col_open(self,c):
+        return (self.x_mask | self.o_mask) & COL_MASKS[c] != COL_MASKS[c]
+
+    def row_open(self,r):
+        return (self.x_mask | self.o_mask) & ROW_MASKS[r] != ROW_MASKS[r]
+
+    def winner(self):
+        if WINNING[self.o_mask]:
+            return O
+        if WINNING[self.x_mask]:
+            return X
+        if (self.x_mask | self.o_mask) == FULL_MASK:
+            return TIE
+        return CONTINUE
+
+    def to_rows(self):
+        #nested list in the original board[y][x] layout
+        return [[self.piece_at(x,y) for x in range(SIZE)] for y in range(SIZE)]
+
+    def __repr__(self):
+        return f"BitBoard(x_mask={self.x_mask:#011b}, o_mask={self.o_mask:#011b})"
+
+#------------------------------
+#N x N boards with k in a row
+
+#Largest board, a move is logged as one byte (cell index below 256) and the store packs a
+#locked column or row in 4 bits with 15 meaning no lock
+MAX_SIZE = 15
+
+class Geometry():
+    #Masks of a size x size board, win_length pieces in a row win
+    def __init__(self,size,win_length):
+        if size > MAX_SIZE:
+            raise ValueError(f"boards are at most {MAX_SIZE}x{MAX_SIZE}, not {size}x{size}")
+        if not 3 <= win_length <= size:
+            raise ValueError(f"win length {win_length} does not fit a {size}x{size} board")
+        self.size = size
+        self.win_length = win_length
+        self.cells = size*size
+        self.full_mask = (1 << self.cells) - 1
+
+        row = (1 << size) - 1
+        self.row_masks = tuple(row << (size*y) for y in range(size))
+        col = sum(1 << (size*y) for y in range(size))
+        self.col_masks = tuple(col << x for x in range(size))
+
+        #one centre cell on odd boards, the middle 2x2 on even ones
+        middle = (size//2,) if size % 2 else (size//2-1,size//2)
+        self.center_mask = sum(self.cell_bit(x,y) for x in middle for y in middle)
+
+        #every run of win_length cells: across, down and both diagonals
+        windows = []
+        for dx, dy in ((1,0),(0,1),(1,1),(1,-1)):
+            for y in range(size):
+                for x in range(size):
+                    end_x, end_y = x+dx*(win_length-1), y+dy*(win_length-1)
+                    if 0 <= end_x < size and 0 <= end_y < size:
+                        windows.append(tuple(self.cell_index(x+dx*i,y+dy*i) for i in range(win_length)))
+        self.windows = tuple(sum(1 << i for i in window) for window in windows)
+        #cell index -> indices of the windows through it, at most 4*win_length
+        self.cell_windows = tuple(tuple(w for w, window in enumerate(windows) if i in window) for i in range(self.cells))
+
+    def cell_index(self,x,y):
+        return y*self.size+x
+
+    def cell_bit(self,x,y):
+        return 1 << (y*self.size+x)
+
+    def index_to_cell(self,index):
+        return index % self.size, index // self.size
+
+    def __repr__(self):
+        return f"Geometry(size={self.size}, win_length={self.win_length})"
+
+@lru_cache(maxsize=None)
+def geometry(size=SIZE,win_length=SIZE):
+    return Geometry(size,win_length)
+
+def default_win_length(size):
+    #3 in a row on 3x3, 4 on boards up to 6x6 and 5 past that
+    return 3 if size == 3 else 4 if size <= 6 else 5
+
+class GridBoard():
+    #BitBoard for any Geometry, wins are found by per-window counters updated on each place
+    __slots__ = ("geometry","x_mask","o_mask","x_counts","o_counts","filled","result")
+
+    def __init__(self,geometry,x_mask=0,o_mask=0):
+        self.geometry = geometry
+        self.x_mask = 0
+        self.o_mask = 0
+        self.x_counts = [0]*len(geometry.windows)
+        self.o_counts = [0]*len(geometry.windows)
+        self.filled = 0
+        self.result = CONTINUE
+        #replay stored masks through place so the counters match
+        for i in range(geometry.cells):
+            if x_mask >> i & 1:
+                self.place(X,*geometry.index_to_cell(i))
+            elif o_mask >> i & 1:
+                self.place(O,*geometry.index_to_cell(i))
+
+    @property
+    def occupied(self):
+        return self.x_mask | self.o_mask
+
+    def open_mask(self):
+        return self.geometry.full_mask & ~(self.x_mask | self.o_mask)
+
+    def is_open(self,x,y):
+        return not (self.x_mask | self.o_mask) & self.geometry.cell_bit(x,y)
+
+    def piece_at(self,x,y):
+        bit = self.geometry.cell_bit(x,y)
+        if self.x_mask & bit:
+            return X
+        if self.o_mask & bit:
+            return O
+        return 0
+
+    def place(self,piece,x,y):
+        #Only the windows through (x,y) are touched, the placed piece is the only possible new winner
+        geometry = self.geometry
+        index = geometry.cell_index(x,y)
+        if piece == X:
+            self.x_mask |= 1 << index
+            counts = self.x_counts
+        else:
+            self.o_mask |= 1 << index
+            counts = self.o_counts
+        self.filled += 1
+        if self.result not in (CONTINUE,TIE):
+            return
+        for window in geometry.cell_windows[index]:
+            counts[window] += 1
+            if counts[window] == geometry.win_length:
+                self.result = piece
+        if self.result == CONTINUE and self.filled == geometry.cells:
+            self.result = TIE
+
+    def has_open(self):
+        return (self.x_mask | self.o_mask) != self.geometry.full_mask
+
+    def col_open(self,c):
+        mask = self.geometry.col_masks[c]
+        return (self.x_mask | self.o_mask) & mask != mask
+
+    def row_open(self,r):
+        mask = self.geometry.row_masks[r]
+        return (self.x_mask | self.o_mask) & mask != mask
+
+    def winner(self):
+        return self.result
+
+    def scan_winner(self):
+        #Full rescan, reference for the incremental counters
+        if any(self.o_mask & window == window for window in self.geometry.windows):
+            return O
+        if any(self.x_mask & window == window for window in self.geometry.windows):
+            return X
+        if (self.x_mask | self.o_mask) == self.geometry.full_mask:
+            return TIE
+        return CONTINUE
+
+    def to_rows(self):
+        size = self.geometry.size
+        return [[self.piece_at(x,y) for x in range(size)] for y in range(size)]
+
+    def __repr__(self):
+        return f"GridBoard({self.geometry!r}, x_mask={self.x_mask:#x}, o_mask={self.o_mask:#x})"
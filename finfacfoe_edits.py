@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import time
+from collections import deque
+import discord
+from finfacfoe_metrics import EDIT, EDIT_QUEUE, RATE_LIMIT_WAIT, RATE_LIMITED
+
+#Per-game message edit scheduler
+#Edits to different messages go out concurrently, edits queued for the same message
+#before it is sent are merged into one edit carrying the latest state
+#Every edit waits on the rate-limit bucket of its route instead of a fixed sleep
+#SendPacer queues new messages the same way, behind a per-channel and a global bucket
+#
+#Clicks are acknowledged before any edit goes out, see ClickReply. The clicked message is then
+#edited through the click's own interaction token, whose bucket is fresh, and the other boards
+#through their usual routes. One task per message sends its edits in order
+
+#Discord's deadline for the first response to an interaction
+RESPONSE_DEADLINE = 3.0
+
+class RateLimitBucket():
+    #Sliding window of `limit` requests per `per` seconds, like Discord's per-route buckets
+    def __init__(self,limit=5,per=5.0):
+        self.limit = limit
+        self.per = per
+        self.sent = deque()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+        #total seconds spent waiting on this bucket
+        self.waited = 0.0
+
+    async def acquire(self):
+        #returns the seconds this call waited
+        waited = 0.0
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.sent and now-self.sent[0] >= self.per:
+                    self.sent.popleft()
+                if now < self.blocked_until:
+                    delay = self.blocked_until-now
+                elif len(self.sent) >= self.limit:
+                    delay = self.per-(now-self.sent[0])
+                else:
+                    self.sent.append(now)
+                    return waited
+                waited += delay
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+    def block(self,retry_after):
+        #Discord answered 429, hold every request on this route until retry_after passes
+        self.blocked_until = max(self.blocked_until,time.monotonic()+retry_after)
+
+    def idle(self,now):
+        #Nothing waiting, blocked or sent within the window, a new bucket would behave the same
+        return not self.lock.locked() and now >= self.blocked_until and (not self.sent or now-self.sent[-1] >= self.per)
+
+class BucketRegistry():
+    #Every game adds a webhook route, so buckets left idle are dropped, at most once a window
+    def __init__(self,limit=5,per=5.0):
+        self.limit = limit
+        self.per = per
+        self.buckets = {}
+        self.pruned = time.monotonic()
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def get(self,route):
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            self.prune()
+            bucket = self.buckets[route] = RateLimitBucket(self.limit,self.per)
+        return bucket
+
+    def prune(self,force=False):
+        now = time.monotonic()
+        if not force and now-self.pruned < self.per:
+            return
+        self.pruned = now
+        for route in [route for route, bucket in self.buckets.items() if bucket.idle(now)]:
+            del self.buckets[route]
+
+#Buckets are per route, so every game shares them
+BUCKETS = BucketRegistry()
+
+def route_key(msg):
+    #Webhook (followup) messages are limited per webhook token, channel messages per channel
+    webhook = getattr(msg,"webhook",None) or getattr(getattr(msg,"_state",None),"_webhook",None)
+    if webhook is not None:
+        return ("webhook",webhook.id,webhook.token)
+    channel = getattr(msg,"channel",None)
+    if channel is not None:
+        return ("channel",channel.id)
+    return ("message",id(msg))
+
+class ClickReply():
+    #First response to a button click: a deferred update once the click changed the game,
+    #or an ephemeral rejection. Nothing is edited before it is sent
+    def __init__(self,interaction,msg):
+        self.interaction = interaction
+        #the clicked message, edited through its own route if the deferral failed
+        self.msg = msg
+        self.rejection = None
+        #True once deferred, False if that failed
+        self.deferred = asyncio.get_running_loop().create_future()
+
+    def reject(self,text):
+        self.rejection = text
+        return self
+
+    async def send(self):
+        if self.rejection is not None:
+            await self.interaction.response.send_message(self.rejection,ephemeral=True,delete_after=3)
+            return
+        try:
+            await self.interaction.response.defer()
+        except discord.HTTPException:
+            self.deferred.set_result(False)
+            raise
+        self.deferred.set_result(True)
+
+    async def edit(self,**kwargs):
+        #Edit the clicked message through the click's token, the edit waits for the deferral
+        try:
+            deferred = await asyncio.wait_for(asyncio.shield(self.deferred),RESPONSE_DEADLINE)
+        except asyncio.TimeoutError:
+            deferred = False
+        if deferred:
+            return await self.interaction.edit_original_response(**kwargs)
+        return await self.msg.edit(**kwargs)
+
+class EditScheduler():
+    def __init__(self,buckets=BUCKETS,retries=3):
+        self.buckets = buckets
+        self.retries = retries
+        #message -> merged kwargs of the edit not sent yet
+        self.pending = {}
+        #message -> ClickReply of the latest click on it, its token carries the next edit
+        self.replies = {}
+        #message -> when its pending edit was first queued
+        self.queued = {}
+        #message -> task sending edits for it
+        self.tasks = {}
+
+    def schedule(self,msg,reply=None,**kwargs):
+        #Queue an edit, merging it with one that has not been sent yet
+        #a board nobody is shown, like the AI boardmaster's, has no message
+        if msg is None:
+            return
+        key = id(msg)
+        if key in self.pending:
+            self.pending[key][1].update(kwargs)
+        else:
+            self.pending[key] = (msg,dict(kwargs))
+            self.queued[key] = time.perf_counter()
+        if reply is not None:
+            self.replies[key] = reply
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.create_task(self._send(key))
+
+    async def _send(self,key):
+        try:
+            while key in self.pending:
+                if key in self.replies:
+                    #a clicked message, the click's token has a bucket of its own
+                    msg, kwargs = self.pending.pop(key)
+                    reply = self.replies.pop(key)
+                    EDIT_QUEUE.labels("interaction").observe(time.perf_counter()-self.queued.pop(key))
+                    await self._edit(reply,RateLimitBucket(),kwargs,"interaction")
+                    continue
+                msg = self.pending[key][0]
+                route = route_key(msg)
+                bucket = self.buckets.get(route)
+                RATE_LIMIT_WAIT.labels(route[0]).observe(await bucket.acquire())
+                #Take the latest state only once the bucket lets it through, a click that came
+                #in meanwhile gives its token to the edit
+                msg, kwargs = self.pending.pop(key)
+                reply = self.replies.pop(key,None)
+                EDIT_QUEUE.labels(route[0]).observe(time.perf_counter()-self.queued.pop(key))
+                await self._edit(msg if reply is None else reply,bucket,kwargs,route[0])
+        finally:
+            del self.tasks[key]
+
+    async def _edit(self,msg,bucket,kwargs,kind="message"):
+        for attempt in range(self.retries+1):
+            start = time.perf_counter()
+            try:
+                await msg.edit(**kwargs)
+                EDIT.labels(kind).observe(time.perf_counter()-start)
+                return
+            except discord.RateLimited as e:
+                error, retry_after = e, e.retry_after
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    logging.warning(f"Message edit failed: {e}")
+                    return
+                error, retry_after = e, 1.0
+            RATE_LIMITED.labels(kind).inc()
+            if attempt == self.retries:
+                logging.warning(f"Message edit dropped after {attempt+1} rate limited attempts: {error}")
+                return
+            bucket.block(retry_after)
+            RATE_LIMIT_WAIT.labels(kind).observe(await bucket.acquire())
+
+    async def flush(self):
+        #Wait until every queued edit has been sent
+        while self.tasks:
+            await asyncio.gather(*list(self.tasks.values()),return_exceptions=True)
+
+#Discord's global limit on requests from one bot
+GLOBAL_BUCKET = RateLimitBucket(limit=50,per=1.0)
+
+class SendPacer():
+    #Message creation queued behind the channel's bucket and the global one, so a tournament
+    #round starting many games at once spreads its sends instead of bursting into 429s
+    #The bucket locks are fair, sends go out in the order they were queued
+    def __init__(self,buckets=BUCKETS,global_bucket=GLOBAL_BUCKET,retries=3):
+        self.buckets = buckets
+        self.global_bucket = global_bucket
+        self.retries = retries
+
+    async def _acquire(self,bucket):
+        waited = await bucket.acquire()
+        waited += await self.global_bucket.acquire()
+        RATE_LIMIT_WAIT.labels("send").observe(waited)
+
+    async def send(self,channel,**kwargs):
+        #channel.send(**kwargs) once the buckets allow it, HTTP errors other than 429 are raised
+        #creating messages is limited separately from editing them
+        bucket = self.buckets.get(("send",channel.id))
+        await self._acquire(bucket)
+        for attempt in range(self.retries+1):
+            start = time.perf_counter()
+            try:
+                msg = await channel.send(**kwargs)
+                EDIT.labels("send").observe(time.perf_counter()-start)
+                return msg
+            except discord.RateLimited as e:
+                error, retry_after = e, e.retry_after
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+                error, retry_after = e, 1.0
+            RATE_LIMITED.labels("send").inc()
+            if attempt == self.retries:
+                raise error
+            bucket.block(retry_after)
+            await self._acquire(bucket)
@@ -0,0 +1,165 @@
+import math
+import logging
+from enum import Enum
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+
+#Headless FinFacFoe game, the synchronous transition behind FinFacFoeGame.on_update
+#No Discord objects are touched here so it can be driven from scripts, benchmarks and simulators
+#3x3 games run on the precomputed rule table, larger boards on core.GridBoard and the grid rules
+
+MOVE = Enum("MOVE RESULT",["PLACED","OCCUPIED","NOT_TURN","CENTER","LOCKED"])
+
+#Per-move traces, at DEBUG so they cost a level check in production
+LOG = logging.getLogger("finfacfoe.game")
+
+def format_board(x_mask,o_mask,size=core.SIZE):
+    #debug_board from the raw masks, so a log record can format a snapshot later
+    def replacer(bit):
+        if x_mask & bit:
+            return "X"
+        elif o_mask & bit:
+            return "O"
+        else:
+            return " "
+    rows = [[replacer(1 << (y*size+x)) for x in range(size)] for y in range(size)]
+    return "\n".join(str(row) for row in rows)
+
+class FinFacFoeState():
+    #CONSTANTS
+    X = core.X #Challenger
+    O = core.O #Boardmaster
+    TIE = core.TIE
+    CONTINUE = core.CONTINUE
+    STATES = core.STATES
+    CHECK = core.CHECK
+
+    def __init__(self,size=core.SIZE,win_length=core.SIZE):
+        #Board, win_length in a row on a size x size grid
+        self.geometry = core.geometry(size,win_length)
+        self.is_classic = size == core.SIZE
+        self.core = core.BitBoard() if self.is_classic else core.GridBoard(self.geometry)
+
+        #Piece counter
+        self.count = 0
+
+        #Current player
+        self.current_player = self.X
+
+        #Col/Row locks
+        self.c = None
+        self.r = None
+
+        #Record current input coords
+        self.x = None
+        self.y = None
+
+        #Boardmaster current trap state
+        self.bm_state = self.STATES.FREE
+
+        #Result of the last placed move
+        self.result = self.CONTINUE
+
+        #Cell index of every placed move in order, what the move log records
+        self.moves = bytearray()
+
+        #Logger for this game's trace, FinFacFoeGame swaps in one carrying the game id
+        self.log = LOG
+
+    @property
+    def board(self):
+        #nested list view of the bitboard, only used for display
+        return self.core.to_rows()
+
+    def get_current_turn(self):
+        return math.floor(self.count*0.5)+1
+
+    def save_input(self,x,y):
+        self.x = x
+        self.y = y
+
+    def transfer_turn_to(self,piece):
+        self.count +=1
+        self.current_player = piece
+
+    def get_rule_entry(self):
+        #one lookup into the precomputed rule table for the current position
+        return rules.lookup(self.core.occupied,self.bm_state,self.c,self.r)
+
+    def legal_moves(self):
+        if not self.is_classic:
+            return rules.grid_legal_mask(self.geometry,self.core.occupied,self.bm_state,self.c,self.r)
+        return rules.legal_mask(self.get_rule_entry())
+
+    def check_rule(self):
+        #Assume position is unoccupied
+        if not self.is_classic:
+            return self.check_grid_rule()
+        entry = self.get_rule_entry()
+        index = core.cell_index(self.x,self.y)
+
+        if not entry >> index & 1:
+            self.log.debug("Invalid %s move; state remains %s","X" if self.current_player == self.X else "O",self.bm_state.name)
+            return False
+
+        #Challenger moves leave the boardmaster lock untouched
+        if self.current_player == self.O:
+            self.bm_state, self.c, self.r = rules.next_state(entry,index)
+        self.log.debug("Valid %s move; state now %s","X" if self.current_player == self.X else "O",self.bm_state.name)
+        return True
+
+    def check_grid_rule(self):
+        #check_rule for boards without a rule table
+        transition = rules.grid_transition(self.geometry,self.core.occupied,self.bm_state,self.c,self.r,self.x,self.y)
+        if transition is None:
+            self.log.debug("Invalid %s move; state remains %s","X" if self.current_player == self.X else "O",self.bm_state.name)
+            return False
+        if self.current_player == self.O:
+            self.bm_state, self.c, self.r = transition
+        self.log.debug("Valid %s move; state now %s","X" if self.current_player == self.X else "O",self.bm_state.name)
+        return True
+
+    def is_moves_available(self,check_axis):
+        match check_axis:
+            case self.CHECK.ANY:
+                return self.core.has_open()
+            case self.CHECK.COL:
+                return self.core.col_open(self.c)
+            case self.CHECK.ROW:
+                return self.core.row_open(self.r)
+
+    def is_won(self):
+        #line masks are checked in the core, O before X then tie
+        #GridBoard keeps the result up to date as pieces are placed
+        return self.core.winner()
+
+    def update_board(self):
+        self.core.place(self.current_player,self.x,self.y)
+
+    def precheck(self,piece,x,y):
+        #Checks that need no rule lookup, returns None when the move may go to the rules
+        if not self.core.is_open(x,y):
+            return MOVE.OCCUPIED
+        if self.current_player != piece:
+            return MOVE.NOT_TURN
+        return None
+
+    def play(self,piece,x,y):
+        #Full synchronous transition for one click of piece on (x,y)
+        outcome = self.precheck(piece,x,y)
+        if outcome is not None:
+            return outcome
+
+        self.save_input(x,y)
+        if not self.check_rule():
+            #first move of either side can only fail on the center
+            return MOVE.CENTER if self.count <= 1 else MOVE.LOCKED
+
+        self.update_board()
+        self.moves.append(self.geometry.cell_index(x,y))
+        self.transfer_turn_to(self.O if piece == self.X else self.X)
+        self.result = self.is_won()
+        return MOVE.PLACED
+
+    def debug_board(self):
+        return format_board(self.core.x_mask,self.core.o_mask,self.geometry.size)
@@ -0,0 +1,780 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+import aiohttp
+from aiohttp import web, WSMsgType
+
+#Local stand-in for the Discord gateway and the parts of the HTTP API the bot uses
+#Point the bot at it with DISCORD_API_BASE=<base url printed on start>, leave SHARD_COUNT unset
+#so the shard count comes from /gateway/bot
+#
+#Guild ids are spread so that (guild_id >> 22) % shards hashes every shard to its own guilds,
+#the same way Discord routes guild events
+#
+#HTTP requests can be delayed by a simulated latency and are rate limited per route the way Discord
+#answers bots: fixed windows per channel and per webhook token plus a global limit, a 429 with
+#retry_after when one is exhausted. Interaction callbacks are exempt, and like on Discord the
+#interaction webhooks do not count against the global limit
+
+API_VERSION = 10
+DISCORD_EPOCH = 1420070400000
+EPHEMERAL = 1 << 6
+
+#Simulated limits as (requests, window seconds), close to what Discord gives a bot
+DISCORD_RATE_LIMITS = {"channel": (5,5.0),"webhook": (5,2.0)}
+DISCORD_GLOBAL_LIMIT = (50,1.0)
+
+#Gateway opcodes
+DISPATCH, HEARTBEAT, IDENTIFY, RESUME, REQUEST_MEMBERS, HELLO, HEARTBEAT_ACK = 0, 1, 2, 6, 8, 10, 11
+
+def reply(data,status=200):
+    #discord.py only decodes bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode(),status=status,content_type="application/json")
+
+def iso_now():
+    return datetime.now(timezone.utc).isoformat()
+
+class Snowflakes():
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def next(self):
+        ms = int(time.time()*1000)-DISCORD_EPOCH
+        return (ms << 22) | (next(self.counter) & 0x3FFFFF)
+
+class FakeBucket():
+    #Fixed window of limit requests every per seconds
+    __slots__ = ("limit","per","remaining","reset_at")
+
+    def __init__(self,limit,per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self,now):
+        #0 when the request may go, otherwise the seconds until the window resets
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now+self.per
+        if not self.remaining:
+            return self.reset_at-now
+        self.remaining -= 1
+        return 0.0
+
+def user_payload(user_id,name,bot=False):
+    return {"id": str(user_id),"username": name,"discriminator": "0","global_name": name,"avatar": None,"bot": bot}
+
+class FakeDiscord():
+    def __init__(self,guilds=1,channels_per_guild=2,members_per_guild=4,shards=1,host="127.0.0.1",port=0,
+        latency=0.0,jitter=0.0,rate_limits=None,global_limit=None,edit_latency=0.0):
+        self.host = host
+        self.port = port
+        self.shard_count = shards
+        self.ids = Snowflakes()
+
+        #seconds added to every HTTP request, plus up to jitter more
+        self.latency = latency
+        self.jitter = jitter
+        #seconds more for message edits, a slow edit endpoint must not hold up responses
+        self.edit_latency = edit_latency
+        #route kind -> (requests, seconds), see DISCORD_RATE_LIMITS, None for no limits
+        self.rate_limits = rate_limits or {}
+        self.global_bucket = FakeBucket(*global_limit) if global_limit else None
+        #(route kind, channel id or webhook token) -> FakeBucket
+        self.buckets = {}
+        #requests and 429s per route kind
+        self.requests = Counter()
+        self.rate_limited = Counter()
+
+        self.application_id = self.ids.next()
+        self.bot_user = user_payload(self.application_id,"FinFacFoe",bot=True)
+
+        #guild id -> {"channels": [...], "members": [user payloads]}
+        self.guilds = {}
+        base = int(time.time()*1000)-DISCORD_EPOCH
+        for i in range(guilds):
+            guild_id = (base-guilds+i) << 22
+            members = [user_payload(self.ids.next(),f"player{i}_{m}") for m in range(members_per_guild)]
+            self.guilds[guild_id] = {
+                "channels": [self.ids.next() for _ in range(channels_per_guild)],
+                "members": members,
+            }
+        #user id -> (guild id, user payload), interactions look their user up here
+        self.users = {int(user["id"]): (guild_id,user) for guild_id, guild in self.guilds.items() for user in guild["members"]}
+        self.channel_guilds = {channel_id: guild_id for guild_id, guild in self.guilds.items() for channel_id in guild["channels"]}
+
+        self.commands = []
+        #message id -> message payload
+        self.messages = {}
+        #interaction id -> record, see new_interaction
+        self.interactions = {}
+        #token -> interaction id
+        self.tokens = {}
+        #user id -> DM channel id, and back
+        self.dm_channels = {}
+        self.dm_users = {}
+
+        #shard id -> websocket, and gateway bookkeeping
+        self.sockets = {}
+        self.sequence = {}
+        self.identified = asyncio.Event()
+        self.synced = asyncio.Event()
+
+        self.app = web.Application(middlewares=[self.simulate])
+        self.app.add_routes(self.routes())
+        self.runner = None
+
+    #------------------------------
+    #lifecycle
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/api/v{API_VERSION}"
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner,self.host,self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.base_url
+
+    async def stop(self):
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def shard_for(self,guild_id):
+        #DMs arrive on shard 0
+        return (guild_id >> 22) % self.shard_count if guild_id else 0
+
+    #------------------------------
+    #payloads
+
+    def member_payload(self,user,with_user=True):
+        member = {"roles": [],"joined_at": iso_now(),"deaf": False,"mute": False,"flags": 0,"permissions": "2199023255551"}
+        if with_user:
+            member["user"] = user
+        return member
+
+    def channel_payload(self,guild_id,channel_id):
+        return {"id": str(channel_id),"type": 0,"guild_id": str(guild_id),"name": f"fin-{channel_id}","position": 0,
+            "permission_overwrites": [],"nsfw": False,"parent_id": None,"topic": None,"rate_limit_per_user": 0,"last_message_id": None}
+
+    def guild_payload(self,guild_id):
+        guild = self.guilds[guild_id]
+        members = [self.member_payload(user) for user in guild["members"]+[self.bot_user]]
+        return {
+            "id": str(guild_id),"name": f"guild-{guild_id}","icon": None,"owner_id": guild["members"][0]["id"],
+            "features": [],"emojis": [],"stickers": [],"mfa_level": 0,"verification_level": 0,
+            "default_message_notifications": 0,"explicit_content_filter": 0,"premium_tier": 0,"nsfw_level": 0,
+            "preferred_locale": "en-US","system_channel_flags": 0,"afk_timeout": 300,"large": False,"unavailable": False,
+            "roles": [{"id": str(guild_id),"name": "@everyone","permissions": "2199023255551","position": 0,"color": 0,
+                "hoist": False,"managed": False,"mentionable": False,"flags": 0}],
+            "member_count": len(members),"members": members,
+            "channels": [self.channel_payload(guild_id,channel_id) for channel_id in guild["channels"]],
+            "threads": [],"presences": [],"voice_states": [],"stage_instances": [],"guild_scheduled_events": [],
+            "joined_at": iso_now(),
+        }
+
+    def message_payload(self,message_id,channel_id,content="",components=None,flags=0,interaction_id=None):
+        return {
+            "id": str(message_id),"channel_id": str(channel_id),"author": self.bot_user,"content": content or "",
+            "timestamp": iso_now(),"edited_timestamp": None,"tts": False,"mention_everyone": False,"mentions": [],
+            "mention_roles": [],"attachments": [],"embeds": [],"pinned": False,"type": 0,
+            "components": components or [],"flags": flags,"application_id": str(self.application_id),
+            "webhook_id": str(self.application_id) if interaction_id else None,
+        }
+
+    def dm_channel_payload(self,channel_id):
+        return {"id": str(channel_id),"type": 1,"last_message_id": None,"recipients": [self.find_user(None,self.dm_users[channel_id])]}
+
+    def find_user(self,guild_id,user_id):
+        #guild_id None looks in every guild
+        member_guild, user = self.users[user_id]
+        if guild_id is not None and member_guild != guild_id:
+            raise KeyError(user_id)
+        return user
+
+    def new_interaction(self,type,guild_id,channel_id,user_id,data,message=None):
+        interaction_id = self.ids.next()
+        token = f"token-{interaction_id}"
+        payload = {
+            "id": str(interaction_id),"application_id": str(self.application_id),"type": type,"token": token,
+            "version": 1,"channel_id": str(channel_id),
+            "data": data,"app_permissions": "2199023255551","locale": "en-US",
+            "entitlements": [],"attachment_size_limit": 8388608,
+        }
+        if guild_id is None:
+            #a click in the bot's DMs
+            payload.update({"channel": self.dm_channel_payload(channel_id),"user": self.find_user(None,user_id),
+                "authorizing_integration_owners": {"1": str(user_id)},"context": 1})
+        else:
+            payload.update({"guild_id": str(guild_id),"channel": self.channel_payload(guild_id,channel_id),
+                "member": self.member_payload(self.find_user(guild_id,user_id)),"guild_locale": "en-US",
+                "authorizing_integration_owners": {"0": str(guild_id)},"context": 0})
+        if message is not None:
+            payload["message"] = message
+        self.interactions[interaction_id] = {
+            "id": interaction_id,"token": token,"guild_id": guild_id,"channel_id": channel_id,"user_id": user_id,
+            "message_id": None if message is None else int(message["id"]),
+            #the original response of a component interaction is the clicked message from the start
+            "sent_ns": time.perf_counter_ns(),"ack_ns": None,"response_type": None,"original_id": None if message is None else int(message["id"]),
+            "acked": asyncio.get_running_loop().create_future(),
+            #messages created by the response and followups, and an event set on each new one
+            "messages": [],
+            "message_sent": asyncio.Event(),
+        }
+        self.tokens[token] = interaction_id
+        return payload
+
+    #------------------------------
+    #driving the bot
+
+    async def dispatch(self,shard_id,event,data):
+        ws = self.sockets[shard_id]
+        self.sequence[shard_id] += 1
+        await ws.send_str(json.dumps({"op": DISPATCH,"t": event,"s": self.sequence[shard_id],"d": data}))
+
+    def command_payload(self,guild_id,channel_id,user_id,name,options=()):
+        #options: (name, type, value) tuples, user options are resolved from the guild members
+        #"group sub" names a subcommand of a command group
+        name, _, subcommand = name.partition(" ")
+        resolved = {"users": {},"members": {}}
+        data_options = []
+        for option_name, option_type, value in options:
+            data_options.append({"name": option_name,"type": option_type,"value": str(value) if option_type == 6 else value})
+            if option_type == 6:
+                user = self.find_user(guild_id,int(value))
+                resolved["users"][user["id"]] = user
+                resolved["members"][user["id"]] = self.member_payload(user,with_user=False)
+        if subcommand:
+            data_options = [{"name": subcommand,"type": 1,"options": data_options}]
+        command = next((c for c in self.commands if c["name"] == name),{"id": "0"})
+        data = {"id": command["id"],"name": name,"type": 1,"options": data_options,"resolved": resolved}
+        return self.new_interaction(2,guild_id,channel_id,user_id,data)
+
+    def click_payload(self,message_id,custom_id,user_id):
+        message = self.messages[message_id]
+        data = {"custom_id": custom_id,"component_type": 2}
+        body = {key: value for key, value in message.items() if key != "guild_id"}
+        return self.new_interaction(3,message["guild_id"],int(message["channel_id"]),user_id,data,message=body)
+
+    async def send_command(self,guild_id,channel_id,user_id,name,options=()):
+        payload = self.command_payload(guild_id,channel_id,user_id,name,options)
+        await self.dispatch(self.shard_for(guild_id),"INTERACTION_CREATE",payload)
+        return int(payload["id"])
+
+    async def click(self,message_id,custom_id,user_id):
+        payload = self.click_payload(message_id,custom_id,user_id)
+        await self.dispatch(self.shard_for(self.messages[message_id]["guild_id"]),"INTERACTION_CREATE",payload)
+        return int(payload["id"])
+
+    async def wait_ack(self,interaction_id,timeout=3.0):
+        #Discord's own deadline for the first response is 3 seconds
+        record = self.interactions[interaction_id]
+        try:
+            await asyncio.wait_for(asyncio.shield(record["acked"]),timeout)
+        except asyncio.TimeoutError:
+            return None
+        return record
+
+    async def wait_boards(self,interaction_id,timeout=3.0,tiles=1):
+        #Public and private board messages sent as followups to a /fin command
+        #with tiles > 1 these are lists of the tile messages of each board
+        record = self.interactions[interaction_id]
+        deadline = time.monotonic()+timeout
+        while True:
+            boards = [self.messages[m] for m in record["messages"] if m in self.messages and self.messages[m]["components"]]
+            if len(boards) >= 2*tiles:
+                public = [b for b in boards if not b["flags"] & EPHEMERAL]
+                private = [b for b in boards if b["flags"] & EPHEMERAL]
+                if tiles > 1:
+                    return public, private
+                return public[0], private[0]
+            record["message_sent"].clear()
+            try:
+                await asyncio.wait_for(record["message_sent"].wait(),deadline-time.monotonic())
+            except asyncio.TimeoutError:
+                return None
+
+    async def wait_edit(self,message_id,content,timeout=3.0):
+        #True once the message's content is no longer content
+        deadline = time.monotonic()+timeout
+        while self.messages[message_id]["content"] == content:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    @staticmethod
+    def custom_ids(message):
+        return [button["custom_id"] for row in message["components"] for button in row["components"]]
+
+    def create_message(self,channel_id,guild_id,content,components,flags=0,interaction_id=None):
+        message_id = self.ids.next()
+        message = self.message_payload(message_id,channel_id,content,components,flags,interaction_id)
+        message["guild_id"] = guild_id
+        self.messages[message_id] = message
+        if interaction_id is not None:
+            record = self.interactions[interaction_id]
+            record["messages"].append(message_id)
+            record["message_sent"].set()
+        return message
+
+    def public(self,message):
+        return {key: value for key, value in message.items() if key != "guild_id"}
+
+    #------------------------------
+    #HTTP API
+
+    def routes(self):
+        base = f"/api/v{API_VERSION}"
+        return [
+            web.get("/gateway",self.gateway),
+            web.get(base+"/gateway/bot",self.get_gateway_bot),
+            web.get(base+"/users/@me",self.get_me),
+            web.post(base+"/users/@me/channels",self.create_dm),
+            web.get(base+"/oauth2/applications/@me",self.get_application),
+            web.put(base+"/applications/{app}/commands",self.put_commands),
+            web.put(base+"/applications/{app}/guilds/{guild}/commands",self.put_commands),
+            web.get(base+"/applications/{app}/commands",self.get_commands),
+            web.post(base+"/interactions/{id}/{token}/callback",self.interaction_callback),
+            web.post(base+"/webhooks/{app}/{token}",self.webhook_send),
+            web.get(base+"/webhooks/{app}/{token}/messages/{message}",self.webhook_get),
+            web.patch(base+"/webhooks/{app}/{token}/messages/{message}",self.webhook_edit),
+            web.delete(base+"/webhooks/{app}/{token}/messages/{message}",self.webhook_delete),
+            web.post(base+"/channels/{channel}/messages",self.channel_send),
+            web.patch(base+"/channels/{channel}/messages/{message}",self.channel_edit),
+            web.route("*",base+"/{tail:.*}",self.not_found),
+        ]
+
+    @staticmethod
+    def route_of(request):
+        #(route kind, major parameter) of an HTTP request, what its rate limit is keyed by
+        path = request.path
+        if "/interactions/" in path:
+            return "interaction", None
+        if "/webhooks/" in path:
+            return "webhook", request.match_info.get("token")
+        if "/channels/" in path:
+            return "channel", request.match_info.get("channel")
+        return "other", None
+
+    @web.middleware
+    async def simulate(self,request,handler):
+        #Latency and rate limits on the HTTP API, the gateway websocket is left alone
+        if request.path == "/gateway":
+            return await handler(request)
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency+random.random()*self.jitter)
+        if self.edit_latency and request.method == "PATCH":
+            await asyncio.sleep(self.edit_latency)
+        kind, major = self.route_of(request)
+        self.requests[kind] += 1
+        limit = self.rate_limits.get(kind)
+        if limit is None:
+            return await handler(request)
+
+        now = time.monotonic()
+        if self.global_bucket is not None and kind != "webhook":
+            retry_after = self.global_bucket.take(now)
+            if retry_after:
+                return self.too_many_requests(kind,retry_after,self.global_bucket,is_global=True)
+        bucket = self.buckets.get((kind,major))
+        if bucket is None:
+            bucket = self.buckets[(kind,major)] = FakeBucket(*limit)
+        retry_after = bucket.take(now)
+        if retry_after:
+            return self.too_many_requests(kind,retry_after,bucket)
+        response = await handler(request)
+        response.headers.update({"X-RateLimit-Limit": str(bucket.limit),"X-RateLimit-Remaining": str(bucket.remaining),
+            "X-RateLimit-Reset-After": f"{bucket.reset_at-now:.3f}","X-RateLimit-Bucket": kind})
+        return response
+
+    def too_many_requests(self,kind,retry_after,bucket,is_global=False):
+        self.rate_limited["global" if is_global else kind] += 1
+        response = reply({"message": "You are being rate limited.","retry_after": round(retry_after,3),"global": is_global,"code": 0},status=429)
+        #discord.py treats a 429 without Via as a Cloudflare ban
+        response.headers.update({"Via": "1.1 google","Retry-After": str(max(1,round(retry_after))),
+            "X-RateLimit-Limit": str(bucket.limit),"X-RateLimit-Remaining": "0","X-RateLimit-Reset-After": f"{retry_after:.3f}",
+            "X-RateLimit-Bucket": kind,"X-RateLimit-Scope": "global" if is_global else "user"})
+        if is_global:
+            response.headers["X-RateLimit-Global"] = "true"
+        return response
+
+    async def read_json(self,request):
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == "payload_json":
+                    return json.loads(await part.text())
+            return {}
+        if request.can_read_body:
+            return await request.json()
+        return {}
+
+    async def not_found(self,request):
+        return reply({"message": f"Unknown route {request.method} {request.path}","code": 0},status=404)
+
+    async def get_gateway_bot(self,request):
+        return reply({
+            "url": f"ws://{self.host}:{self.port}/gateway","shards": self.shard_count,
+            "session_start_limit": {"total": 1000,"remaining": 1000,"reset_after": 0,"max_concurrency": 16},
+        })
+
+    async def get_me(self,request):
+        return reply(self.bot_user)
+
+    async def get_application(self,request):
+        return reply({"id": str(self.application_id),"name": "FinFacFoe","icon": None,"description": "",
+            "bot_public": True,"bot_require_code_grant": False,"verify_key": "0"*64,"flags": 0,
+            "owner": self.bot_user,"team": None,"rpc_origins": [],"summary": ""})
+
+    async def put_commands(self,request):
+        commands = await self.read_json(request)
+        for command in commands:
+            command.setdefault("id",str(self.ids.next()))
+            command.setdefault("application_id",str(self.application_id))
+            command.setdefault("version",str(self.ids.next()))
+            command.setdefault("default_member_permissions",None)
+            command.setdefault("type",1)
+        if "guild" not in request.match_info:
+            self.commands = commands
+            self.synced.set()
+        return reply(commands)
+
+    async def get_commands(self,request):
+        return reply(self.commands)
+
+    def acknowledge(self,record,response_type):
+        if record["ack_ns"] is None:
+            record["ack_ns"] = time.perf_counter_ns()
+            record["response_type"] = response_type
+            if not record["acked"].done():
+                record["acked"].set_result(record)
+
+    async def interaction_callback(self,request):
+        record = self.interactions.get(int(request.match_info["id"]))
+        if record is None:
+            return reply({"message": "Unknown interaction","code": 10062},status=404)
+        if record["ack_ns"] is not None:
+            return reply({"message": "Interaction has already been acknowledged.","code": 40060},status=400)
+        return reply(self.apply_response(record,await self.read_json(request)))
+
+    def apply_response(self,record,body):
+        #Act on an interaction response, whether the bot POSTed it to the callback route or
+        #answered the HTTP request of an interactions endpoint with it
+        response_type = body.get("type")
+        data = body.get("data") or {}
+        resource = None
+
+        #4 new message, 5 deferred message, 6 deferred update, 7 update the clicked message
+        if response_type in (4,5):
+            message = self.create_message(record["channel_id"],record["guild_id"],data.get("content"),
+                data.get("components"),data.get("flags",0),record["id"])
+            record["original_id"] = int(message["id"])
+            resource = {"type": response_type,"message": self.public(message)}
+        elif response_type == 7:
+            message = self.messages.get(record["message_id"])
+            if message is not None:
+                message.update({key: data[key] for key in ("content","components") if key in data})
+                resource = {"type": 7,"message": self.public(message)}
+        if response_type in (6,7):
+            #the clicked message is the original response of a component interaction
+            record["original_id"] = record["message_id"]
+        self.acknowledge(record,response_type)
+
+        payload = {"interaction": {"id": str(record["id"]),"type": 2,"response_message_id": str(record["original_id"]) if record["original_id"] else None,
+            "response_message_loading": response_type == 5,"response_message_ephemeral": bool(data.get("flags",0) & EPHEMERAL)}}
+        if resource is not None:
+            payload["resource"] = resource
+        return payload
+
+    def record_for_token(self,token):
+        interaction_id = self.tokens.get(token)
+        return None if interaction_id is None else self.interactions[interaction_id]
+
+    async def webhook_send(self,request):
+        record = self.record_for_token(request.match_info["token"])
+        if record is None:
+            return reply({"message": "Unknown Webhook","code": 10015},status=404)
+        body = await self.read_json(request)
+        message = self.create_message(record["channel_id"],record["guild_id"],body.get("content"),
+            body.get("components"),body.get("flags",0),record["id"])
+        return reply(self.public(message))
+
+    def webhook_message(self,request):
+        record = self.record_for_token(request.match_info["token"])
+        if record is None:
+            return None
+        message_id = request.match_info["message"]
+        message_id = record["original_id"] if message_id == "@original" else int(message_id)
+        return self.messages.get(message_id)
+
+    async def webhook_get(self,request):
+        message = self.webhook_message(request)
+        if message is None:
+            return reply({"message": "Unknown Message","code": 10008},status=404)
+        return reply(self.public(message))
+
+    async def webhook_edit(self,request):
+        message = self.webhook_message(request)
+        if message is None:
+            return reply({"message": "Unknown Message","code": 10008},status=404)
+        body = await self.read_json(request)
+        message.update({key: body[key] for key in ("content","components") if key in body})
+        message["edited_timestamp"] = iso_now()
+        return reply(self.public(message))
+
+    async def webhook_delete(self,request):
+        message = self.webhook_message(request)
+        if message is not None:
+            self.messages.pop(int(message["id"]),None)
+        return web.Response(status=204)
+
+    async def channel_send(self,request):
+        channel_id = int(request.match_info["channel"])
+        guild_id = self.channel_guilds.get(channel_id)
+        body = await self.read_json(request)
+        message = self.create_message(channel_id,guild_id,body.get("content"),body.get("components"))
+        return reply(self.public(message))
+
+    async def create_dm(self,request):
+        user_id = int((await self.read_json(request))["recipient_id"])
+        if user_id not in self.dm_channels:
+            channel_id = self.ids.next()
+            self.dm_channels[user_id] = channel_id
+            self.dm_users[channel_id] = user_id
+        return reply(self.dm_channel_payload(self.dm_channels[user_id]))
+
+    def channel_messages(self,channel_id):
+        return [message for message in self.messages.values() if int(message["channel_id"]) == channel_id]
+
+    async def channel_edit(self,request):
+        message = self.messages.get(int(request.match_info["message"]))
+        if message is None:
+            return reply({"message": "Unknown Message","code": 10008},status=404)
+        body = await self.read_json(request)
+        message.update({key: body[key] for key in ("content","components") if key in body})
+        message["edited_timestamp"] = iso_now()
+        return reply(self.public(message))
+
+    #------------------------------
+    #gateway
+
+    async def gateway(self,request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({"op": HELLO,"d": {"heartbeat_interval": 41250}}))
+        shard_id = None
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            frame = json.loads(msg.data)
+            op = frame.get("op")
+            if op == HEARTBEAT:
+                await ws.send_str(json.dumps({"op": HEARTBEAT_ACK}))
+            elif op == IDENTIFY:
+                shard_id = frame["d"].get("shard",[0,1])[0]
+                await self.identify(shard_id,ws)
+            elif op == RESUME and shard_id is not None:
+                await self.dispatch(shard_id,"RESUMED",{})
+            elif op == REQUEST_MEMBERS and shard_id is not None:
+                data = frame["d"]
+                guild_id = int(data["guild_id"])
+                members = [self.member_payload(user) for user in self.guilds[guild_id]["members"]+[self.bot_user]]
+                await self.dispatch(shard_id,"GUILD_MEMBERS_CHUNK",{"guild_id": str(guild_id),"members": members,
+                    "chunk_index": 0,"chunk_count": 1,"nonce": data.get("nonce")})
+        if shard_id is not None and self.sockets.get(shard_id) is ws:
+            del self.sockets[shard_id]
+        return ws
+
+    async def identify(self,shard_id,ws):
+        self.sockets[shard_id] = ws
+        self.sequence[shard_id] = 0
+        guilds = [guild_id for guild_id in self.guilds if self.shard_for(guild_id) == shard_id]
+        await self.dispatch(shard_id,"READY",{
+            "v": API_VERSION,"user": self.bot_user,"guilds": [{"id": str(g),"unavailable": True} for g in guilds],
+            "session_id": f"session-{shard_id}","resume_gateway_url": f"ws://{self.host}:{self.port}/gateway",
+            "shard": [shard_id,self.shard_count],"application": {"id": str(self.application_id),"flags": 0},
+            "private_channels": [],"relationships": [],
+        })
+        for guild_id in guilds:
+            await self.dispatch(shard_id,"GUILD_CREATE",self.guild_payload(guild_id))
+        if len(self.sockets) == self.shard_count:
+            self.identified.set()
+
+#------------------------------
+
+def free_port(host="127.0.0.1"):
+    with socket.socket() as sock:
+        sock.bind((host,0))
+        return sock.getsockname()[1]
+
+def bot_env(base_url,**extra):
+    env = dict(os.environ)
+    env.update({"DISCORD_API_BASE": base_url,"DISCORD_TOKEN2": "fake-token"})
+    env.pop("SHARD_COUNT",None)
+    env.pop("DISCORD_GUILD_ID2",None)
+    env.update({key: str(value) for key, value in extra.items()})
+    return env
+
+async def smoke(guilds,shards,timeout=60.0):
+    #Start the bot against the fake, check every shard connects and /fin honours the channel config
+    fake = FakeDiscord(guilds=guilds,shards=shards,members_per_guild=6)
+    base_url = await fake.start()
+    workdir = tempfile.mkdtemp(prefix="finfacfoe-smoke-")
+    guild_ids = list(fake.guilds)
+    allowed = {str(g): [fake.guilds[g]["channels"][0]] for g in guild_ids}
+    config_path = os.path.join(workdir,"channels.json")
+    metrics_port = free_port()
+    with open(config_path,"w") as f:
+        json.dump({"allow_unlisted": False,"guilds": allowed},f)
+
+    env = bot_env(base_url,CHANNEL_CONFIG_PATH=config_path,CHANNEL_RELOAD_INTERVAL=0.5,
+        GAME_STORE_PATH=os.path.join(workdir,"games.db"),COMMAND_SYNC_STATE=os.path.join(workdir,"sync.json"),METRICS_PORT=metrics_port,
+        AI_MOVE_BUDGET=0.2)
+    bot = subprocess.Popen([sys.executable,os.path.join(os.path.dirname(os.path.abspath(__file__)),"finfacfoe.py")],env=env)
+    try:
+        await asyncio.wait_for(asyncio.gather(fake.identified.wait(),fake.synced.wait()),timeout)
+        print(f"{len(fake.sockets)}/{shards} shards identified, {len(fake.commands)} commands synced")
+        #give the shards time to finish processing their GUILD_CREATE events
+        await asyncio.sleep(1.0)
+
+        failures = 0
+        for guild_id in guild_ids[:min(len(guild_ids),2*shards)]:
+            boardmaster, challenger = fake.guilds[guild_id]["members"][:2]
+            allowed_channel, other_channel = fake.guilds[guild_id]["channels"][:2]
+            ok = await fake.wait_ack(await fake.send_command(guild_id,allowed_channel,int(boardmaster["id"]),"fin",[("challenger",6,challenger["id"])]))
+            denied = await fake.wait_ack(await fake.send_command(guild_id,other_channel,int(boardmaster["id"]),"fin",[("challenger",6,challenger["id"])]),timeout=1.0)
+            if ok is None or denied is not None and denied["response_type"] != 4:
+                failures += 1
+            print(f"guild {guild_id} shard {fake.shard_for(guild_id)}: allowed channel {'answered' if ok else 'NO ANSWER'}, other channel {'answered' if denied else 'ignored'}")
+            if ok is None:
+                continue
+
+            #the challenger opens on a corner of the public board, the click is deferred and
+            #the board edited after it
+            boards = await fake.wait_boards(ok["id"])
+            clicked = boards and await fake.wait_ack(await fake.click(int(boards[0]["id"]),fake.custom_ids(boards[0])[0],int(challenger["id"])))
+            updated = bool(clicked) and clicked["response_type"] == 6 and await fake.wait_edit(int(boards[0]["id"]),boards[0]["content"])
+            failures += not updated
+            print(f"  board click {'updated the board' if updated else 'answered, board NOT updated' if clicked else 'NO ANSWER'}")
+
+        #a 7x7 board takes four tile messages per player, a click on the last public tile
+        #re-renders that tile and moves the status line on the first one
+        guild_id = guild_ids[0]
+        boardmaster, challenger = fake.guilds[guild_id]["members"][4:6]
+        started = await fake.wait_ack(await fake.send_command(guild_id,fake.guilds[guild_id]["channels"][0],int(boardmaster["id"]),"fin",
+            [("challenger",6,challenger["id"]),("size",4,7)]))
+        boards = started and await fake.wait_boards(started["id"],timeout=10.0,tiles=4)
+        clicked = None
+        if boards:
+            public, private = boards
+            status = public[0]["content"]
+            clicked = await fake.wait_ack(await fake.click(int(public[-1]["id"]),fake.custom_ids(public[-1])[-1],int(challenger["id"])))
+        tiled = bool(clicked) and clicked["response_type"] == 6 and await fake.wait_edit(int(public[0]["id"]),status)
+        print(f"7x7 board: {f'{len(public)}+{len(private)} tiles, corner click updated the status tile' if tiled else 'FAILED'}")
+        failures += not tiled
+
+        #a four player bracket posts both first round games, public boards in the channel
+        #and private boards in the boardmasters' DMs
+        channel_id = fake.guilds[guild_id]["channels"][0]
+        players = [int(member["id"]) for member in fake.guilds[guild_id]["members"][:4]]
+        before = len(fake.channel_messages(channel_id))
+        await fake.wait_ack(await fake.send_command(guild_id,channel_id,players[0],"tournament create",[("format",3,"bracket")]))
+        for player in players:
+            await fake.wait_ack(await fake.send_command(guild_id,channel_id,player,"tournament join"))
+        await fake.wait_ack(await fake.send_command(guild_id,channel_id,players[0],"tournament start"))
+        await asyncio.sleep(1.0)
+        public = [m for m in fake.channel_messages(channel_id)[before:] if m["components"]]
+        private = [m for dm in fake.dm_channels.values() for m in fake.channel_messages(dm) if m["components"]]
+        clicked = private and await fake.wait_ack(await fake.click(int(private[0]["id"]),fake.custom_ids(private[0])[0],fake.dm_users[int(private[0]["channel_id"])]))
+        started = len(public) == 2 and len(private) == 2 and bool(clicked)
+        print(f"tournament: {f'{len(public)} public and {len(private)} DM boards, DM board click answered' if started else 'FAILED'}")
+        failures += not started
+
+        #/finbot with the user as boardmaster, the AI challenger opens on the public board
+        channel_id = fake.guilds[guild_id]["channels"][0]
+        user = fake.guilds[guild_id]["members"][5]
+        started = await fake.wait_ack(await fake.send_command(guild_id,channel_id,int(user["id"]),"finbot",[("play_as",3,"boardmaster")]))
+        boards = started and await fake.wait_boards(started["id"])
+        opened = False
+        deadline = time.monotonic()+5.0
+        while boards and not opened and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+            public = fake.messages[int(boards[0]["id"])]
+            opened = any(button["label"] == "X" for row in public["components"] for button in row["components"])
+        print(f"finbot: {'AI challenger placed its first X' if opened else 'FAILED'}")
+        failures += not opened
+
+        #the leaderboard answers from memory whether or not anyone is rated yet
+        answered = await fake.wait_ack(await fake.send_command(guild_id,channel_id,int(user["id"]),"leaderboard",[("role",3,"boardmaster")]))
+        ranked = bool(answered) and answered["response_type"] == 4 and "rated" in fake.messages[answered["original_id"]]["content"]
+        print(f"leaderboard: {'answered' if ranked else 'FAILED'}")
+        failures += not ranked
+
+        #hot reload: open the second channel of the first guild
+        allowed[str(guild_ids[0])].append(fake.guilds[guild_ids[0]]["channels"][1])
+        with open(config_path,"w") as f:
+            json.dump({"allow_unlisted": False,"guilds": allowed},f)
+        await asyncio.sleep(1.5)
+        boardmaster, challenger = fake.guilds[guild_ids[0]]["members"][2:4]
+        reloaded = await fake.wait_ack(await fake.send_command(guild_ids[0],fake.guilds[guild_ids[0]]["channels"][1],int(boardmaster["id"]),"fin",[("challenger",6,challenger["id"])]))
+        print(f"after reload the second channel {'answered' if reloaded else 'NO ANSWER'}")
+        failures += reloaded is None
+
+        #the bot's metrics endpoint saw the commands
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{metrics_port}/metrics") as response:
+                scraped = await response.text()
+        answered = [line for line in scraped.splitlines() if line.startswith('finfacfoe_interaction_first_response_seconds_count{kind="command"}')]
+        print(f"metrics endpoint: {answered[0] if answered else 'NO first response samples'}")
+        failures += not answered
+        return failures
+    finally:
+        bot.terminate()
+        bot.wait()
+        await fake.stop()
+
+async def serve(guilds,shards,port,latency=0.0,jitter=0.0,rate_limits=False):
+    fake = FakeDiscord(guilds=guilds,shards=shards,port=port,latency=latency,jitter=jitter,
+        rate_limits=DISCORD_RATE_LIMITS if rate_limits else None,global_limit=DISCORD_GLOBAL_LIMIT if rate_limits else None)
+    base_url = await fake.start()
+    print(f"Fake Discord on {base_url} with {guilds} guilds over {shards} shards")
+    print(f"Run the bot with DISCORD_API_BASE={base_url}")
+    for guild_id, guild in list(fake.guilds.items())[:5]:
+        print(f"  guild {guild_id} channels {guild['channels']}")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Discord gateway and HTTP API")
+    parser.add_argument("--guilds",type=int,default=10)
+    parser.add_argument("--shards",type=int,default=2)
+    parser.add_argument("--port",type=int,default=0)
+    parser.add_argument("--latency",type=float,default=0.0,help="seconds added to every HTTP request")
+    parser.add_argument("--jitter",type=float,default=0.0,help="up to this many more seconds, uniformly")
+    parser.add_argument("--rate-limits",action="store_true",help="answer with 429 past Discord-like per-route and global limits")
+    parser.add_argument("--smoke",action="store_true",help="run the bot against the fake and check sharding and channel config")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.smoke:
+        failures = asyncio.run(smoke(args.guilds,args.shards))
+        print("smoke test passed" if not failures else f"smoke test failed: {failures} checks")
+        sys.exit(1 if failures else 0)
+    asyncio.run(serve(args.guilds,args.shards,args.port,args.latency,args.jitter,args.rate_limits))
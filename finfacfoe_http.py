@@ -0,0 +1,846 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+import finfacfoe_core as core
+import finfacfoe_ratings as ratings
+from finfacfoe_engine import FinFacFoeState, MOVE
+from finfacfoe_render import render_key, render_rows, board_tiles, custom_id, parse_custom_id
+from finfacfoe_store import encode_board, decode_board
+from finfacfoe_sessions import SessionLimitError
+from finfacfoe_config import ChannelConfig
+from finfacfoe_signing import SigningKey, PureVerifyKey, verify_key, verify_request, sign_request
+from finfacfoe_logging import setup_logging
+
+#HTTP interactions endpoint, the deployment without a gateway connection
+#Discord POSTs every interaction to Interactions Endpoint URL signed with the application's key
+#and takes the HTTP response as the interaction response. A parent process starts HTTP_WORKERS
+#worker processes that all listen on HTTP_PORT (SO_REUSEPORT, the kernel spreads connections),
+#and keep nothing between requests: every click loads its game from a SQLite store they share
+#
+#Per-game ordering is optimistic. A click loads the game with its version, plays the move and
+#writes it back only if the version did not move in between, otherwise it loads again and replays,
+#so moves of one game apply one at a time in the order they commit whichever worker takes them.
+#Board edits go out after the response, from the one worker holding the game's editor lease,
+#which sends what changed and lets go only once the version it sent is still the latest
+#
+#Messages are posted and edited through interaction webhooks, no bot token is needed.
+#/fin is served, /finbot, tournaments and /leaderboard need the gateway bot (finfacfoe.py),
+#which also registers the commands. Games finished here are rated into the same RATINGS_PATH
+#
+#python finfacfoe_http.py             serve, needs DISCORD_PUBLIC_KEY
+#python finfacfoe_http.py --selftest  run workers against the fake Discord with a local signer
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL","INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT","text")
+
+#Application public key from the developer portal, hex
+DISCORD_PUBLIC_KEY = os.getenv("DISCORD_PUBLIC_KEY")
+DISCORD_API_BASE = os.getenv("DISCORD_API_BASE") or "https://discord.com/api/v10"
+
+HTTP_HOST = os.getenv("HTTP_HOST","0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT",8080))
+HTTP_WORKERS = int(os.getenv("HTTP_WORKERS")) if os.getenv("HTTP_WORKERS") else os.cpu_count() or 1
+HTTP_STORE_PATH = os.getenv("HTTP_STORE_PATH","finfacfoe_http.db")
+#Set by the self test only, verify signatures in pure Python when PyNaCl is not installed
+HTTP_PURE_VERIFY = os.getenv("HTTP_PURE_VERIFY","0") == "1"
+
+#Same settings as the gateway bot
+CHANNEL_CONFIG_PATH = os.getenv("CHANNEL_CONFIG_PATH","channels.json")
+CHANNEL_RELOAD_INTERVAL = float(os.getenv("CHANNEL_RELOAD_INTERVAL",10))
+MAX_GAMES_PER_GUILD = int(os.getenv("MAX_GAMES_PER_GUILD",100))
+MAX_GAMES_PER_USER = int(os.getenv("MAX_GAMES_PER_USER",3))
+GAME_IDLE_TTL = float(os.getenv("GAME_IDLE_TTL",600))
+RATINGS_PATH = os.getenv("RATINGS_PATH","finfacfoe_ratings.db")
+MAX_BOARD_SIZE = min(int(os.getenv("MAX_BOARD_SIZE",10)),core.MAX_SIZE)
+
+EPHEMERAL = 1 << 6
+
+#Finished games are kept this long so late clicks still find them, then swept with idle ones
+FINISHED_TTL = 60.0
+SWEEP_INTERVAL = 60.0
+
+#Seconds an editor lease lasts without progress before another worker may take it over
+EDIT_LEASE = 30.0
+#Times a click is replayed after losing the version race before it is turned away
+CONFLICT_RETRIES = 20
+#Attempts of one Discord request through 429s
+API_ATTEMPTS = 5
+#Seconds the store connection waits on another process's write
+BUSY_TIMEOUT = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS http_games (
+    game_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    challenger_id INTEGER NOT NULL,
+    boardmaster_id INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    win_length INTEGER NOT NULL,
+    board NOT NULL,
+    revealed BLOB NOT NULL,
+    occupied INTEGER NOT NULL DEFAULT 0,
+    moves BLOB,
+    application_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    editor INTEGER,
+    lease REAL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS http_messages (
+    message_id INTEGER PRIMARY KEY,
+    game_id INTEGER NOT NULL,
+    is_visible INTEGER NOT NULL,
+    tile INTEGER NOT NULL,
+    token TEXT,
+    sent_key BLOB,
+    sent_content TEXT
+);
+CREATE INDEX IF NOT EXISTS http_messages_game ON http_messages (game_id);
+CREATE INDEX IF NOT EXISTS http_games_guild ON http_games (guild_id, finished);
+CREATE INDEX IF NOT EXISTS http_games_challenger ON http_games (challenger_id, finished);
+CREATE INDEX IF NOT EXISTS http_games_boardmaster ON http_games (boardmaster_id, finished);
+CREATE INDEX IF NOT EXISTS http_games_updated ON http_games (updated);
+"""
+
+GAME_COLUMNS = ("game_id","guild_id","channel_id","challenger_id","boardmaster_id","size","win_length",
+    "board","revealed","occupied","moves","application_id","token","version","finished")
+#what a move changes, HttpGame.state_row
+STATE_COLUMNS = ("board","revealed","occupied","moves","finished")
+
+SELECT_GAME = f"SELECT {','.join(GAME_COLUMNS)},editor FROM http_games WHERE game_id = ?"
+SELECT_GAME_OF_MESSAGE = f"""SELECT {','.join('g.'+column for column in GAME_COLUMNS)} FROM http_messages AS m
+    JOIN http_games AS g ON g.game_id = m.game_id WHERE m.message_id = ?"""
+INSERT_GAME = f"INSERT INTO http_games ({','.join(GAME_COLUMNS)},updated) VALUES ({','.join('?'*(len(GAME_COLUMNS)+1))})"
+UPDATE_GAME = f"UPDATE http_games SET {','.join(column+' = ?' for column in STATE_COLUMNS)},version = version+1,updated = ? WHERE game_id = ? AND version = ?"
+CLAIM_EDITOR = "UPDATE http_games SET editor = ?, lease = ? WHERE game_id = ? AND (editor IS NULL OR lease < ?)"
+RELEASE_EDITOR = "UPDATE http_games SET editor = NULL, lease = NULL WHERE game_id = ? AND version = ? AND editor = ?"
+#(finished before, idle before), games and their messages are swept together
+STALE_GAMES = "SELECT game_id FROM http_games WHERE (finished = 1 AND updated < ?) OR updated < ?"
+
+def _blob(value):
+    #Masks past 63 bits do not fit an SQLite integer
+    return value.to_bytes((value.bit_length()+7)//8 or 1,"little")
+
+def connect(path):
+    conn = sqlite3.connect(path,check_same_thread=False,timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+#------------------------------
+
+class HttpGame(FinFacFoeState):
+    #A game as one request sees it, loaded from the store and written back before the response
+    def __init__(self,game_id,guild_id,channel_id,challenger_id,boardmaster_id,application_id,token,size=core.SIZE,win_length=core.SIZE):
+        super().__init__(size,win_length)
+        self.game_id = game_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.challenger_id = challenger_id
+        self.boardmaster_id = boardmaster_id
+        self.application_id = application_id
+        self.token = token
+        self.tiles = board_tiles(size)
+
+        #O cells the challenger has found, and whether the last click found one
+        self.revealed = 0
+        self.occupied = False
+        self.finished = False
+        #store version this game was loaded at
+        self.version = 0
+
+    @classmethod
+    def from_row(cls,row):
+        data = dict(zip(GAME_COLUMNS,row))
+        game = cls(data["game_id"],data["guild_id"],data["channel_id"],data["challenger_id"],data["boardmaster_id"],
+            data["application_id"],data["token"],data["size"],data["win_length"])
+        decode_board(data["board"],game)
+        game.revealed = int.from_bytes(data["revealed"],"little")
+        game.occupied = bool(data["occupied"])
+        game.moves = bytearray(data["moves"] or b"")
+        game.finished = bool(data["finished"])
+        game.version = data["version"]
+        return game
+
+    def state_row(self):
+        return (encode_board(self),_blob(self.revealed),int(self.occupied),bytes(self.moves),int(self.finished))
+
+    def new_row(self,now):
+        return (self.game_id,self.guild_id,self.channel_id,self.challenger_id,self.boardmaster_id,self.geometry.size,
+            self.geometry.win_length,*self.state_row()[:4],self.application_id,self.token,self.version,int(self.finished),now)
+
+    def on_click(self,is_visible,x,y,user_id):
+        #FinFacFoeGame.on_update without Discord objects
+        #Returns None when the click changed the game, otherwise the text turning it away
+        if is_visible:
+            if user_id != self.challenger_id:
+                return f"This is not your board <@{user_id}> ⛔"
+            outcome = self.precheck(self.X,x,y)
+            if outcome == MOVE.OCCUPIED:
+                self.revealed |= self.geometry.cell_bit(x,y)
+                self.occupied = True
+                return None
+            if outcome == MOVE.NOT_TURN:
+                return "Not your turn ⏳"
+            if self.play(self.X,x,y) != MOVE.PLACED:
+                return "Center position is prohibited on first turn. Try again. ⛔"
+        else:
+            outcome = self.play(self.O,x,y)
+            if outcome == MOVE.NOT_TURN:
+                return "Not your turn ⏳"
+            if outcome == MOVE.CENTER:
+                return "Center position is prohibited on first turn. Try again. ⛔"
+            if outcome != MOVE.PLACED:
+                match self.bm_state:
+                    case self.STATES.COL:
+                        locked, locked2 = "COL LOCKED", "vertically ↕"
+                    case self.STATES.ROW:
+                        locked, locked2 = "ROW LOCKED", "horizontally ↔"
+                    case _:
+                        locked, locked2 = "AXIS LOCKED", "perpendiculary ➕"
+                return f"You are {locked}. Stay {locked2}. Try again. ⛔"
+        self.occupied = False
+        self.finished = self.result != self.CONTINUE
+        return None
+
+def status_text(game,is_visible):
+    #Status line on the first tile of a board, the texts the gateway bot edits in
+    header = f"[X] <@{game.challenger_id}>\n" if is_visible else f"[O] <@{game.boardmaster_id}>\n"
+    if game.finished:
+        match game.result:
+            case game.X:
+                line = "✨ You win ✨" if is_visible else "[X] wins"
+            case game.O:
+                line = "[O] wins" if is_visible else "✨ You win ✨"
+            case _:
+                line = "🎈 TIE"
+    elif is_visible and game.occupied:
+        line = "Occupied spot. Try again. ⛔"
+    elif not game.count:
+        line = '\u200b'
+    elif game.current_player == game.O:
+        line = "It is [O]'s Turn ⏳" if is_visible else "It is [O] your turn ✅✅✅"
+    else:
+        line = "It is [X] your Turn ✅✅✅" if is_visible else "It is [X]'s turn ⏳"
+    return f"{header}> {line}"
+
+#------------------------------
+
+class HttpStore():
+    #Games shared by the worker processes, each worker's connection is owned by one thread
+    def __init__(self,path=HTTP_STORE_PATH,ratings_path=RATINGS_PATH):
+        self.path = path
+        self.ratings_path = ratings_path
+        self.executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix="finfacfoe-http-store")
+        self.conn = None
+        self.ratings = None
+
+    def run(self,func,*args):
+        return asyncio.get_running_loop().run_in_executor(self.executor,func,*args)
+
+    def _connect(self):
+        self.conn = connect(self.path)
+        if self.ratings_path:
+            self.ratings = ratings.connect(self.ratings_path)
+
+    def _close(self):
+        for conn in (self.conn,self.ratings):
+            if conn is not None:
+                conn.close()
+        self.conn = self.ratings = None
+
+    async def open(self):
+        await self.run(self._connect)
+
+    async def close(self):
+        await self.run(self._close)
+        self.executor.shutdown(wait=True)
+
+    def open_game(self,row,max_per_guild,max_per_user):
+        #Insert a new game or raise SessionLimitError, the limits of SessionManager.open over every worker
+        game_id, guild_id, channel_id, challenger_id, boardmaster_id = row[:5]
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self.conn.execute("SELECT 1 FROM http_games WHERE boardmaster_id = ? AND challenger_id = ? AND channel_id = ? AND finished = 0",
+                    (boardmaster_id,challenger_id,channel_id)).fetchone():
+                raise SessionLimitError("You already have a game running against this player here")
+            if self.conn.execute("SELECT COUNT(*) FROM http_games WHERE guild_id IS ? AND finished = 0",(guild_id,)).fetchone()[0] >= max_per_guild:
+                raise SessionLimitError(f"This server already has {max_per_guild} games running")
+            for user_id in (boardmaster_id,challenger_id):
+                running = self.conn.execute("SELECT (SELECT COUNT(*) FROM http_games WHERE challenger_id = ? AND finished = 0)"
+                    "+(SELECT COUNT(*) FROM http_games WHERE boardmaster_id = ? AND finished = 0)",(user_id,user_id)).fetchone()[0]
+                if running >= max_per_user:
+                    raise SessionLimitError(f"<@{user_id}> is already in {max_per_user} games")
+            self.conn.execute(INSERT_GAME,row)
+
+    def add_message(self,row,editor,now):
+        #row: (message_id, game_id, is_visible, tile, token, sent_key, sent_content)
+        #A move may have committed before the message was known, the editor lease is taken then
+        #so the message is brought up to date. Returns whether it was taken
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO http_messages VALUES (?,?,?,?,?,?,?)",row)
+            if not self.conn.execute("SELECT 1 FROM http_games WHERE game_id = ? AND version > 0",(row[1],)).fetchone():
+                return False
+            return bool(self.conn.execute(CLAIM_EDITOR,(editor,now+EDIT_LEASE,row[1],now)).rowcount)
+
+    def delete_game(self,game_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM http_messages WHERE game_id = ?",(game_id,))
+            self.conn.execute("DELETE FROM http_games WHERE game_id = ?",(game_id,))
+
+    def game_of_message(self,message_id):
+        return self.conn.execute(SELECT_GAME_OF_MESSAGE,(message_id,)).fetchone()
+
+    def commit_click(self,game_id,version,state,message_id,token,editor,now):
+        #Write a move if the game is still at version, returns (written, editor lease taken)
+        #The click's token is kept for editing the clicked message as its original response
+        with self.conn:
+            if not self.conn.execute(UPDATE_GAME,(*state,now,game_id,version)).rowcount:
+                return False, False
+            self.conn.execute("UPDATE http_messages SET token = ? WHERE message_id = ?",(token,message_id))
+            claimed = self.conn.execute(CLAIM_EDITOR,(editor,now+EDIT_LEASE,game_id,now)).rowcount
+        return True, bool(claimed)
+
+    def edit_snapshot(self,game_id):
+        #(game row, lease holder, message rows) for the editor, None once the game is gone
+        row = self.conn.execute(SELECT_GAME,(game_id,)).fetchone()
+        if row is None:
+            return None
+        messages = self.conn.execute("SELECT message_id,is_visible,tile,token,sent_key,sent_content FROM http_messages WHERE game_id = ?",(game_id,)).fetchall()
+        return row[:-1], row[-1], messages
+
+    def finish_edits(self,game_id,version,editor,sent,now):
+        #Record what was sent and let go of the lease if version is still the latest
+        #False means a move committed meanwhile and the editor goes round again
+        with self.conn:
+            self.conn.executemany("UPDATE http_messages SET sent_key = ?, sent_content = ? WHERE message_id = ?",sent)
+            if self.conn.execute(RELEASE_EDITOR,(game_id,version,editor)).rowcount:
+                return True
+            self.conn.execute("UPDATE http_games SET lease = ? WHERE game_id = ? AND editor = ?",(now+EDIT_LEASE,game_id,editor))
+        return False
+
+    def rate(self,challenger_id,boardmaster_id,result):
+        if self.ratings is not None:
+            ratings.record_in_db(self.ratings,challenger_id,boardmaster_id,result)
+
+    def sweep(self,finished_before,idle_before):
+        with self.conn:
+            self.conn.execute(f"DELETE FROM http_messages WHERE game_id IN ({STALE_GAMES})",(finished_before,idle_before))
+            return self.conn.execute("DELETE FROM http_games WHERE (finished = 1 AND updated < ?) OR updated < ?",(finished_before,idle_before)).rowcount
+
+#------------------------------
+
+class DiscordHTTPError(Exception):
+    def __init__(self,status,text):
+        super().__init__(f"{status}: {text}")
+        self.status = status
+
+def ephemeral(text):
+    return {"type": 4,"data": {"content": text,"flags": EPHEMERAL}}
+
+def invoker(payload):
+    #(user id, display name) of whoever sent the interaction
+    member = payload.get("member")
+    user = member["user"] if member else payload["user"]
+    return int(user["id"]), (member or {}).get("nick") or user.get("global_name") or user["username"]
+
+def resolved_name(data,user_id):
+    resolved = data.get("resolved",{})
+    member = resolved.get("members",{}).get(str(user_id),{})
+    user = resolved.get("users",{}).get(str(user_id),{})
+    return member.get("nick") or user.get("global_name") or user.get("username") or f"<@{user_id}>"
+
+class InteractionWorker():
+    def __init__(self,public_key,api_base=DISCORD_API_BASE,store=None,channel_config=None):
+        self.key = verify_key(public_key,allow_pure=HTTP_PURE_VERIFY)
+        self.api_base = api_base.rstrip("/")
+        self.store = store or HttpStore()
+        self.channel_config = channel_config or ChannelConfig(CHANNEL_CONFIG_PATH)
+        #editor lease holder id
+        self.editor = os.getpid()
+        self.session = None
+        self.runner = None
+        #work left running after a response was sent
+        self.tasks = set()
+        self.housekeeping = None
+
+        self.app = web.Application()
+        self.app.add_routes([web.post("/interactions",self.interactions)])
+
+    async def start(self,host=HTTP_HOST,port=HTTP_PORT):
+        await self.store.open()
+        self.channel_config.reload(force=True)
+        self.session = aiohttp.ClientSession()
+        self.housekeeping = asyncio.create_task(self._housekeeping())
+        #no access log, a line per click is the volume of the gateway bot's per-move traces
+        self.runner = web.AppRunner(self.app,access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner,host,port,reuse_port=True).start()
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+        if self.housekeeping is not None:
+            self.housekeeping.cancel()
+        if self.tasks:
+            await asyncio.wait(self.tasks,timeout=5.0)
+        if self.session is not None:
+            await self.session.close()
+        await self.store.close()
+
+    def spawn(self,coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _housekeeping(self):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(CHANNEL_RELOAD_INTERVAL)
+            self.channel_config.reload()
+            if time.monotonic()-last_sweep < SWEEP_INTERVAL:
+                continue
+            last_sweep = time.monotonic()
+            now = time.time()
+            try:
+                swept = await self.store.run(self.store.sweep,now-FINISHED_TTL,now-GAME_IDLE_TTL)
+            except sqlite3.Error:
+                logging.exception("Failed to sweep games")
+                continue
+            if swept:
+                logging.info(f"Swept {swept} finished or idle games")
+
+    async def api(self,method,path,body=None,params=None):
+        #One Discord API request through the interaction webhook routes, 429s are waited out
+        for attempt in range(API_ATTEMPTS):
+            async with self.session.request(method,self.api_base+path,json=body,params=params) as response:
+                if response.status == 429:
+                    data = await response.json(content_type=None)
+                    await asyncio.sleep(float(data.get("retry_after",1.0)))
+                    continue
+                if response.status >= 400:
+                    raise DiscordHTTPError(response.status,await response.text())
+                return None if response.status == 204 else await response.json(content_type=None)
+        raise DiscordHTTPError(429,f"{method} {path} still rate limited after {API_ATTEMPTS} attempts")
+
+    async def answer(self,request,data):
+        #Send the interaction response now, what the handler does next happens after Discord has it
+        response = web.json_response(data)
+        await response.prepare(request)
+        await response.write_eof()
+        return response
+
+    async def interactions(self,request):
+        body = await request.read()
+        signature = request.headers.get("X-Signature-Ed25519")
+        timestamp = request.headers.get("X-Signature-Timestamp")
+        if signature is None or timestamp is None or not verify_request(self.key,timestamp,body,signature):
+            return web.Response(status=401,text="invalid request signature")
+        payload = json.loads(body)
+        match payload.get("type"):
+            case 1:
+                return web.json_response({"type": 1})
+            case 2:
+                return await self.command(request,payload)
+            case 3:
+                return await self.click(request,payload)
+        return web.json_response(ephemeral("Not available over HTTP interactions ⛔"))
+
+    #------------------------------
+    #commands
+
+    async def command(self,request,payload):
+        data = payload["data"]
+        if data["name"] != "fin":
+            return web.json_response(ephemeral(f"/{data['name']} is not available over HTTP interactions ⛔"))
+        guild_id = int(payload["guild_id"]) if payload.get("guild_id") else None
+        channel_id = int(payload["channel_id"])
+        if not self.channel_config.allows(guild_id,channel_id):
+            return web.json_response(ephemeral("FinFacFoe is not played in this channel ⛔"))
+
+        options = {option["name"]: option["value"] for option in data.get("options",())}
+        boardmaster_id, boardmaster_name = invoker(payload)
+        challenger_id = int(options["challenger"])
+        size = int(options.get("size",core.SIZE))
+        win_length = int(options["win_length"]) if options.get("win_length") else core.default_win_length(size)
+        #the gateway bot registers the bounds, a command it registered with older ones may still arrive
+        if not 3 <= size <= MAX_BOARD_SIZE:
+            return web.json_response(ephemeral(f"Boards are 3x3 up to {MAX_BOARD_SIZE}x{MAX_BOARD_SIZE} ⛔"))
+        if win_length > size:
+            return web.json_response(ephemeral(f"{win_length} in a row does not fit a {size}x{size} board ⛔"))
+
+        game = HttpGame(int(payload["id"]),guild_id,channel_id,challenger_id,boardmaster_id,int(payload["application_id"]),
+            payload["token"],size,win_length)
+        try:
+            await self.store.run(self.store.open_game,game.new_row(time.time()),MAX_GAMES_PER_GUILD,MAX_GAMES_PER_USER)
+        except SessionLimitError as e:
+            return web.json_response(ephemeral(f"{e} ⛔"))
+
+        variant = "" if size == 3 else f" ({size}x{size}, {win_length} in a row)"
+        response = await self.answer(request,{"type": 4,"data": {"content": f"{boardmaster_name} challenged {resolved_name(data,challenger_id)} to FinFacFoe{variant}."}})
+        self.spawn(self.post_boards(game))
+        return response
+
+    async def post_boards(self,game):
+        #Followups of the /fin response: the public board, then the boardmaster's private one
+        #Each message is stored as soon as it is posted, clicks on it find the game from then on
+        claimed = False
+        try:
+            for is_visible in (True,False):
+                for index, tile in enumerate(game.tiles):
+                    key = render_key(game,is_visible,tile)
+                    content = status_text(game,is_visible) if index == 0 else None
+                    body = {"components": render_rows(key)}
+                    if content is not None:
+                        body["content"] = content
+                    if not is_visible:
+                        body["flags"] = EPHEMERAL
+                    message = await self.api("POST",f"/webhooks/{game.application_id}/{game.token}",body,params={"wait": "true"})
+                    row = (int(message["id"]),game.game_id,int(is_visible),index,None,_blob(key),content)
+                    claimed |= await self.store.run(self.store.add_message,row,self.editor,time.time())
+        except (aiohttp.ClientError,DiscordHTTPError):
+            logging.exception(f"Failed to post the boards of game {game.game_id}")
+            await self.store.run(self.store.delete_game,game.game_id)
+            return
+        if claimed:
+            await self.edit_boards(game.game_id)
+        logging.info("Game started",extra={"game_id": game.game_id,"guild_id": game.guild_id,"channel_id": game.channel_id})
+
+    #------------------------------
+    #clicks
+
+    async def click(self,request,payload):
+        button = payload["data"].get("custom_id","")
+        if not button.startswith("fin:"):
+            return web.json_response(ephemeral("Not available over HTTP interactions ⛔"))
+        is_visible, x, y = parse_custom_id(button)
+        message_id = int(payload["message"]["id"])
+        user_id, _ = invoker(payload)
+
+        for attempt in range(CONFLICT_RETRIES):
+            row = await self.store.run(self.store.game_of_message,message_id)
+            game = row and HttpGame.from_row(row)
+            if game is None or game.finished:
+                return web.json_response(ephemeral("This game is over ⛔"))
+            rejection = game.on_click(is_visible,x,y,user_id)
+            if rejection is not None:
+                return web.json_response(ephemeral(rejection))
+            written, claimed = await self.store.run(self.store.commit_click,game.game_id,game.version,game.state_row(),
+                message_id,payload["token"],self.editor,time.time())
+            if written:
+                break
+        else:
+            logging.warning(f"Click on game {game.game_id} lost {CONFLICT_RETRIES} version races")
+            return web.json_response(ephemeral("The board is busy, try again ⏳"))
+
+        response = await self.answer(request,{"type": 6})
+        if game.finished:
+            self.spawn(self.rate(game))
+        if claimed:
+            self.spawn(self.edit_boards(game.game_id))
+        return response
+
+    async def rate(self,game):
+        try:
+            await self.store.run(self.store.rate,game.challenger_id,game.boardmaster_id,game.result)
+        except sqlite3.Error:
+            logging.exception(f"Failed to rate game {game.game_id}")
+
+    async def edit_boards(self,game_id):
+        #Bring every board message up to the latest version while holding the editor lease
+        #Moves committed by other workers meanwhile are picked up on the next round
+        while True:
+            snapshot = await self.store.run(self.store.edit_snapshot,game_id)
+            if snapshot is None:
+                return
+            row, editor, messages = snapshot
+            if editor != self.editor:
+                #the lease ran out and another worker took over
+                return
+            game = HttpGame.from_row(row)
+            edits = []
+            for message_id, is_visible, tile, token, sent_key, sent_content in messages:
+                key = render_key(game,bool(is_visible),game.tiles[tile])
+                content = status_text(game,bool(is_visible)) if tile == 0 else None
+                if _blob(key) != sent_key or content != sent_content:
+                    edits.append(self.edit_message(game,message_id,token,key,content))
+            sent = [edit for edit in await asyncio.gather(*edits) if edit is not None]
+            if await self.store.run(self.store.finish_edits,game_id,game.version,self.editor,sent,time.time()):
+                return
+
+    async def edit_message(self,game,message_id,token,key,content):
+        #A click's token edits the clicked message as its original response, the /fin token any board
+        if token:
+            path = f"/webhooks/{game.application_id}/{token}/messages/@original"
+        else:
+            path = f"/webhooks/{game.application_id}/{game.token}/messages/{message_id}"
+        body = {"components": render_rows(key)}
+        if content is not None:
+            body["content"] = content
+        try:
+            await self.api("PATCH",path,body)
+        except (aiohttp.ClientError,DiscordHTTPError) as e:
+            logging.warning(f"Failed to edit board message {message_id} of game {game.game_id}: {e}")
+            return None
+        return _blob(key), content, message_id
+
+#------------------------------
+
+async def run_worker():
+    worker = InteractionWorker(DISCORD_PUBLIC_KEY)
+    await worker.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM,signal.SIGINT):
+        loop.add_signal_handler(signum,stop.set)
+    await stop.wait()
+    await worker.close()
+
+def worker_main():
+    setup_logging(LOG_LEVEL,LOG_LEVEL,LOG_FORMAT)
+    asyncio.run(run_worker())
+
+def serve(workers=HTTP_WORKERS):
+    #Start the workers and restart any that dies until SIGTERM
+    if not DISCORD_PUBLIC_KEY:
+        raise SystemExit("DISCORD_PUBLIC_KEY is not set")
+    #the workers build the same verifier, a missing PyNaCl or a bad key stops here and not in each of them
+    try:
+        key = verify_key(DISCORD_PUBLIC_KEY,allow_pure=HTTP_PURE_VERIFY)
+    except (RuntimeError,ValueError) as e:
+        raise SystemExit(f"Cannot verify interactions: {e}")
+    setup_logging(LOG_LEVEL,LOG_LEVEL,LOG_FORMAT)
+    if isinstance(key,PureVerifyKey):
+        logging.warning("PyNaCl is not installed, HTTP_PURE_VERIFY checks signatures in pure Python, for the self test only")
+    #schema and WAL mode set up once, before the workers race for them
+    connect(HTTP_STORE_PATH).close()
+    if RATINGS_PATH:
+        ratings.connect(RATINGS_PATH).close()
+
+    context = multiprocessing.get_context("spawn")
+    def start_worker():
+        process = context.Process(target=worker_main,name="finfacfoe-http")
+        process.start()
+        return process
+    processes = [start_worker() for _ in range(workers)]
+    logging.info(f"{workers} workers answering interactions on {HTTP_HOST}:{HTTP_PORT}/interactions")
+
+    signal.signal(signal.SIGTERM,lambda *args: sys.exit(0))
+    try:
+        while True:
+            multiprocessing.connection.wait([process.sentinel for process in processes])
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    logging.error(f"Worker {process.pid} exited with {process.exitcode}, restarting it")
+                    processes[i] = start_worker()
+    except (KeyboardInterrupt,SystemExit):
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+#------------------------------
+#Offline check against the fake Discord, this process signs as Discord does
+
+class SigningClient():
+    #Discord's side of an interactions endpoint: signs each interaction the fake builds, POSTs it
+    #to the workers and hands the response to the fake as if Discord had received it
+    def __init__(self,url,signing_key,fake):
+        self.url = url
+        self.signing_key = signing_key
+        self.fake = fake
+        self.session = aiohttp.ClientSession()
+
+    async def send(self,payload,tamper=False):
+        #(status, response body, seconds to the response)
+        body = json.dumps(payload).encode()
+        headers = sign_request(self.signing_key,str(int(time.time())),body)
+        if tamper:
+            body += b" "
+        start = time.perf_counter()
+        async with self.session.post(self.url,data=body,headers={**headers,"Content-Type": "application/json"}) as response:
+            data = await response.json() if response.status == 200 else None
+        elapsed = time.perf_counter()-start
+        if data is not None and payload["type"] != 1:
+            self.fake.apply_response(self.fake.interactions[int(payload["id"])],data)
+        return response.status, data, elapsed
+
+    async def close(self):
+        await self.session.close()
+
+def expected_boards(fake,game,record):
+    #True once the fake's board messages show game, the mirror of what the workers played
+    messages = [fake.messages[message_id] for message_id in record["messages"] if fake.messages[message_id]["components"]]
+    for is_visible in (True,False):
+        board = [message for message in messages if bool(message["flags"] & EPHEMERAL) != is_visible]
+        for index, (tile, message) in enumerate(zip(game.tiles,board)):
+            if message["components"] != render_rows(render_key(game,is_visible,tile)):
+                return False
+            if index == 0 and message["content"] != status_text(game,is_visible):
+                return False
+    return True
+
+def opening_cells(game):
+    legal = game.legal_moves()
+    return [game.geometry.index_to_cell(i) for i in range(game.geometry.cells) if legal >> i & 1]
+
+async def selftest(games=200,workers=2,size=3,latency=0.0,timeout=10.0,seed=0):
+    #the fake Discord and the scripted games are test code, the workers never import them
+    from finfacfoe_fakegateway import FakeDiscord, free_port
+    from finfacfoe_loadtest import LoadGame, latency_summary
+    rng = random.Random(seed)
+    fake = FakeDiscord(guilds=4,channels_per_guild=2,members_per_guild=2*math.ceil(games/4),latency=latency)
+    base_url = await fake.start()
+    signing_key = SigningKey()
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="finfacfoe-http-")
+    config_path = os.path.join(workdir,"channels.json")
+    with open(config_path,"w") as f:
+        json.dump({"allow_unlisted": True,"guilds": {}},f)
+    env = dict(os.environ,DISCORD_PUBLIC_KEY=signing_key.public_key.hex(),DISCORD_API_BASE=base_url,
+        HTTP_HOST="127.0.0.1",HTTP_PORT=str(port),HTTP_WORKERS=str(workers),HTTP_PURE_VERIFY="1",HTTP_STORE_PATH=os.path.join(workdir,"http.db"),
+        RATINGS_PATH=os.path.join(workdir,"ratings.db"),CHANNEL_CONFIG_PATH=config_path,
+        MAX_GAMES_PER_GUILD=str(games),MAX_GAMES_PER_USER=str(games),LOG_LEVEL="WARNING")
+    server = subprocess.Popen([sys.executable,os.path.abspath(__file__)],env=env)
+    client = SigningClient(f"http://127.0.0.1:{port}/interactions",signing_key,fake)
+    ping = {"id": "0","application_id": str(fake.application_id),"type": 1,"token": "ping","version": 1}
+    failures = 0
+    try:
+        deadline = time.monotonic()+30.0
+        while True:
+            try:
+                status, data, elapsed = await client.send(ping)
+                break
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+        print(f"{workers} workers up, ping answered with {data}")
+        failures += data != {"type": 1}
+
+        guild_id = next(iter(fake.guilds))
+        members = [int(user["id"]) for user in fake.guilds[guild_id]["members"]]
+        channel_id = fake.guilds[guild_id]["channels"][0]
+        status, data, elapsed = await client.send(ping,tamper=True)
+        print(f"tampered body: {status}")
+        failures += status != 401
+        status, data, elapsed = await client.send(fake.command_payload(guild_id,channel_id,members[0],"leaderboard"))
+        refused = status == 200 and data["type"] == 4 and data["data"]["flags"] & EPHEMERAL
+        print(f"/leaderboard: {'refused, gateway only' if refused else 'FAILED'}")
+        failures += not refused
+
+        #Every game opens with the challenger clicking two cells at once, on whichever workers
+        #take them: one move commits and the other, loaded or replayed after it, is turned away
+        members = {guild_id: [int(user["id"]) for user in guild["members"]] for guild_id, guild in fake.guilds.items()}
+        load_games = []
+        for i in range(games):
+            guild_id = list(members)[i%len(members)]
+            slot = i//len(members)
+            boardmaster, challenger = members[guild_id][2*slot:2*slot+2]
+            load_games.append(LoadGame(guild_id,fake.guilds[guild_id]["channels"][slot%2],challenger,boardmaster,size,core.default_win_length(size)))
+        acks = {"command": [],"click": []}
+        rejected = []
+
+        async def play(load):
+            payload = fake.command_payload(load.guild_id,load.channel_id,load.boardmaster_id,"fin",
+                [("challenger",6,load.challenger_id),("size",4,size)])
+            status, data, elapsed = await client.send(payload)
+            acks["command"].append(elapsed)
+            record = fake.interactions[int(payload["id"])]
+            boards = status == 200 and await fake.wait_boards(record["id"],timeout)
+            if not boards:
+                return False
+            load.public_id, load.private_id = int(boards[0]["id"]), int(boards[1]["id"])
+            mirror = HttpGame(record["id"],load.guild_id,load.channel_id,load.challenger_id,load.boardmaster_id,fake.application_id,record["token"],size,load.state.geometry.win_length)
+
+            first = rng.sample(opening_cells(mirror),2)
+            answers = await asyncio.gather(*(client.send(fake.click_payload(load.public_id,custom_id(True,x,y),load.challenger_id)) for x, y in first))
+            acks["click"].extend(elapsed for status, data, elapsed in answers)
+            placed = [cell for cell, (status, data, elapsed) in zip(first,answers) if data and data["type"] == 6]
+            turned_away = [data["data"]["content"] for status, data, elapsed in answers if data and data["type"] == 4]
+            if len(placed) != 1 or turned_away != ["Not your turn ⏳"]:
+                rejected.append(answers)
+                return False
+            load.apply(*placed[0])
+            mirror.on_click(True,*placed[0],load.challenger_id)
+
+            while not load.finished:
+                message_id, button, user_id, x, y = load.next_click(rng)
+                status, data, elapsed = await client.send(fake.click_payload(message_id,button,user_id))
+                acks["click"].append(elapsed)
+                if not data or data["type"] != 6:
+                    rejected.append(data)
+                    return False
+                load.apply(x,y)
+                mirror.on_click(message_id == load.public_id,x,y,user_id)
+            deadline = time.monotonic()+timeout
+            while not expected_boards(fake,mirror,record):
+                if time.monotonic() > deadline:
+                    return False
+                await asyncio.sleep(0.05)
+            return True
+
+        start = time.perf_counter()
+        played = await asyncio.gather(*(play(load) for load in load_games))
+        elapsed = time.perf_counter()-start
+        clicks = len(acks["click"])
+        print(f"{sum(played)}/{games} games played to the end with every board showing the final position, "
+            f"{len(rejected)} unexpected answers")
+        print(f"{clicks} clicks in {elapsed:.1f}s, {clicks/elapsed:.0f} clicks/s over {workers} workers")
+        for kind, samples in acks.items():
+            summary = latency_summary(samples)
+            print(f"  {kind} response: p50 {summary['p50_ms']:.1f}ms p99 {summary['p99_ms']:.1f}ms max {summary['max_ms']:.1f}ms")
+        failures += games-sum(played)
+
+        #every finished game was rated once, by whichever worker committed its last move
+        await asyncio.sleep(0.5)
+        with sqlite3.connect(env["RATINGS_PATH"]) as conn:
+            rated = conn.execute("SELECT SUM(games) FROM ratings WHERE role = 'challenger'").fetchone()[0] or 0
+        print(f"ratings: {rated} games rated")
+        failures += rated != sum(played)
+        return failures
+    finally:
+        await client.close()
+        server.terminate()
+        server.wait()
+        await fake.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FinFacFoe over HTTP interactions, a pool of stateless worker processes")
+    parser.add_argument("--workers",type=int,default=HTTP_WORKERS)
+    parser.add_argument("--selftest",action="store_true",help="run workers against the fake Discord with a local signer")
+    parser.add_argument("--games",type=int,default=200,help="games the self test plays")
+    parser.add_argument("--size",type=int,default=3,choices=(3,4,5),help="boards up to 5x5 fit one message")
+    parser.add_argument("--latency",type=float,default=0.0,help="seconds the fake adds to every HTTP request")
+    args = parser.parse_args()
+
+    if args.selftest:
+        logging.basicConfig(level=logging.WARNING)
+        failures = asyncio.run(selftest(args.games,args.workers,args.size,args.latency))
+        print("self test passed" if not failures else f"self test failed: {failures} checks")
+        sys.exit(1 if failures else 0)
+    serve(args.workers)
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+import finfacfoe_metrics as metrics
+from finfacfoe_ai import random_bit
+from finfacfoe_engine import FinFacFoeState, MOVE
+from finfacfoe_fakegateway import FakeDiscord, DISCORD_RATE_LIMITS, DISCORD_GLOBAL_LIMIT, free_port, bot_env
+from finfacfoe_render import custom_id
+
+#Load test of the whole bot against the fake Discord
+#The bot runs as its own process like in production. The driver opens thousands of /fin games,
+#then plays all of them at once with scripted clicks from both sides and reports:
+#games started and clicks per second, first response latency percentiles as Discord sees them,
+#the bot's event loop lag and memory per game scraped from its metrics endpoint, and the 429s
+#the fake answered
+#
+#Every game keeps a headless FinFacFoeState mirroring the bot's, so both players click moves the
+#rules allow. The challenger does not look at O's hidden pieces and probes them like a person would
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),"finfacfoe.py")
+
+#Discord drops interactions not answered within this many seconds
+DEADLINE = 3.0
+
+def parse_metrics(text):
+    #{(name, labels text): value} of a Prometheus text page
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, _, value = line.rpartition(" ")
+        name, _, labels = series.partition("{")
+        samples[(name,labels.rstrip("}"))] = float(value)
+    return samples
+
+def bucket_counts(samples,name):
+    #[(upper bound, cumulative count)] of an unlabelled histogram
+    counts = []
+    for (series, labels), value in samples.items():
+        if series == name+"_bucket":
+            bound = labels.partition('le="')[2].rstrip('"')
+            counts.append((float(bound),value))
+    return sorted(counts)
+
+def bucket_quantile(counts,q):
+    #Upper bound of the bucket holding the q quantile, like _HistogramChild.quantile
+    if not counts or not counts[-1][1]:
+        return 0.0
+    target = q*counts[-1][1]
+    for bound, cumulative in counts:
+        if cumulative >= target:
+            return bound
+    return float("inf")
+
+def percentile(samples,q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1,int(q*len(ordered)))]
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": percentile(samples,0.50)*1e3,
+        "p90_ms": percentile(samples,0.90)*1e3,
+        "p99_ms": percentile(samples,0.99)*1e3,
+        "max_ms": max(samples,default=0.0)*1e3,
+        "over_deadline": sum(1 for sample in samples if sample > DEADLINE),
+    }
+
+class LoadGame():
+    #One game as the driver sees it
+    __slots__ = ("guild_id","channel_id","challenger_id","boardmaster_id","state","revealed","public_id","private_id","finished")
+
+    def __init__(self,guild_id,channel_id,challenger_id,boardmaster_id,size,win_length):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.challenger_id = challenger_id
+        self.boardmaster_id = boardmaster_id
+        self.state = FinFacFoeState(size,win_length)
+        #O cells the challenger has probed
+        self.revealed = 0
+        self.public_id = None
+        self.private_id = None
+        self.finished = False
+
+    def next_click(self,rng):
+        #(message id, custom id, user id, x, y) of the next click of the player to move
+        state = self.state
+        if state.current_player == state.X:
+            #cells that look open on the public board, hidden O pieces included
+            candidates = (state.legal_moves() | state.core.o_mask) & ~self.revealed
+            message_id, user_id, is_visible = self.public_id, self.challenger_id, True
+        else:
+            candidates = state.legal_moves()
+            message_id, user_id, is_visible = self.private_id, self.boardmaster_id, False
+        x, y = state.geometry.index_to_cell(random_bit(candidates,rng))
+        return message_id, custom_id(is_visible,x,y), user_id, x, y
+
+    def apply(self,x,y):
+        #Play the click on the mirror the way the bot plays it
+        state = self.state
+        outcome = state.play(state.current_player,x,y)
+        if outcome == MOVE.OCCUPIED:
+            self.revealed |= state.geometry.cell_bit(x,y)
+        self.finished = state.result != state.CONTINUE
+        return outcome
+
+class LoadTest():
+    def __init__(self,games=1000,guilds=10,shards=2,size=3,win_length=None,start_rate=200.0,think=0.5,
+        latency=0.0,jitter=0.0,edit_latency=0.0,rate_limits=True,timeout=10.0,seed=0,log_path=None):
+        self.games = games
+        self.size = size
+        self.win_length = win_length or (3 if size == 3 else 4)
+        self.start_rate = start_rate
+        self.think = think
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.log_path = log_path
+        self.fake = FakeDiscord(guilds=guilds,channels_per_guild=2,members_per_guild=2*math.ceil(games/guilds),shards=shards,
+            latency=latency,jitter=jitter,rate_limits=DISCORD_RATE_LIMITS if rate_limits else None,
+            global_limit=DISCORD_GLOBAL_LIMIT if rate_limits else None,edit_latency=edit_latency)
+        self.workdir = tempfile.mkdtemp(prefix="finfacfoe-load-")
+        self.metrics_port = free_port()
+        self.bot = None
+        self.session = None
+
+        self.load_games = []
+        #seconds from sending an interaction to its first response, per kind
+        self.acks = {"command": [],"click": []}
+        #interactions with no response within timeout
+        self.lost = 0
+        self.clicks = 0
+        #largest values the bot reported between scrapes
+        self.peak_lag = 0.0
+        self.peak_memory = 0
+
+    #------------------------------
+    #bot process
+
+    async def start(self):
+        base_url = await self.fake.start()
+        config_path = os.path.join(self.workdir,"channels.json")
+        with open(config_path,"w") as f:
+            json.dump({"allow_unlisted": True,"guilds": {}},f)
+        env = bot_env(base_url,CHANNEL_CONFIG_PATH=config_path,
+            GAME_STORE_PATH=os.path.join(self.workdir,"games.db"),MOVE_LOG_PATH=os.path.join(self.workdir,"moves.fml"),
+            RATINGS_PATH=os.path.join(self.workdir,"ratings.db"),SOLVED_TABLE_PATH=os.path.join(self.workdir,"solved.bin"),COMMAND_SYNC_STATE=os.path.join(self.workdir,"sync.json"),
+            METRICS_PORT=self.metrics_port,MAX_GAMES_PER_GUILD=self.games,MAX_GAMES_PER_USER=self.games,LOG_LEVEL="WARNING")
+        log = open(self.log_path or os.path.join(self.workdir,"bot.log"),"w")
+        self.bot = subprocess.Popen([sys.executable,BOT_PATH],env=env,stdout=log,stderr=subprocess.STDOUT)
+        log.close()
+        self.session = aiohttp.ClientSession()
+        await asyncio.wait_for(asyncio.gather(self.fake.identified.wait(),self.fake.synced.wait()),60.0)
+        #let the shards work through their GUILD_CREATE events
+        await asyncio.sleep(1.0)
+
+    async def stop(self):
+        if self.session is not None:
+            await self.session.close()
+        if self.bot is not None:
+            self.bot.terminate()
+            self.bot.wait()
+        await self.fake.stop()
+
+    async def scrape(self):
+        async with self.session.get(f"http://127.0.0.1:{self.metrics_port}/metrics") as response:
+            samples = parse_metrics(await response.text())
+        self.peak_lag = max(self.peak_lag,samples.get(("finfacfoe_event_loop_lag_max_seconds",""),0.0))
+        self.peak_memory = max(self.peak_memory,samples.get(("finfacfoe_resident_memory_bytes",""),0.0))
+        return samples
+
+    async def watch_bot(self,interval=1.0):
+        #The lag gauge resets on every scrape, scraping often keeps its peak
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.scrape()
+            except aiohttp.ClientError:
+                pass
+
+    #------------------------------
+    #driving games
+
+    async def interact(self,kind,interaction_id):
+        record = await self.fake.wait_ack(interaction_id,self.timeout)
+        if record is None:
+            self.lost += 1
+            return None
+        self.acks[kind].append((record["ack_ns"]-record["sent_ns"])/1e9)
+        return record
+
+    async def open_game(self,game):
+        interaction_id = await self.fake.send_command(game.guild_id,game.channel_id,game.boardmaster_id,"fin",
+            [("challenger",6,game.challenger_id),("size",4,self.size),("win_length",4,self.win_length)])
+        if await self.interact("command",interaction_id) is None:
+            return False
+        boards = await self.fake.wait_boards(interaction_id,self.timeout)
+        if boards is None:
+            return False
+        public, private = boards
+        game.public_id, game.private_id = int(public["id"]), int(private["id"])
+        return True
+
+    async def play_game(self,game):
+        while not game.finished:
+            if self.think:
+                await asyncio.sleep(self.rng.random()*self.think)
+            message_id, button, user_id, x, y = game.next_click(self.rng)
+            self.clicks += 1
+            if await self.interact("click",await self.fake.click(message_id,button,user_id)) is None:
+                return False
+            game.apply(x,y)
+        return True
+
+    def pair_players(self):
+        #Two members of a guild per game, each player in one game
+        members = {guild_id: [int(user["id"]) for user in guild["members"]] for guild_id, guild in self.fake.guilds.items()}
+        guild_ids = list(members)
+        for i in range(self.games):
+            guild_id = guild_ids[i%len(guild_ids)]
+            slot = i//len(guild_ids)
+            boardmaster, challenger = members[guild_id][2*slot:2*slot+2]
+            channel_id = self.fake.guilds[guild_id]["channels"][slot%2]
+            self.load_games.append(LoadGame(guild_id,channel_id,challenger,boardmaster,self.size,self.win_length))
+
+    async def run(self):
+        await self.start()
+        watcher = asyncio.create_task(self.watch_bot())
+        driver_lag = asyncio.create_task(metrics.watch_event_loop())
+        try:
+            self.pair_players()
+            before = await self.scrape()
+
+            #Phase 1: open every game at start_rate
+            start = time.perf_counter()
+            opening = []
+            for game in self.load_games:
+                opening.append(asyncio.create_task(self.open_game(game)))
+                await asyncio.sleep(1/self.start_rate)
+            opened = await asyncio.gather(*opening)
+            open_elapsed = time.perf_counter()-start
+            live = [game for game, ok in zip(self.load_games,opened) if ok]
+            #every opened game is live on the bot now, the growth since the start is their cost
+            await asyncio.sleep(1.0)
+            after_open = await self.scrape()
+
+            #Phase 2: play every game at once
+            start = time.perf_counter()
+            played = await asyncio.gather(*(self.play_game(game) for game in live))
+            play_elapsed = time.perf_counter()-start
+            await asyncio.sleep(1.0)
+            after = await self.scrape()
+        finally:
+            watcher.cancel()
+            driver_lag.cancel()
+            await self.stop()
+
+        lag_counts = [(bound,count-dict(bucket_counts(before,"finfacfoe_event_loop_lag_seconds")).get(bound,0))
+            for bound, count in bucket_counts(after,"finfacfoe_event_loop_lag_seconds")]
+        memory_before = before.get(("finfacfoe_resident_memory_bytes",""),0.0)
+        memory_open = after_open.get(("finfacfoe_resident_memory_bytes",""),0.0)
+        moves = sum(game.state.count for game in live)
+        return {
+            "games": self.games,
+            "opened": len(live),
+            "finished": sum(played),
+            "games_started_per_second": len(live)/open_elapsed,
+            "clicks": self.clicks,
+            "clicks_per_second": self.clicks/play_elapsed,
+            "moves_per_second": moves/play_elapsed,
+            "lost_interactions": self.lost,
+            "ack": {kind: latency_summary(samples) for kind, samples in self.acks.items()},
+            "requests": dict(self.fake.requests),
+            "rate_limited": dict(self.fake.rate_limited),
+            "bot_rate_limited": {labels: value for (name, labels), value in after.items() if name == "finfacfoe_rate_limited_total"},
+            "bot_loop_lag_ms": {
+                "p50": bucket_quantile(lag_counts,0.50)*1e3,
+                "p99": bucket_quantile(lag_counts,0.99)*1e3,
+                "max": self.peak_lag*1e3,
+            },
+            "bot_memory_mb": {"start": memory_before/2**20,"games_open": memory_open/2**20,"peak": self.peak_memory/2**20},
+            "memory_per_game_kb": (memory_open-memory_before)/max(1,len(live))/1024,
+            "driver_loop_lag_ms": {"p99": metrics.LOOP_LAG.labels().quantile(0.99)*1e3,"max": metrics.LAG.take()*1e3},
+        }
+
+def print_report(report):
+    print(f"{report['opened']}/{report['games']} games opened at {report['games_started_per_second']:.0f}/s, "
+        f"{report['finished']} played to the end")
+    print(f"{report['clicks']} clicks at {report['clicks_per_second']:.0f}/s, {report['moves_per_second']:.0f} moves/s, "
+        f"{report['lost_interactions']} interactions never answered")
+    for kind, summary in report["ack"].items():
+        print(f"  {kind} first response: p50 {summary['p50_ms']:.1f}ms p90 {summary['p90_ms']:.1f}ms "
+            f"p99 {summary['p99_ms']:.1f}ms max {summary['max_ms']:.1f}ms, {summary['over_deadline']} over {DEADLINE:.0f}s")
+    print(f"requests {report['requests']}, 429s {report['rate_limited']}")
+    lag = report["bot_loop_lag_ms"]
+    print(f"bot event loop lag: p50 <{lag['p50']:.1f}ms p99 <{lag['p99']:.1f}ms max {lag['max']:.1f}ms")
+    memory = report["bot_memory_mb"]
+    print(f"bot memory: {memory['start']:.1f}MB idle, {memory['games_open']:.1f}MB with games open, peak {memory['peak']:.1f}MB, "
+        f"{report['memory_per_game_kb']:.1f}KB per game")
+    lag = report["driver_loop_lag_ms"]
+    print(f"driver event loop lag: p99 <{lag['p99']:.1f}ms max {lag['max']:.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot against the fake Discord with thousands of scripted games")
+    parser.add_argument("--games",type=int,default=1000)
+    parser.add_argument("--guilds",type=int,default=10)
+    parser.add_argument("--shards",type=int,default=2)
+    parser.add_argument("--size",type=int,default=3,choices=(3,4,5),help="boards up to 5x5 fit one message")
+    parser.add_argument("--win-length",type=int)
+    parser.add_argument("--start-rate",type=float,default=200.0,help="/fin commands sent per second")
+    parser.add_argument("--think",type=float,default=0.5,help="players wait up to this many seconds before a click")
+    parser.add_argument("--latency",type=float,default=0.02,help="seconds the fake adds to every HTTP request")
+    parser.add_argument("--jitter",type=float,default=0.03)
+    parser.add_argument("--edit-latency",type=float,default=0.0,help="seconds more for every message edit")
+    parser.add_argument("--no-rate-limits",action="store_true")
+    parser.add_argument("--timeout",type=float,default=10.0,help="seconds to wait for a response before counting it lost")
+    parser.add_argument("--seed",type=int,default=0)
+    parser.add_argument("--bot-log",help="bot output, a file in the temporary work directory by default")
+    parser.add_argument("--json",help="also write the report here")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    test = LoadTest(args.games,args.guilds,args.shards,args.size,args.win_length,args.start_rate,args.think,
+        args.latency,args.jitter,args.edit_latency,not args.no_rate_limits,args.timeout,args.seed,args.bot_log)
+    report = asyncio.run(test.run())
+    print_report(report)
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump(report,f,indent=2)
+
+if __name__ == "__main__":
+    main()
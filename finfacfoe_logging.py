@@ -0,0 +1,137 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from enum import Enum
+
+#Logging setup for the bot
+#Records are put on a queue on the event loop thread and formatted and written by a listener thread
+#Per-move traces go to the finfacfoe.game logger at DEBUG through a GameLogger carrying the game's
+#trace id. A game is sampled once when it starts, so a traced game is traced from its first move to its last
+#
+#LOG_LEVEL       root level, INFO in production
+#GAME_LOG_LEVEL  level of the finfacfoe.game logger, DEBUG turns per-move traces on
+#TRACE_SAMPLE_RATE  fraction of games traced when GAME_LOG_LEVEL allows it
+#LOG_FORMAT      text or json
+
+GAME_LOGGER = "finfacfoe.game"
+
+#attributes every LogRecord has, anything else came in through extra
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("","",0,"",0,(),None))) | {"message","asctime","taskName"}
+
+#argument types that are safe to format later on the listener thread
+_SNAPSHOT_TYPES = (str,int,float,bool,type(None),Enum)
+
+_sample_rate = 1.0
+_listener = None
+
+class Lazy():
+    #Argument formatted only when the record is written, func and args must not change afterwards
+    __slots__ = ("func","args")
+
+    def __init__(self,func,*args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+def sampled(game_id):
+    #Same answer for a game id on every call and every process
+    if _sample_rate >= 1.0:
+        return True
+    if _sample_rate <= 0.0 or game_id is None:
+        return False
+    return ((game_id*0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) < _sample_rate*(1 << 64)
+
+def trace_id(game_id):
+    return f"{(game_id*0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFF:012x}" if game_id is not None else os.urandom(6).hex()
+
+class GameLogger(logging.LoggerAdapter):
+    def __init__(self,logger,game_id):
+        super().__init__(logger,{"game_id": game_id,"trace_id": trace_id(game_id)})
+        self.sampled = sampled(game_id)
+
+    def isEnabledFor(self,level):
+        #Games left out of the sample skip DEBUG before anything is formatted
+        if level < logging.INFO and not self.sampled:
+            return False
+        return self.logger.isEnabledFor(level)
+
+    def process(self,msg,kwargs):
+        extra = kwargs.get("extra")
+        kwargs["extra"] = self.extra if extra is None else {**self.extra,**extra}
+        return msg, kwargs
+
+def game_logger(game_id):
+    return GameLogger(logging.getLogger(GAME_LOGGER),game_id)
+
+class QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self,record):
+        #The stock handler formats on the calling thread, here only mutable arguments are
+        #resolved now and the rest of the formatting happens on the listener thread
+        args = record.args
+        if args and (not isinstance(args,tuple) or not all(isinstance(arg,_SNAPSHOT_TYPES) or type(arg) is Lazy for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+def _extras(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRS}
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self,record):
+        line = super().format(record)
+        extras = _extras(record)
+        if extras:
+            line += " [" + " ".join(f"{key}={value}" for key, value in extras.items()) + "]"
+        return line
+
+class JSONFormatter(logging.Formatter):
+    def format(self,record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extras(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry,default=str)
+
+def setup_logging(level=logging.INFO,game_level=None,fmt="text",sample_rate=1.0,stream=None):
+    #Replace the root handlers with the queue, returns the listener writing to stream
+    global _sample_rate, _listener
+    stop_logging()
+    _sample_rate = sample_rate
+
+    output = logging.StreamHandler(sys.stderr if stream is None else stream)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+    logging.getLogger(GAME_LOGGER).setLevel(level if game_level is None else game_level)
+
+    _listener = logging.handlers.QueueListener(log_queue,output)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    #Write out everything still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
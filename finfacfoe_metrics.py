@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+
+#In-process metrics with a Prometheus text endpoint
+#Histograms keep fixed bucket counts, so observing is a bisect and two additions on the event loop
+#and nothing is stored per sample. Gauges can read a callable when scraped
+
+#seconds, tuned around Discord's 3 second interaction deadline
+LATENCY_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.0,3.0,5.0,10.0)
+
+def _labels_text(names,values,extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names,values)] + [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value,float) else str(value)
+
+class Metric():
+    kind = None
+
+    def __init__(self,name,help,labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        #label values -> child holding the numbers
+        self.children = {}
+
+    def labels(self,*values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._child()
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",f"# TYPE {self.name} {self.kind}"]
+        for values, child in self.children.items():
+            lines.extend(self._render_child(values,child))
+        return lines
+
+class _Value():
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self,amount=1):
+        self.value += amount
+
+    def set(self,value):
+        self.value = value
+
+class Counter(Metric):
+    kind = "counter"
+    _child = _Value
+
+    def __init__(self,name,help,labelnames=()):
+        super().__init__(name,help,labelnames)
+        if not labelnames:
+            self.inc = self.labels().inc
+
+    def _render_child(self,values,child):
+        return [f"{self.name}{_labels_text(self.labelnames,values)} {_number(child.value)}"]
+
+class Gauge(Metric):
+    kind = "gauge"
+    _child = _Value
+
+    def __init__(self,name,help,func=None):
+        super().__init__(name,help)
+        self.func = func
+        child = self.labels()
+        self.set, self.inc = child.set, child.inc
+
+    def _render_child(self,values,child):
+        value = self.func() if self.func is not None else child.value
+        return [f"{self.name} {_number(value)}"]
+
+class _HistogramChild():
+    __slots__ = ("bounds","counts","sum","count")
+
+    def __init__(self,bounds):
+        self.bounds = bounds
+        self.counts = [0]*(len(bounds)+1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self,value):
+        self.counts[bisect_left(self.bounds,value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self,q):
+        #Upper bound of the bucket holding the q-th sample, what a scraper would estimate
+        if not self.count:
+            return 0.0
+        target = q*self.count
+        seen = 0
+        for bound, count in zip(self.bounds+(float("inf"),),self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self,name,help,labelnames=(),buckets=LATENCY_BUCKETS):
+        super().__init__(name,help,labelnames)
+        self.buckets = tuple(buckets)
+        if not labelnames:
+            self.observe = self.labels().observe
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self,values,child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets+(float("inf"),),child.counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_labels_text(self.labelnames,values,[('le',_number(bound))])} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels_text(self.labelnames,values)} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{_labels_text(self.labelnames,values)} {child.count}")
+        return lines
+
+class RateMeter():
+    #Events per second over the last `window` seconds, counted in one-second slots
+    def __init__(self,window=60):
+        self.window = window
+        self.slots = deque()
+
+    def mark(self,now=None):
+        second = int(time.monotonic() if now is None else now)
+        if self.slots and self.slots[-1][0] == second:
+            self.slots[-1][1] += 1
+        else:
+            self.slots.append([second,1])
+            while self.slots[0][0] <= second-self.window:
+                self.slots.popleft()
+
+    def rate(self,now=None):
+        second = int(time.monotonic() if now is None else now)
+        return sum(count for slot, count in self.slots if slot > second-self.window)/self.window
+
+class Registry():
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self,metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self,name,help,labelnames=()):
+        return self.register(Counter(name,help,labelnames))
+
+    def gauge(self,name,help,func=None):
+        return self.register(Gauge(name,help,func))
+
+    def histogram(self,name,help,labelnames=(),buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name,help,labelnames,buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines)+"\n"
+
+REGISTRY = Registry()
+
+#------------------------------
+#Interaction path
+
+FIRST_RESPONSE = REGISTRY.histogram("finfacfoe_interaction_first_response_seconds",
+    "Time from receiving an interaction to its first response",("kind",))
+CALLBACK = REGISTRY.histogram("finfacfoe_interaction_callback_seconds",
+    "Time from receiving an interaction to the end of its handler, board edits are sent in the background",("kind",))
+DEADLINE_MISSED = REGISTRY.counter("finfacfoe_interaction_deadline_missed_total",
+    "Interactions whose first response came after Discord's 3 second limit",("kind",))
+LOCK_WAIT = REGISTRY.histogram("finfacfoe_game_lock_wait_seconds",
+    "Time a click waited for the game lock")
+RULE_CHECK = REGISTRY.histogram("finfacfoe_rule_check_seconds",
+    "Time in the synchronous move transition",buckets=(1e-6,2.5e-6,5e-6,1e-5,2.5e-5,5e-5,1e-4,2.5e-4,1e-3))
+
+#Message edits
+EDIT = REGISTRY.histogram("finfacfoe_edit_seconds","Duration of one message edit request",("route",))
+RATE_LIMIT_WAIT = REGISTRY.histogram("finfacfoe_rate_limit_wait_seconds",
+    "Time an edit waited on its route's rate-limit bucket",("route",))
+RATE_LIMITED = REGISTRY.counter("finfacfoe_rate_limited_total","Edits answered with 429",("route",))
+EDIT_QUEUE = REGISTRY.histogram("finfacfoe_edit_queue_seconds",
+    "Time from a board edit being queued to it being sent, merged edits count from the first",("route",))
+
+#Games
+MOVES = REGISTRY.counter("finfacfoe_moves_total","Moves placed",("piece",))
+MOVE_RATE = RateMeter()
+REGISTRY.gauge("finfacfoe_moves_per_second","Moves placed per second over the last minute",MOVE_RATE.rate)
+REJECTED = REGISTRY.counter("finfacfoe_rejected_moves_total","Clicks that did not place a piece",("reason",))
+GAMES_FINISHED = REGISTRY.counter("finfacfoe_games_finished_total","Games that ended",("result",))
+
+#Tournaments
+TOURNAMENT_GAMES = REGISTRY.counter("finfacfoe_tournament_games_started_total","Tournament legs started")
+TOURNAMENT_QUEUE_WAIT = REGISTRY.histogram("finfacfoe_tournament_queue_wait_seconds",
+    "Time a tournament leg waited for free players and a channel slot",buckets=(0.1,0.5,1.0,5.0,10.0,30.0,60.0,120.0,300.0,600.0))
+
+#AI opponent
+AI_SEARCH = REGISTRY.histogram("finfacfoe_ai_move_seconds",
+    "Time from asking the AI pool for a move to getting it, queueing for a worker included")
+AI_ITERATIONS = REGISTRY.counter("finfacfoe_ai_iterations_total","Search iterations run by the AI pool")
+AI_FALLBACKS = REGISTRY.counter("finfacfoe_ai_fallback_samples_total",
+    "Challenger determinizations placed without a consistent O history after rejection sampling gave up")
+
+#Process
+LOOP_LAG = REGISTRY.histogram("finfacfoe_event_loop_lag_seconds",
+    "How late the event loop woke a periodic timer, time every other callback waited behind the running one")
+
+class LagTracker():
+    #Largest lag seen since the last scrape, the histogram alone hides single long stalls
+    def __init__(self):
+        self.worst = 0.0
+
+    def observe(self,lag):
+        LOOP_LAG.observe(lag)
+        self.worst = max(self.worst,lag)
+
+    def take(self):
+        worst, self.worst = self.worst, 0.0
+        return worst
+
+LAG = LagTracker()
+REGISTRY.gauge("finfacfoe_event_loop_lag_max_seconds","Largest event loop lag since the last scrape",LAG.take)
+
+async def watch_event_loop(interval=0.1):
+    #Sleep interval and record how much later than asked the loop came back
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LAG.observe(max(0.0,loop.time()-start-interval))
+
+def resident_memory():
+    #Resident set size in bytes, the peak size where /proc is missing
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+REGISTRY.gauge("finfacfoe_resident_memory_bytes","Resident memory of the bot process",resident_memory)
+
+#------------------------------
+
+async def start_server(host="127.0.0.1",port=9108,registry=REGISTRY):
+    #Serve GET /metrics, returns the aiohttp runner to clean up on shutdown
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=registry.render(),content_type="text/plain",charset="utf-8",
+            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.add_routes([web.get("/metrics",metrics)])
+    runner = web.AppRunner(app,access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner,host,port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
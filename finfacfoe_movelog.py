@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from finfacfoe_core import X, O, TIE, CONTINUE
+from finfacfoe_engine import FinFacFoeState, MOVE
+
+#Append-only binary log of finished games
+#Each game is written once when it ends, as a fixed header followed by one byte per placed move,
+#the cell index y*size+x. X always moves first, so the piece of a move is its parity
+#Records are queued on the event loop and appended in batches by a single writer thread
+#Readers stream one record at a time, a log of millions of games is never held in memory
+#
+#File: MAGIC, then records back to back
+#Record: HEADER (game id, guild id, challenger id, boardmaster id, end time, size, win length,
+#result, move count), then move count bytes
+#A crash can leave a partial record at the end of the file, readers stop before it and the
+#writer cuts it off before appending again
+
+MAGIC = b"FFML\x01"
+HEADER = struct.Struct("<QQQQdBBbH")
+
+RESULT_NAMES = {X: "X",O: "O",TIE: "TIE",CONTINUE: "UNFINISHED"}
+
+class MoveLogError(ValueError):
+    pass
+
+class GameRecord():
+    __slots__ = ("game_id","guild_id","challenger_id","boardmaster_id","ended","size","win_length","result","moves")
+
+    def __init__(self,game_id,guild_id,challenger_id,boardmaster_id,ended,size,win_length,result,moves):
+        self.game_id = game_id
+        self.guild_id = guild_id
+        self.challenger_id = challenger_id
+        self.boardmaster_id = boardmaster_id
+        self.ended = ended
+        self.size = size
+        self.win_length = win_length
+        self.result = result
+        self.moves = moves
+
+    @classmethod
+    def from_game(cls,game):
+        return cls(game.game_id or 0,game.guild_id or 0,game.challenger.id,game.boardmaster.id,time.time(),
+            game.geometry.size,game.geometry.win_length,game.result,bytes(game.moves))
+
+    def encode(self):
+        return HEADER.pack(self.game_id,self.guild_id,self.challenger_id,self.boardmaster_id,self.ended,
+            self.size,self.win_length,self.result,len(self.moves)) + self.moves
+
+    def cells(self):
+        #(x, y) of each move in order
+        return [(index % self.size,index // self.size) for index in self.moves]
+
+    def to_dict(self):
+        return {
+            "game_id": self.game_id,
+            "guild_id": self.guild_id,
+            "challenger_id": self.challenger_id,
+            "boardmaster_id": self.boardmaster_id,
+            "ended": self.ended,
+            "size": self.size,
+            "win_length": self.win_length,
+            "result": RESULT_NAMES.get(self.result,self.result),
+            "moves": self.cells(),
+        }
+
+    def __repr__(self):
+        return f"GameRecord(game_id={self.game_id}, size={self.size}, result={RESULT_NAMES.get(self.result,self.result)}, moves={len(self.moves)})"
+
+#------------------------------
+#Reading
+
+def read_records(path):
+    #Yields every GameRecord in one log file
+    with open(path,"rb") as f:
+        magic = f.read(len(MAGIC))
+        if not magic:
+            return
+        if magic != MAGIC:
+            raise MoveLogError(f"{path} is not a move log")
+        while True:
+            header = f.read(HEADER.size)
+            if not header:
+                return
+            if len(header) < HEADER.size:
+                logging.warning(f"{path}: partial record at the end of the log, ignored")
+                return
+            *fields, count = HEADER.unpack(header)
+            moves = f.read(count)
+            if len(moves) < count:
+                logging.warning(f"{path}: partial record at the end of the log, ignored")
+                return
+            yield GameRecord(*fields,moves)
+
+def complete_length(f):
+    #Bytes of f up to the end of its last whole record, f is read from the start
+    f.seek(0)
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        if MAGIC.startswith(magic):
+            return 0
+        raise MoveLogError(f"{f.name} is not a move log")
+    end = f.seek(0,os.SEEK_END)
+    position = len(MAGIC)
+    while True:
+        f.seek(position)
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return position
+        count = HEADER.unpack(header)[-1]
+        if position+HEADER.size+count > end:
+            return position
+        position += HEADER.size+count
+
+def iter_records(paths):
+    for path in paths:
+        yield from read_records(path)
+
+def find_record(paths,game_id):
+    return next((record for record in iter_records(paths) if record.game_id == game_id),None)
+
+def replay(record):
+    #Plays the record through the rule engine, yields the state after each move
+    #The same state object is yielded every time, copy what has to outlive the next step
+    state = FinFacFoeState(record.size,record.win_length)
+    for number, index in enumerate(record.moves,1):
+        x, y = index % record.size, index // record.size
+        if state.play(state.current_player,x,y) != MOVE.PLACED:
+            raise MoveLogError(f"game {record.game_id}: move {number} on {x},{y} is not legal")
+        yield state
+
+def state_at(record,move):
+    #State after the first `move` moves, 0 is the empty board
+    if move <= 0:
+        return FinFacFoeState(record.size,record.win_length)
+    for state in replay(record):
+        if state.count >= move:
+            break
+    return state
+
+def verify(record):
+    #Replays the whole game and checks the logged result
+    state = FinFacFoeState(record.size,record.win_length)
+    for state in replay(record):
+        pass
+    if state.result != record.result:
+        raise MoveLogError(f"game {record.game_id}: replay ends in {RESULT_NAMES[state.result]}, log says {RESULT_NAMES.get(record.result,record.result)}")
+    return state
+
+EXPORT_FIELDS = ("game_id","guild_id","challenger_id","boardmaster_id","ended","size","win_length","result","moves")
+
+def export(records,out,fmt="jsonl"):
+    #Streams records to out as JSON lines or CSV, moves as "x,y x,y ..." in CSV, returns the count
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_FIELDS)
+        for record in records:
+            row = record.to_dict()
+            row["moves"] = " ".join(f"{x},{y}" for x, y in row["moves"])
+            writer.writerow([row[field] for field in EXPORT_FIELDS])
+            count += 1
+    else:
+        for record in records:
+            out.write(json.dumps(record.to_dict())+"\n")
+            count += 1
+    return count
+
+#------------------------------
+#Writing
+
+class MoveLog():
+    def __init__(self,path="finfacfoe_moves.fml",flush_interval=1.0,batch_size=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        #encoded records not written yet
+        self.pending = []
+
+        #one thread owns the file
+        self.executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix="finfacfoe-movelog")
+        self.file = None
+        #end of the last whole record, a failed append is cut back to it
+        self.end = 0
+        self.flusher = None
+        self.wakeup = None
+
+    def _run(self,func,*args):
+        return asyncio.get_running_loop().run_in_executor(self.executor,func,*args)
+
+    def _open(self):
+        #unbuffered, a batch is one write and a failed one must not linger in a buffer
+        self.file = open(self.path,"a+b",buffering=0)
+        self.end = complete_length(self.file)
+        size = self.file.seek(0,os.SEEK_END)
+        if size > self.end:
+            logging.warning(f"{self.path}: cut {size-self.end} bytes of a partial record off the end of the log")
+            self._truncate()
+        if self.end == 0:
+            self._write(MAGIC)
+
+    def _truncate(self):
+        os.ftruncate(self.file.fileno(),self.end)
+        self.file.seek(self.end)
+
+    def _write(self,data):
+        view = memoryview(data)
+        try:
+            while view:
+                view = view[self.file.write(view):]
+        except OSError:
+            #disk full and the like, the next batch must start on a record boundary
+            self._truncate()
+            raise
+        self.end += len(data)
+
+    async def open(self):
+        await self._run(self._open)
+        self.wakeup = asyncio.Event()
+        self.flusher = asyncio.create_task(self._flush_loop())
+
+    def record(self,game):
+        #Queue a game that just ended, games without a placed move are not logged
+        if not game.moves:
+            return
+        #games stored before the log existed lost their first moves
+        if len(game.moves) != game.count:
+            logging.debug(f"Game {game.game_id} has no full move history, not logged")
+            return
+        self.pending.append(GameRecord.from_game(game).encode())
+        if len(self.pending) >= self.batch_size and self.wakeup is not None:
+            self.wakeup.set()
+
+    async def flush(self):
+        if not self.pending or self.file is None:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await self._run(self._write,b"".join(batch))
+        except OSError:
+            logging.exception(f"Failed to append {len(batch)} games to {self.path}, retrying with the next flush")
+            #the file was cut back to the last whole record, the batch goes in front of newer games
+            self.pending[:0] = batch
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(),self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+        if self.file is not None:
+            await self._run(self.file.close)
+            self.file = None
+        self.executor.shutdown(wait=True)
+
+#------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Read FinFacFoe move logs")
+    commands = parser.add_subparsers(dest="command",required=True)
+
+    export_parser = commands.add_parser("export",help="write every game as JSON lines or CSV")
+    export_parser.add_argument("paths",nargs="+")
+    export_parser.add_argument("--format",choices=("jsonl","csv"),default="jsonl")
+    export_parser.add_argument("--output",help="file to write, stdout by default")
+
+    replay_parser = commands.add_parser("replay",help="print the board of one game after each move")
+    replay_parser.add_argument("paths",nargs="+")
+    replay_parser.add_argument("--game",type=int,required=True)
+    replay_parser.add_argument("--move",type=int,help="only the board after this many moves")
+
+    verify_parser = commands.add_parser("verify",help="replay every game and check its logged result")
+    verify_parser.add_argument("paths",nargs="+")
+
+    args = parser.parse_args()
+    match args.command:
+        case "export":
+            out = open(args.output,"w",newline="") if args.output else sys.stdout
+            try:
+                count = export(iter_records(args.paths),out,args.format)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            print(f"Exported {count} games",file=sys.stderr)
+        case "replay":
+            record = find_record(args.paths,args.game)
+            if record is None:
+                sys.exit(f"game {args.game} is not in the log")
+            if args.move is not None:
+                print(state_at(record,args.move).debug_board())
+                return
+            for state in replay(record):
+                print(f"move {state.count}, BM {state.bm_state.name}\n{state.debug_board()}\n")
+            print(RESULT_NAMES.get(record.result,record.result))
+        case "verify":
+            games = 0
+            results = {}
+            start = time.perf_counter()
+            for record in iter_records(args.paths):
+                verify(record)
+                games += 1
+                name = RESULT_NAMES.get(record.result,record.result)
+                results[name] = results.get(name,0)+1
+            print(f"{games} games verified in {time.perf_counter()-start:.2f}s: {results}")
+
+if __name__ == "__main__":
+    main()
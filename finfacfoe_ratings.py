@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from finfacfoe_core import X, O, TIE
+
+#Elo ratings kept apart for the challenger and boardmaster roles
+#A finished game moves the challenger's challenger rating and the boardmaster's boardmaster rating,
+#the expected score of each side comes from the other side's rating in its own role
+#
+#Each role keeps its ratings in a dict and a sorted index of (-rating, player id), so a game end is
+#a remove and an insert per player, rank a few bisects and top N a slice, however many players
+#Games are rated in memory at once and queued, a single writer thread like the game store's replays
+#the queue on the table in batches. The HTTP workers rate into the same table, so the table is the
+#truth: a batch is replayed read-modify-write in one write transaction and every row changed since
+#the last batch, by this process or another, is loaded back into the index
+
+ROLES = ("challenger","boardmaster")
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+#players in their first games move faster towards their level
+PROVISIONAL_GAMES = 10
+PROVISIONAL_K_FACTOR = 64.0
+#Seconds of rows read back again at each flush, for commits stamped before the previous flush ran
+SYNC_SLACK = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratings (
+    player_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    ties INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (player_id, role)
+)
+"""
+
+INDEX = "CREATE INDEX IF NOT EXISTS ratings_updated ON ratings (updated)"
+
+COLUMNS = ("player_id","role","rating","games","wins","losses","ties","updated")
+UPSERT = f"INSERT OR REPLACE INTO ratings ({','.join(COLUMNS)}) VALUES ({','.join('?'*len(COLUMNS))})"
+
+def connect(path):
+    conn = sqlite3.connect(path,check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(SCHEMA)
+    conn.execute(INDEX)
+    conn.commit()
+    return conn
+
+def expected_score(rating,opponent):
+    return 1.0/(1.0+10.0**((opponent-rating)/400.0))
+
+#Entries per block of the sorted index, an insert or remove moves at most twice this many pointers
+BLOCK_SIZE = 512
+
+class SortedIndex():
+    #Sorted list of keys split into blocks, a flat list would move half of a large
+    #leaderboard on every rating change. maxes[i] is the last key of blocks[i]
+    def __init__(self,keys=()):
+        keys = sorted(keys)
+        self.blocks = [keys[i:i+BLOCK_SIZE] for i in range(0,len(keys),BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def _block(self,key):
+        return min(bisect_left(self.maxes,key),len(self.maxes)-1)
+
+    def add(self,key):
+        self.size += 1
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            return
+        i = self._block(key)
+        block = self.blocks[i]
+        insort(block,key)
+        self.maxes[i] = block[-1]
+        if len(block) > 2*BLOCK_SIZE:
+            self.blocks[i:i+1] = [block[:BLOCK_SIZE],block[BLOCK_SIZE:]]
+            self.maxes[i:i+1] = [block[BLOCK_SIZE-1],block[-1]]
+
+    def remove(self,key):
+        #key must be in the index
+        i = self._block(key)
+        block = self.blocks[i]
+        del block[bisect_left(block,key)]
+        self.size -= 1
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+
+    def index(self,key):
+        #position of key, or where it would go
+        if not self.blocks:
+            return 0
+        i = self._block(key)
+        return sum(map(len,self.blocks[:i]))+bisect_left(self.blocks[i],key)
+
+    def slice(self,start,count):
+        keys = []
+        for block in self.blocks:
+            if start >= len(block):
+                start -= len(block)
+                continue
+            keys.extend(block[start:start+count-len(keys)])
+            start = 0
+            if len(keys) >= count:
+                break
+        return keys
+
+class PlayerRating():
+    __slots__ = ("rating","games","wins","losses","ties")
+
+    def __init__(self,rating=INITIAL_RATING,games=0,wins=0,losses=0,ties=0):
+        self.rating = rating
+        self.games = games
+        self.wins = wins
+        self.losses = losses
+        self.ties = ties
+
+    def k_factor(self):
+        return PROVISIONAL_K_FACTOR if self.games < PROVISIONAL_GAMES else K_FACTOR
+
+    def count(self,won,tied):
+        self.games += 1
+        if tied:
+            self.ties += 1
+        elif won:
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def __repr__(self):
+        return f"PlayerRating(rating={self.rating:.1f}, games={self.games}, {self.wins}/{self.losses}/{self.ties})"
+
+def rating_changes(challenger,boardmaster,result):
+    #(challenger, boardmaster) rating changes of one game, result is X, O or TIE
+    score = 1.0 if result == X else 0.0 if result == O else 0.5
+    expected = expected_score(challenger.rating,boardmaster.rating)
+    return challenger.k_factor()*(score-expected), boardmaster.k_factor()*(expected-score)
+
+def _record_rows(conn,challenger_id,boardmaster_id,result):
+    #Rate one game on the table, inside a write transaction the caller holds
+    entries = {}
+    for role, player_id in (("challenger",challenger_id),("boardmaster",boardmaster_id)):
+        row = conn.execute(f"SELECT {','.join(COLUMNS[2:-1])} FROM ratings WHERE player_id = ? AND role = ?",(player_id,role)).fetchone()
+        entries[role] = PlayerRating(*row) if row else PlayerRating()
+    challenger, boardmaster = entries["challenger"], entries["boardmaster"]
+    deltas = rating_changes(challenger,boardmaster,result)
+    for (role, player_id, entry), delta in zip((("challenger",challenger_id,challenger),("boardmaster",boardmaster_id,boardmaster)),deltas):
+        entry.rating += delta
+        entry.count((result == X) == (role == "challenger"),result == TIE)
+        conn.execute(UPSERT,(player_id,role,entry.rating,entry.games,entry.wins,entry.losses,entry.ties,time.time()))
+    return deltas
+
+def record_in_db(conn,challenger_id,boardmaster_id,result):
+    #RatingBook.record straight on the table, for processes that keep no book in memory
+    #One write transaction, so processes rating games at once do not lose updates
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return _record_rows(conn,challenger_id,boardmaster_id,result)
+
+class Leaderboard():
+    #Ratings of one role with their sorted index
+    def __init__(self):
+        self.ratings = {}
+        #(-rating, player id), best first
+        self.order = SortedIndex()
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def get(self,player_id):
+        return self.ratings.get(player_id)
+
+    def load(self,entries):
+        #(player id, PlayerRating) pairs read at startup, sorted once
+        self.ratings.update(entries)
+        self.order = SortedIndex((-entry.rating,player_id) for player_id, entry in self.ratings.items())
+
+    def entry(self,player_id):
+        #PlayerRating of player_id, a new player starts at INITIAL_RATING
+        entry = self.ratings.get(player_id)
+        if entry is None:
+            entry = self.ratings[player_id] = PlayerRating()
+            self.order.add((-entry.rating,player_id))
+        return entry
+
+    def set_rating(self,player_id,entry,rating):
+        self.order.remove((-entry.rating,player_id))
+        entry.rating = rating
+        self.order.add((-rating,player_id))
+
+    def replace(self,player_id,stored):
+        #Take a PlayerRating read back from the table in place of the one in memory
+        entry = self.entry(player_id)
+        self.set_rating(player_id,entry,stored.rating)
+        entry.games, entry.wins, entry.losses, entry.ties = stored.games, stored.wins, stored.losses, stored.ties
+
+    def rank(self,player_id):
+        #1 for the best rating, None for a player without one
+        entry = self.ratings.get(player_id)
+        if entry is None:
+            return None
+        return self.order.index((-entry.rating,player_id))+1
+
+    def top(self,count=10,offset=0):
+        #[(rank, player id, PlayerRating)] of the best count players after offset
+        return [(offset+i+1,player_id,self.ratings[player_id]) for i, (key, player_id) in enumerate(self.order.slice(offset,count))]
+
+class RatingBook():
+    def __init__(self,path="finfacfoe_ratings.db",flush_interval=2.0,batch_size=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.boards = {role: Leaderboard() for role in ROLES}
+
+        #(challenger id, boardmaster id, result) of games rated since the last flush
+        self.pending = []
+        #time.time() the rows changed after were not read back yet
+        self.synced = 0.0
+
+        #one thread owns the connection
+        self.executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix="finfacfoe-ratings")
+        self.conn = None
+        self.flusher = None
+        self.wakeup = None
+
+    def __getitem__(self,role):
+        return self.boards[role]
+
+    def record(self,challenger_id,boardmaster_id,result):
+        #Rate one finished game, result is X, O or TIE, returns the (challenger, boardmaster) changes
+        challenger = self.boards["challenger"].entry(challenger_id)
+        boardmaster = self.boards["boardmaster"].entry(boardmaster_id)
+        challenger_delta, boardmaster_delta = rating_changes(challenger,boardmaster,result)
+
+        for role, player_id, entry, delta in (("challenger",challenger_id,challenger,challenger_delta),("boardmaster",boardmaster_id,boardmaster,boardmaster_delta)):
+            self.boards[role].set_rating(player_id,entry,entry.rating+delta)
+            entry.count((result == X) == (role == "challenger"),result == TIE)
+        #the table rates it again against what is stored, which wins once it is read back
+        self.pending.append((challenger_id,boardmaster_id,result))
+
+        if len(self.pending) >= self.batch_size and self.wakeup is not None:
+            self.wakeup.set()
+        return challenger_delta, boardmaster_delta
+
+    #------------------------------
+    #Storage
+
+    def _run(self,func,*args):
+        return asyncio.get_running_loop().run_in_executor(self.executor,func,*args)
+
+    def _connect(self):
+        self.conn = connect(self.path)
+
+    def _load(self):
+        return self.conn.execute(f"SELECT {','.join(COLUMNS[:-1])} FROM ratings").fetchall()
+
+    def _sync(self,games,since):
+        #Replay games on the table in one write transaction, then read every row changed since
+        if games:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                for game in games:
+                    _record_rows(self.conn,*game)
+        return self.conn.execute(f"SELECT {','.join(COLUMNS)} FROM ratings WHERE updated >= ?",(since,)).fetchall()
+
+    async def open(self):
+        #Connect and read every stored rating, returns the number of rated players
+        await self._run(self._connect)
+        start = time.perf_counter()
+        self.synced = time.time()
+        rows = await self._run(self._load)
+        for role in ROLES:
+            self.boards[role].load((player_id,PlayerRating(*values)) for player_id, row_role, *values in rows if row_role == role)
+        logging.info(f"Loaded {len(rows)} ratings in {time.perf_counter()-start:.3f}s")
+        self.wakeup = asyncio.Event()
+        self.flusher = asyncio.create_task(self._flush_loop())
+        return len(rows)
+
+    async def flush(self):
+        #Write the queued games and load back what changed, also what the HTTP workers rated
+        if self.conn is None:
+            return
+        games, self.pending = self.pending, []
+        #another process may commit a row stamped a little before the last one read here
+        since = self.synced-SYNC_SLACK
+        started = time.time()
+        try:
+            rows = await self._run(self._sync,games,since)
+        except sqlite3.Error:
+            logging.exception(f"Failed to write {len(games)} rated games, retrying with the next flush")
+            self.pending[:0] = games
+            return
+        self.synced = started
+        #players in games rated meanwhile keep their newer rating in memory until the next flush
+        rated = {(player_id,role) for game in self.pending for player_id, role in zip(game,ROLES)}
+        for player_id, role, *values, updated in rows:
+            if (player_id,role) not in rated:
+                self.boards[role].replace(player_id,PlayerRating(*values))
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(),self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self.conn = None
+        self.executor.shutdown(wait=True)
+
+#------------------------------
+
+def bench(players=200000,games=1000000,queries=10000,seed=1):
+    #Rating updates and leaderboard queries on a synthetic population, nothing is written
+    rng = random.Random(seed)
+    book = RatingBook(path=None)
+    ids = [rng.getrandbits(62) for _ in range(players)]
+    results = (X,O,TIE)
+
+    start = time.perf_counter()
+    for _ in range(games):
+        challenger, boardmaster = rng.sample(ids,2)
+        book.record(challenger,boardmaster,rng.choice(results))
+    elapsed = time.perf_counter()-start
+    print(f"{games} games between {players} players rated in {elapsed:.2f}s, {elapsed/games*1e6:.1f}µs per game")
+
+    board = book["challenger"]
+    start = time.perf_counter()
+    for _ in range(queries):
+        board.rank(rng.choice(ids))
+    rank_time = (time.perf_counter()-start)/queries
+    start = time.perf_counter()
+    for _ in range(queries):
+        board.top(10,rng.randrange(len(board)))
+    top_time = (time.perf_counter()-start)/queries
+    print(f"{len(board)} rated challengers: rank {rank_time*1e6:.1f}µs, top 10 {top_time*1e6:.1f}µs")
+    best = board.top(3)
+    print("best challengers:",", ".join(f"{rank}. {player_id} {entry.rating:.0f}" for rank, player_id, entry in best))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FinFacFoe rating updates and leaderboard queries")
+    parser.add_argument("--players",type=int,default=200000)
+    parser.add_argument("--games",type=int,default=1000000)
+    parser.add_argument("--queries",type=int,default=10000)
+    args = parser.parse_args()
+    bench(args.players,args.games,args.queries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from functools import lru_cache
+import discord
+
+#Board rendering as a pure function of game state and audience
+#
+#The state is reduced to an integer key holding only what the audience may see,
+#the component payload for a key is built once and shared by every game in that state
+#Custom ids are the same in every game, discord.py routes a click by message id first
+#
+#A message holds at most 5 rows of 5 buttons, larger boards are split into tiles sent as
+#separate messages. A key covers one tile of n = width*height cells, masks are tile-local:
+#tile | public << 16 | finished << 17 | X mask << 18 | O mask << 18+n | legal O moves << 18+2n
+#Tile: x0 | y0 << 4 | width << 8 | height << 12
+#Public keys carry only revealed O cells and no legal moves, so the public render can not leak them
+
+RENDER_CACHE_SIZE = 4096
+
+EMPTY_LABEL = '\u200b'
+MAX_TILE = 5
+
+def board_tiles(size):
+    #(x0, y0, width, height) of each message of a size x size board, row by row
+    #the board is cut into near-equal spans, 7 is 4+3 rather than 5+2
+    count = -(-size // MAX_TILE)
+    spans = [(size*i//count,size*(i+1)//count-size*i//count) for i in range(count)]
+    return tuple((x0,y0,width,height) for y0, height in spans for x0, width in spans)
+
+def _tile_mask(mask,size,tile):
+    x0, y0, width, height = tile
+    if width == size and height == size:
+        return mask
+    row = (1 << width)-1
+    local = 0
+    for j in range(height):
+        local |= (mask >> ((y0+j)*size+x0) & row) << (j*width)
+    return local
+
+def render_key(state,is_visible,tile=None):
+    size = state.geometry.size
+    tile = (0,0,size,size) if tile is None else tile
+    x0, y0, width, height = tile
+    n = width*height
+    key = x0 | y0 << 4 | width << 8 | height << 12 | int(is_visible) << 16 | int(state.finished) << 17
+    if is_visible:
+        o_mask = state.revealed & state.core.o_mask
+        legal = 0
+    else:
+        o_mask = state.core.o_mask
+        legal = 0 if state.finished else _tile_mask(state.legal_moves(),size,tile)
+    masks = (legal << n | _tile_mask(o_mask,size,tile)) << n | _tile_mask(state.core.x_mask,size,tile)
+    return key | masks << 18
+
+def custom_id(is_visible,x,y):
+    return f"fin:{int(is_visible)}:{x}:{y}"
+
+def parse_custom_id(custom_id):
+    #(is_visible, x, y), older ids also carried the game id before these three
+    is_visible, x, y = custom_id.split(":")[-3:]
+    return is_visible == "1", int(x), int(y)
+
+def _button(style,label,disabled,is_visible,x,y):
+    return {"type": 2,"style": style.value,"label": label,"disabled": disabled,"custom_id": custom_id(is_visible,x,y)}
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_rows(key):
+    #Action rows of one tile, shared between games so they must not be modified
+    x0, y0, width, height = key & 0xF, key >> 4 & 0xF, key >> 8 & 0xF, key >> 12 & 0xF
+    is_visible = bool(key >> 16 & 1)
+    finished = bool(key >> 17 & 1)
+    n = width*height
+    cells = (1 << n)-1
+    x_mask = key >> 18 & cells
+    o_mask = key >> 18+n & cells
+    legal = key >> 18+2*n & cells
+
+    rows = []
+    for j in range(height):
+        row = []
+        for i in range(width):
+            bit = 1 << (j*width+i)
+            x, y = x0+i, y0+j
+            if x_mask & bit:
+                button = _button(discord.ButtonStyle.danger,"X",True,is_visible,x,y)
+            elif is_visible:
+                #o_mask is only the O cells the challenger already found
+                style = discord.ButtonStyle.gray if o_mask & bit else discord.ButtonStyle.blurple
+                button = _button(style,EMPTY_LABEL,finished,is_visible,x,y)
+            elif o_mask & bit:
+                button = _button(discord.ButtonStyle.success,"O",True,is_visible,x,y)
+            elif legal & bit:
+                button = _button(discord.ButtonStyle.blurple,EMPTY_LABEL,False,is_visible,x,y)
+            else:
+                #cells the lock rules out this turn
+                button = _button(discord.ButtonStyle.gray,EMPTY_LABEL,True,is_visible,x,y)
+            row.append(button)
+        rows.append({"type": 1,"components": row})
+    return rows
+
+def render(state,is_visible,tile=None):
+    #Component payload for one audience, tile defaults to the whole board
+    return render_rows(render_key(state,is_visible,tile))
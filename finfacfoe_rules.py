@@ -0,0 +1,212 @@
+from array import array
+import finfacfoe_core as core
+from finfacfoe_core import STATES, COL_MASKS, ROW_MASKS, FULL_MASK, CENTER_MASK
+
+#Precomputed legal-move table for the boardmaster lock state machine
+#
+#Key: occupied mask (9 bits), bm_state, lock column, lock row
+#The move count is the popcount of the occupied mask, so it is part of the key implicitly
+#Entry: bits 0-8 legal-move mask, then 6 bits per cell for the packed next state
+#Packed state: state index (2 bits) | column (2 bits) | row (2 bits), 3 means no lock
+
+NO_LOCK = 3
+STATE_LIST = tuple(STATES)
+FREE, FIXED, COL, ROW = range(4)
+
+CELL_X = tuple(i % core.SIZE for i in range(core.SIZE*core.SIZE))
+CELL_Y = tuple(i // core.SIZE for i in range(core.SIZE*core.SIZE))
+POPCOUNT = tuple(bin(mask).count("1") for mask in range(FULL_MASK+1))
+
+def pack_state(state,c,r):
+    return (state << 4) | (c << 2) | r
+
+def table_index(occupied,bm_state,c,r):
+    return (occupied << 6) | ((bm_state.value-1) << 4) | ((NO_LOCK if c is None else c) << 2) | (NO_LOCK if r is None else r)
+
+def _lock(value):
+    return None if value == NO_LOCK else value
+
+def _build_entry(occupied,state,c,r,center_ban=True):
+    open_cells = FULL_MASK & ~occupied
+    banned = CENTER_MASK if center_ban else 0
+    count = POPCOUNT[occupied]
+    next_states = [pack_state(state,c,r)]*9
+
+    #Challenger turn, lock state is untouched
+    if count % 2 == 0:
+        legal = open_cells & ~banned if count == 0 else open_cells
+
+    #first turn for BM, second turn overall
+    elif count == 1:
+        legal = open_cells & ~banned
+        next_states = [pack_state(FIXED,CELL_X[i],CELL_Y[i]) for i in range(9)]
+
+    elif state == FREE:
+        legal = open_cells
+        next_states = [pack_state(FIXED,CELL_X[i],CELL_Y[i]) for i in range(9)]
+
+    elif state == FIXED:
+        if c == NO_LOCK or r == NO_LOCK:
+            return 0
+        axis = (COL_MASKS[c] | ROW_MASKS[r]) & open_cells
+        if axis:
+            legal = axis
+            next_states = [pack_state(COL if CELL_X[i] == c else ROW,c,r) for i in range(9)]
+        #Axis filled, release BM
+        else:
+            legal = open_cells
+            next_states = [pack_state(FREE,c,r)]*9
+
+    elif state == COL or state == ROW:
+        lock = c if state == COL else r
+        if lock == NO_LOCK:
+            return 0
+        line = (COL_MASKS[lock] if state == COL else ROW_MASKS[lock]) & open_cells
+        if line:
+            legal = line
+        #Line filled, release BM
+        else:
+            legal = open_cells
+            next_states = [pack_state(FREE,c,r)]*9
+
+    entry = legal
+    for i in range(9):
+        if legal >> i & 1:
+            entry |= next_states[i] << (9 + 6*i)
+    return entry
+
+def build_table(center_ban=True):
+    #center_ban=False builds the variant without the first-move center rule
+    table = array("Q",bytes(8*((FULL_MASK+1) << 6)))
+    for occupied in range(FULL_MASK+1):
+        for state in range(4):
+            for c in range(4):
+                for r in range(4):
+                    table[(occupied << 6) | (state << 4) | (c << 2) | r] = _build_entry(occupied,state,c,r,center_ban)
+    return table
+
+#Built on first use rather than at import, the bot warms it once it is ready
+_TABLE = None
+
+def get_table():
+    global _TABLE
+    if _TABLE is None:
+        _TABLE = build_table()
+    return _TABLE
+
+def __getattr__(name):
+    #rules.TABLE keeps working for the simulator and solver
+    if name == "TABLE":
+        return get_table()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def lookup(occupied,bm_state,c,r):
+    table = _TABLE if _TABLE is not None else get_table()
+    return table[table_index(occupied,bm_state,c,r)]
+
+def legal_mask(entry):
+    return entry & FULL_MASK
+
+def encode_state(bm_state,c,r):
+    return table_index(0,bm_state,c,r)
+
+def decode_state(packed):
+    return STATE_LIST[packed >> 4], _lock(packed >> 2 & 3), _lock(packed & 3)
+
+def next_state(entry,index):
+    #returns (bm_state, c, r) after a legal move on cell index
+    return decode_state(entry >> (9 + 6*index) & 0x3F)
+
+#------------------------------
+
+def grid_transition(geometry,occupied,bm_state,c,r,x,y,center_ban=True):
+    #Reference implementation of the boardmaster rules on any core.Geometry, one move at a time
+    #returns the next (bm_state, c, r) or None for an illegal move
+    if occupied & geometry.cell_bit(x,y):
+        return None
+    count = occupied.bit_count()
+    in_center = geometry.center_mask & geometry.cell_bit(x,y)
+
+    #Challenger turn
+    if count % 2 == 0:
+        if center_ban and count == 0 and in_center:
+            return None
+        return bm_state, c, r
+
+    #first turn for BM, second turn overall
+    if count == 1:
+        if center_ban and in_center:
+            return None
+        return STATES.FIXED, x, y
+
+    col_open = lambda c: occupied & geometry.col_masks[c] != geometry.col_masks[c]
+    row_open = lambda r: occupied & geometry.row_masks[r] != geometry.row_masks[r]
+    match bm_state:
+        case STATES.FREE:
+            return STATES.FIXED, x, y
+        case STATES.FIXED:
+            if col_open(c) or row_open(r):
+                if c == x:
+                    return STATES.COL, c, r
+                elif r == y:
+                    return STATES.ROW, c, r
+                return None
+            return STATES.FREE, c, r
+        case STATES.COL:
+            if col_open(c):
+                return (bm_state, c, r) if x == c else None
+            return STATES.FREE, c, r
+        case STATES.ROW:
+            if row_open(r):
+                return (bm_state, c, r) if y == r else None
+            return STATES.FREE, c, r
+    return None
+
+def scalar_transition(occupied,bm_state,c,r,x,y,center_ban=True):
+    #The 3x3 rules the table is built from
+    return grid_transition(core.geometry(),occupied,bm_state,c,r,x,y,center_ban)
+
+def grid_legal_mask(geometry,occupied,bm_state,c,r,center_ban=True):
+    #Legal-move mask on boards too large for the table, same rules as _build_entry
+    open_cells = geometry.full_mask & ~occupied
+    banned = geometry.center_mask if center_ban else 0
+    count = occupied.bit_count()
+    if count % 2 == 0:
+        return open_cells & ~banned if count == 0 else open_cells
+    if count == 1:
+        return open_cells & ~banned
+    match bm_state:
+        case STATES.FIXED:
+            axis = (geometry.col_masks[c] | geometry.row_masks[r]) & open_cells
+        case STATES.COL:
+            axis = geometry.col_masks[c] & open_cells
+        case STATES.ROW:
+            axis = geometry.row_masks[r] & open_cells
+        case _:
+            axis = 0
+    #a filled lock releases BM
+    return axis or open_cells
+
+def verify_table(table=None,center_ban=True):
+    #Cross-check every reachable table entry against the scalar rules
+    table = get_table() if table is None else table
+    for occupied in range(FULL_MASK+1):
+        for bm_state in STATES:
+            for c in (None,0,1,2):
+                for r in (None,0,1,2):
+                    if bm_state != STATES.FREE and POPCOUNT[occupied] > 1 and (c is None or r is None):
+                        continue
+                    entry = table[table_index(occupied,bm_state,c,r)]
+                    for i in range(9):
+                        expected = scalar_transition(occupied,bm_state,c,r,CELL_X[i],CELL_Y[i],center_ban)
+                        if expected is None:
+                            assert not entry >> i & 1, (occupied,bm_state,c,r,i)
+                        else:
+                            assert entry >> i & 1 and next_state(entry,i) == expected, (occupied,bm_state,c,r,i)
+                    assert legal_mask(entry) == grid_legal_mask(core.geometry(),occupied,bm_state,c,r,center_ban), (occupied,bm_state,c,r)
+    return True
+
+if __name__ == "__main__":
+    verify_table()
+    verify_table(build_table(center_ban=False),center_ban=False)
+    print("Rule tables OK")
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, Counter
+
+#Registry of running games
+#Each game gets an asyncio.Lock so clicks are handled one at a time across on_update's awaits,
+#running games are capped per guild and per user, and games idle for longer than the TTL are evicted
+
+class SessionLimitError(Exception):
+    pass
+
+class GameSession():
+    __slots__ = ("key","guild_id","user_ids","game","lock","last_active")
+
+    def __init__(self,key,guild_id,user_ids,game):
+        self.key = key
+        self.guild_id = guild_id
+        self.user_ids = user_ids
+        self.game = game
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+class SessionManager():
+    def __init__(self,max_per_guild=100,max_per_user=3,idle_ttl=600.0,sweep_interval=30.0):
+        self.max_per_guild = max_per_guild
+        self.max_per_user = max_per_user
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+
+        #key -> session, oldest activity first
+        self.sessions = OrderedDict()
+        self.guild_counts = Counter()
+        self.user_counts = Counter()
+
+        self.sweeper = None
+
+    @staticmethod
+    def make_key(channel_id,boardmaster_id,challenger_id):
+        return (channel_id,boardmaster_id,challenger_id)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self,key):
+        return self.sessions.get(key)
+
+    def open(self,key,guild_id,user_ids,game,enforce_limits=True):
+        #Register a new game or raise SessionLimitError with a reason to show the user
+        #enforce_limits=False is for games resumed from the store, which were admitted before
+        if key in self.sessions:
+            raise SessionLimitError("You already have a game running against this player here")
+        if enforce_limits:
+            if self.guild_counts[guild_id] >= self.max_per_guild:
+                raise SessionLimitError(f"This server already has {self.max_per_guild} games running")
+            for user_id in user_ids:
+                if self.user_counts[user_id] >= self.max_per_user:
+                    raise SessionLimitError(f"<@{user_id}> is already in {self.max_per_user} games")
+
+        session = GameSession(key,guild_id,tuple(user_ids),game)
+        self.sessions[key] = session
+        self.guild_counts[guild_id] += 1
+        for user_id in session.user_ids:
+            self.user_counts[user_id] += 1
+        game.session = session
+        return session
+
+    def touch(self,session):
+        session.last_active = time.monotonic()
+        if session.key in self.sessions:
+            self.sessions.move_to_end(session.key)
+
+    def close(self,session):
+        if self.sessions.pop(session.key,None) is None:
+            return
+        self.guild_counts[session.guild_id] -= 1
+        if not self.guild_counts[session.guild_id]:
+            del self.guild_counts[session.guild_id]
+        for user_id in session.user_ids:
+            self.user_counts[user_id] -= 1
+            if not self.user_counts[user_id]:
+                del self.user_counts[user_id]
+
+    def expired(self,now=None):
+        #Sessions are kept in activity order, so stop at the first one still alive
+        now = time.monotonic() if now is None else now
+        stale = []
+        for session in self.sessions.values():
+            if now-session.last_active < self.idle_ttl:
+                break
+            stale.append(session)
+        return stale
+
+    async def evict_idle(self):
+        #Games are ended and unregistered under their locks, on_expire returns what is left to
+        #await, the closing edits, and those go out for all games at once with no lock held
+        evicted = 0
+        flushes = []
+        for session in self.expired():
+            #A click in progress counts as activity
+            if session.lock.locked():
+                self.touch(session)
+                continue
+            async with session.lock:
+                self.close(session)
+                try:
+                    flushes.append(session.game.on_expire())
+                except Exception:
+                    logging.exception("Failed to close expired game")
+            evicted += 1
+        for result in await asyncio.gather(*flushes,return_exceptions=True):
+            if isinstance(result,Exception):
+                logging.error("Failed to send the edits of an expired game",exc_info=result)
+        if evicted:
+            logging.info(f"Evicted {evicted} idle games, {len(self.sessions)} running")
+        return evicted
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.evict_idle()
+
+    def start(self):
+        if self.sweeper is None or self.sweeper.done():
+            self.sweeper = asyncio.create_task(self._sweep())
+
+    def stop(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            self.sweeper = None
@@ -0,0 +1,174 @@
+import hashlib
+import os
+
+#Ed25519 signatures of HTTP interactions
+#Discord signs every interaction it POSTs with the application's key: the signature in
+#X-Signature-Ed25519 covers the X-Signature-Timestamp header followed by the raw body
+#PyNaCl verifies in a few microseconds and is required to serve interactions. The RFC 8032
+#arithmetic below signs for the local test client and verifies, about a millisecond and a half
+#per request, only where a self test asks for it explicitly
+
+try:
+    from nacl.signing import VerifyKey as NaclVerifyKey
+    from nacl.exceptions import BadSignatureError
+except ImportError:
+    NaclVerifyKey = None
+
+#------------------------------
+#RFC 8032 section 6, points in extended coordinates (X, Y, Z, T)
+
+P = 2**255-19
+Q = 2**252+27742317777372353535851937790883648493
+D = -121665*pow(121666,P-2,P) % P
+SQRT_M1 = pow(2,(P-1)//4,P)
+
+def _sha512_modq(data):
+    return int.from_bytes(hashlib.sha512(data).digest(),"little") % Q
+
+def _add(a,b):
+    x = (a[1]-a[0])*(b[1]-b[0]) % P
+    y = (a[1]+a[0])*(b[1]+b[0]) % P
+    c = 2*a[3]*b[3]*D % P
+    d = 2*a[2]*b[2] % P
+    e, f, g, h = y-x, d-c, d+c, y+x
+    return (e*f,g*h,f*g,e*h)
+
+def _equal(a,b):
+    return (a[0]*b[2]-b[0]*a[2]) % P == 0 and (a[1]*b[2]-b[1]*a[2]) % P == 0
+
+def _recover_x(y,sign):
+    if y >= P:
+        return None
+    x2 = (y*y-1)*pow(D*y*y+1,P-2,P)
+    if x2 == 0:
+        return None if sign else 0
+    x = pow(x2,(P+3)//8,P)
+    if (x*x-x2) % P:
+        x = x*SQRT_M1 % P
+    if (x*x-x2) % P:
+        return None
+    if x & 1 != sign:
+        x = P-x
+    return x
+
+def _compress(point):
+    zinv = pow(point[2],P-2,P)
+    x, y = point[0]*zinv % P, point[1]*zinv % P
+    return (y | (x & 1) << 255).to_bytes(32,"little")
+
+def _decompress(data):
+    if len(data) != 32:
+        return None
+    y = int.from_bytes(data,"little")
+    sign = y >> 255
+    y &= (1 << 255)-1
+    x = _recover_x(y,sign)
+    if x is None:
+        return None
+    return (x,y,1,x*y % P)
+
+_GY = 4*pow(5,P-2,P) % P
+_GX = _recover_x(_GY,0)
+G = (_GX,_GY,1,_GX*_GY % P)
+
+class _FixedBase():
+    #Multiples of one point in 4 bit windows, table[i][j] = j * 16^i * point
+    #A scalar below 2^256 then costs at most 64 additions and no doublings. The base point is
+    #in every signature and verification, and an endpoint verifies against one public key
+    def __init__(self,point):
+        self.table = []
+        for _ in range(64):
+            row = [(0,1,1,0),point]
+            for _ in range(14):
+                row.append(_add(row[-1],point))
+            self.table.append(row)
+            point = _add(row[-1],point)
+
+    def mul(self,scalar):
+        result = (0,1,1,0)
+        for row in self.table:
+            if not scalar:
+                break
+            if scalar & 15:
+                result = _add(result,row[scalar & 15])
+            scalar >>= 4
+        return result
+
+_G_TABLE = _FixedBase(G)
+
+def _mul_base(scalar):
+    return _G_TABLE.mul(scalar)
+
+def _expand(seed):
+    digest = hashlib.sha512(seed).digest()
+    a = int.from_bytes(digest[:32],"little")
+    a &= (1 << 254)-8
+    a |= 1 << 254
+    return a, digest[32:]
+
+#------------------------------
+
+class SigningKey():
+    #Test signer standing in for Discord, from a 32 byte seed
+    def __init__(self,seed=None):
+        self.seed = os.urandom(32) if seed is None else bytes(seed)
+        self.scalar, self.prefix = _expand(self.seed)
+        self.public_key = _compress(_mul_base(self.scalar))
+
+    def sign(self,message):
+        r = _sha512_modq(self.prefix+message)
+        encoded_r = _compress(_mul_base(r))
+        h = _sha512_modq(encoded_r+self.public_key+message)
+        return encoded_r+((r+h*self.scalar) % Q).to_bytes(32,"little")
+
+class PureVerifyKey():
+    def __init__(self,public_key):
+        self.public_key = bytes(public_key)
+        point = _decompress(self.public_key)
+        if point is None:
+            raise ValueError("Not an Ed25519 public key")
+        self.multiples = _FixedBase(point)
+
+    def verify(self,message,signature):
+        if len(signature) != 64:
+            return False
+        r = _decompress(signature[:32])
+        s = int.from_bytes(signature[32:],"little")
+        if r is None or s >= Q:
+            return False
+        h = _sha512_modq(signature[:32]+self.public_key+message)
+        return _equal(_mul_base(s),_add(r,self.multiples.mul(h)))
+
+class NaclKey():
+    def __init__(self,public_key):
+        self.key = NaclVerifyKey(bytes(public_key))
+
+    def verify(self,message,signature):
+        try:
+            self.key.verify(message,signature)
+        except (BadSignatureError, ValueError):
+            return False
+        return True
+
+def verify_key(public_key,allow_pure=False):
+    #Verifier for a hex or raw public key, PyNaCl's. Without PyNaCl it raises RuntimeError
+    #unless allow_pure lets a self test fall back to PureVerifyKey
+    if isinstance(public_key,str):
+        public_key = bytes.fromhex(public_key)
+    if NaclVerifyKey is not None:
+        return NaclKey(public_key)
+    if not allow_pure:
+        raise RuntimeError("PyNaCl is required to verify interactions, install it with pip install pynacl")
+    return PureVerifyKey(public_key)
+
+def verify_request(key,timestamp,body,signature_hex):
+    #True if signature_hex signs timestamp + body, a malformed header is a bad signature
+    try:
+        signature = bytes.fromhex(signature_hex)
+    except (TypeError, ValueError):
+        return False
+    return key.verify(timestamp.encode()+body,signature)
+
+def sign_request(signing_key,timestamp,body):
+    #X-Signature-Ed25519 and X-Signature-Timestamp headers for body, as Discord sends them
+    return {"X-Signature-Ed25519": signing_key.sign(timestamp.encode()+body).hex(),"X-Signature-Timestamp": timestamp}
@@ -0,0 +1,204 @@
+import argparse
+import time
+import numpy as np
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+from finfacfoe_core import X, O, TIE, CONTINUE, FULL_MASK, CENTER_MASK, LINE_MASKS
+
+#Vectorized batch simulator for rule-balance analysis
+#N games are kept as parallel NumPy arrays and advanced one ply per step
+#
+#hidden=True plays the real rule: the challenger cannot see O's pieces, and clicking one
+#reveals it and costs nothing but the click. hidden=False lets the challenger see the whole board
+#center_ban toggles the first-move center rule from check_rule
+
+BITS = np.array([1 << i for i in range(9)],dtype=np.uint16)
+POPCOUNT = np.array(rules.POPCOUNT,dtype=np.int64)
+WINNING = np.array(core.WINNING,dtype=bool)
+
+#SET_BITS[mask,k] is the index of the k-th set bit of mask
+SET_BITS = np.zeros((FULL_MASK+1,9),dtype=np.int64)
+for _mask in range(FULL_MASK+1):
+    _cells = [i for i in range(9) if _mask >> i & 1]
+    SET_BITS[_mask,:len(_cells)] = _cells
+
+#WIN_CELLS[mask] are the cells that complete a line for a player holding mask
+WIN_CELLS = np.zeros(FULL_MASK+1,dtype=np.uint16)
+for _mask in range(FULL_MASK+1):
+    for _line in LINE_MASKS:
+        _missing = _line & ~_mask
+        if rules.POPCOUNT[_missing] == 1:
+            WIN_CELLS[_mask] |= _missing
+
+_TABLES = {}
+
+def rule_table(center_ban=True):
+    if center_ban not in _TABLES:
+        table = rules.TABLE if center_ban else rules.build_table(center_ban=False)
+        _TABLES[center_ban] = np.frombuffer(table,dtype=np.uint64)
+    return _TABLES[center_ban]
+
+#------------------------------
+#Policies: (candidates, own, opponent as seen by the player, rng) -> cell index per game
+
+def pick_random(candidates,rng):
+    counts = POPCOUNT[candidates]
+    k = (rng.random(len(candidates))*counts).astype(np.int64)
+    return SET_BITS[candidates,np.minimum(k,8)]
+
+def random_policy(candidates,own,opponent,rng):
+    return pick_random(candidates,rng)
+
+def greedy_policy(candidates,own,opponent,rng):
+    #win if possible, else block a visible threat, else random
+    wins = candidates & WIN_CELLS[own]
+    blocks = candidates & WIN_CELLS[opponent]
+    choice = np.where(wins != 0,wins,np.where(blocks != 0,blocks,candidates))
+    return pick_random(choice,rng)
+
+POLICIES = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+}
+
+#------------------------------
+
+def simulate_batch(n,x_policy=random_policy,o_policy=random_policy,hidden=True,center_ban=True,rng=None,record=False):
+    rng = np.random.default_rng() if rng is None else rng
+    table = rule_table(center_ban)
+    banned = np.uint16(CENTER_MASK if center_ban else 0)
+
+    x = np.zeros(n,dtype=np.uint16)
+    o = np.zeros(n,dtype=np.uint16)
+    known = np.zeros(n,dtype=np.uint16) #O pieces revealed to X
+    state = np.full(n,rules.pack_state(rules.FREE,rules.NO_LOCK,rules.NO_LOCK),dtype=np.uint64)
+    result = np.full(n,CONTINUE,dtype=np.int8)
+    probes = np.zeros(n,dtype=np.int32)
+    moves = np.full((n,9),-1,dtype=np.int8) if record else None
+
+    for ply in range(9):
+        active = np.flatnonzero(result == CONTINUE)
+        if len(active) == 0:
+            break
+        xa, oa = x[active], o[active]
+        occupied = xa | oa
+        entry = table[(occupied.astype(np.uint64) << np.uint64(6)) | state[active]]
+        legal = (entry & np.uint64(FULL_MASK)).astype(np.uint16)
+
+        if ply % 2 == 0:
+            #Challenger turn
+            if hidden:
+                cell = np.empty(len(active),dtype=np.int64)
+                pending = np.arange(len(active))
+                while len(pending):
+                    seen = xa[pending] | known[active[pending]]
+                    candidates = np.uint16(FULL_MASK) & ~seen
+                    if ply == 0:
+                        candidates &= ~banned
+                    chosen = x_policy(candidates,xa[pending],known[active[pending]],rng)
+                    hit = (oa[pending] & BITS[chosen]) != 0
+                    #Occupied spot, X learns it and tries again
+                    known[active[pending[hit]]] |= BITS[chosen[hit]]
+                    probes[active[pending[hit]]] += 1
+                    cell[pending[~hit]] = chosen[~hit]
+                    pending = pending[hit]
+            else:
+                cell = x_policy(legal,xa,oa,rng)
+            xa |= BITS[cell]
+            x[active] = xa
+            won = WINNING[xa]
+            winner = X
+        else:
+            #Boardmaster turn, the table also gives the next lock state
+            cell = o_policy(legal,oa,xa,rng)
+            oa |= BITS[cell]
+            o[active] = oa
+            state[active] = (entry >> (np.uint64(9) + np.uint64(6)*cell.astype(np.uint64))) & np.uint64(0x3F)
+            won = WINNING[oa]
+            winner = O
+
+        if record:
+            moves[active,ply] = cell
+        result[active[won]] = winner
+        if ply == 8:
+            result[active[~won]] = TIE
+
+    lengths = POPCOUNT[x | o]
+    return {"result": result, "length": lengths, "probes": probes, "moves": moves}
+
+def summarize(results,elapsed=None):
+    result = np.concatenate([r["result"] for r in results])
+    lengths = np.concatenate([r["length"] for r in results])
+    probes = np.concatenate([r["probes"] for r in results])
+    games = len(result)
+    summary = {
+        "games": games,
+        "x_rate": float(np.count_nonzero(result == X)/games),
+        "o_rate": float(np.count_nonzero(result == O)/games),
+        "tie_rate": float(np.count_nonzero(result == TIE)/games),
+        "mean_length": float(lengths.mean()),
+        "length_histogram": {int(k): int(v) for k, v in zip(*np.unique(lengths,return_counts=True))},
+        "mean_probes": float(probes.mean()),
+    }
+    if elapsed is not None:
+        summary["seconds"] = elapsed
+        summary["games_per_second"] = games/elapsed if elapsed else float("inf")
+    return summary
+
+def simulate(games,x_policy="random",o_policy="random",hidden=True,center_ban=True,seed=None,chunk=1_000_000):
+    rng = np.random.default_rng(seed)
+    results = []
+    start = time.perf_counter()
+    remaining = games
+    while remaining > 0:
+        n = min(chunk,remaining)
+        results.append(simulate_batch(n,POLICIES[x_policy],POLICIES[o_policy],hidden,center_ban,rng))
+        remaining -= n
+    return summarize(results,time.perf_counter()-start)
+
+#------------------------------
+
+def cross_check(games=10_000,x_policy="random",o_policy="random",hidden=True,center_ban=True,seed=None):
+    #Replay recorded games through the scalar rules and compare every move and result
+    rng = np.random.default_rng(seed)
+    batch = simulate_batch(games,POLICIES[x_policy],POLICIES[o_policy],hidden,center_ban,rng,record=True)
+    for g in range(games):
+        board = core.BitBoard()
+        bm_state, c, r = core.STATES.FREE, None, None
+        player = X
+        outcome = CONTINUE
+        for cell in batch["moves"][g]:
+            if cell < 0:
+                break
+            x, y = core.index_to_cell(int(cell))
+            transition = rules.scalar_transition(board.occupied,bm_state,c,r,x,y,center_ban)
+            assert transition is not None, f"game {g}: illegal move {(x,y)}"
+            bm_state, c, r = transition
+            board.place(player,x,y)
+            player = O if player == X else X
+            outcome = board.winner()
+            if outcome != CONTINUE:
+                break
+        assert outcome == batch["result"][g], f"game {g}: scalar result {outcome}, batch result {batch['result'][g]}"
+        assert board.occupied.bit_count() == batch["length"][g], f"game {g}: length mismatch"
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch FinFacFoe rule-balance simulator")
+    parser.add_argument("games",type=int,nargs="?",default=1_000_000)
+    parser.add_argument("--x-policy",choices=POLICIES,default="random")
+    parser.add_argument("--o-policy",choices=POLICIES,default="random")
+    parser.add_argument("--visible",action="store_true",help="let the challenger see O's pieces")
+    parser.add_argument("--no-center-ban",action="store_true",help="drop the first-move center rule")
+    parser.add_argument("--seed",type=int)
+    parser.add_argument("--chunk",type=int,default=1_000_000)
+    parser.add_argument("--check",type=int,default=10_000,help="games to cross-check against the scalar rules first")
+    args = parser.parse_args()
+
+    options = dict(x_policy=args.x_policy,o_policy=args.o_policy,hidden=not args.visible,center_ban=not args.no_center_ban,seed=args.seed)
+    if args.check:
+        cross_check(args.check,**options)
+        print(f"Cross-checked {args.check} games against the scalar rules")
+    summary = simulate(args.games,chunk=args.chunk,**options)
+    for key, value in summary.items():
+        print(f"{key}: {value}")
@@ -0,0 +1,219 @@
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import struct
+import sys
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+from finfacfoe_core import X, O, STATES, FULL_MASK, WINNING
+
+#Perfect-play FinFacFoe solver
+#Memoized negamax over (board, bm_state, c/r lock), the player to move follows from the piece count
+#Positions equal under the 8 board symmetries share one transposition table entry
+#
+#Values are from the view of the player to move: 10-count for a win, 0 for a tie, negative for a loss
+#so quicker wins and slower losses are preferred
+
+NO_MOVE = 255
+MAGIC = b"FFFT"
+HEADER = struct.Struct("<4sII")
+VERSION = 1
+
+FREE, FIXED, COL, ROW = rules.FREE, rules.FIXED, rules.COL, rules.ROW
+NO_LOCK = rules.NO_LOCK
+
+#Cell permutations for the 8 symmetries, PERMS[t][i] is where cell i goes
+def _transforms():
+    maps = []
+    for transpose in (False,True):
+        for flip_x in (False,True):
+            for flip_y in (False,True):
+                maps.append((transpose,flip_x,flip_y))
+    return maps
+
+def _apply(transform,x,y):
+    transpose, flip_x, flip_y = transform
+    if transpose:
+        x, y = y, x
+    if flip_x:
+        x = 2-x
+    if flip_y:
+        y = 2-y
+    return x, y
+
+TRANSFORMS = _transforms()
+PERMS = tuple(tuple(core.cell_index(*_apply(t,*core.index_to_cell(i))) for i in range(9)) for t in TRANSFORMS)
+INVERSE_PERMS = tuple(tuple(perm.index(i) for i in range(9)) for perm in PERMS)
+MASK_PERMS = tuple(
+    tuple(sum(1 << perm[i] for i in range(9) if mask >> i & 1) for mask in range(FULL_MASK+1))
+    for perm in PERMS
+)
+TERNARY = tuple(sum(3**i for i in range(9) if mask >> i & 1) for mask in range(FULL_MASK+1))
+
+def normalize_lock(state,c,r):
+    #Drop lock coordinates the rules never read again
+    if state == FREE:
+        return state, NO_LOCK, NO_LOCK
+    if state == COL:
+        return state, c, NO_LOCK
+    if state == ROW:
+        return state, NO_LOCK, r
+    return state, c, r
+
+def _transform_lock(t,state,c,r):
+    transform = TRANSFORMS[t]
+    if state == FIXED:
+        c, r = _apply(transform,c,r)
+    elif state == COL:
+        x, y = _apply(transform,c,0)
+        if transform[0]:
+            state, c, r = ROW, NO_LOCK, y
+        else:
+            c = x
+    elif state == ROW:
+        x, y = _apply(transform,0,r)
+        if transform[0]:
+            state, c, r = COL, x, NO_LOCK
+        else:
+            r = y
+    return state, c, r
+
+def encode(x_mask,o_mask,state,c,r):
+    return ((TERNARY[x_mask] + 2*TERNARY[o_mask]) << 6) | (state << 4) | (c << 2) | r
+
+def canonical(x_mask,o_mask,state,c,r):
+    #returns (key, transform index) of the smallest symmetric encoding
+    state, c, r = normalize_lock(state,c,r)
+    best_key = None
+    best_t = 0
+    for t in range(8):
+        t_state, t_c, t_r = _transform_lock(t,state,c,r)
+        key = encode(MASK_PERMS[t][x_mask],MASK_PERMS[t][o_mask],t_state,t_c,t_r)
+        if best_key is None or key < best_key:
+            best_key = key
+            best_t = t
+    return best_key, best_t
+
+#------------------------------
+
+class Solver():
+    def __init__(self):
+        #canonical key -> (value, best move in the canonical frame)
+        self.table = {}
+
+    def solve(self,x_mask=0,o_mask=0,state=FREE,c=NO_LOCK,r=NO_LOCK):
+        key, t = canonical(x_mask,o_mask,state,c,r)
+        if key in self.table:
+            return self.table[key][0]
+
+        occupied = x_mask | o_mask
+        count = rules.POPCOUNT[occupied]
+        entry = rules.TABLE[(occupied << 6) | (state << 4) | (c << 2) | r]
+        legal = entry & FULL_MASK
+        x_turn = count % 2 == 0
+
+        best_value = None
+        best_move = NO_MOVE
+        for i in range(9):
+            if not legal >> i & 1:
+                continue
+            bit = 1 << i
+            if x_turn:
+                new_x, new_o = x_mask | bit, o_mask
+                won = WINNING[new_x]
+            else:
+                new_x, new_o = x_mask, o_mask | bit
+                won = WINNING[new_o]
+
+            if won:
+                value = 10-(count+1)
+            elif count+1 == 9:
+                value = 0
+            else:
+                packed = entry >> (9 + 6*i) & 0x3F
+                value = -self.solve(new_x,new_o,packed >> 4,packed >> 2 & 3,packed & 3)
+
+            if best_value is None or value > best_value:
+                best_value = value
+                best_move = i
+
+        #No legal move can only happen on a full board
+        if best_value is None:
+            best_value = 0
+        self.table[key] = (best_value, NO_MOVE if best_move == NO_MOVE else PERMS[t][best_move])
+        return best_value
+
+def write_table(path,table):
+    keys = sorted(table)
+    key_array = array("I",keys)
+    value_array = array("b",(table[key][0] for key in keys))
+    move_array = array("B",(table[key][1] for key in keys))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path,"wb") as f:
+        f.write(HEADER.pack(MAGIC,VERSION,len(keys)))
+        f.write(key_array.tobytes())
+        f.write(value_array.tobytes())
+        f.write(move_array.tobytes())
+    os.replace(tmp_path,path)
+
+class SolvedTable():
+    #Memory-mapped solved table, lookups are a binary search over sorted canonical keys
+    def __init__(self,path):
+        self._file = open(path,"rb")
+        self._map = mmap.mmap(self._file.fileno(),0,access=mmap.ACCESS_READ)
+        magic, version, n = HEADER.unpack_from(self._map,0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a FinFacFoe solved table")
+        view = memoryview(self._map)
+        offset = HEADER.size
+        self.keys = view[offset:offset+4*n].cast("I")
+        offset += 4*n
+        self.values = view[offset:offset+n].cast("b")
+        offset += n
+        self.moves = view[offset:offset+n]
+        self.size = n
+
+    def close(self):
+        self.keys.release()
+        self.values.release()
+        self.moves.release()
+        self._map.close()
+        self._file.close()
+
+    def lookup(self,x_mask,o_mask,bm_state,c,r):
+        #returns (value for the player to move, best (x,y) or None)
+        state = bm_state.value-1
+        c = NO_LOCK if c is None else c
+        r = NO_LOCK if r is None else r
+        key, t = canonical(x_mask,o_mask,state,c,r)
+        i = bisect_left(self.keys,key)
+        if i == self.size or self.keys[i] != key:
+            raise KeyError(f"Unreachable position {key}")
+        move = self.moves[i]
+        if move == NO_MOVE:
+            return self.values[i], None
+        return self.values[i], core.index_to_cell(INVERSE_PERMS[t][move])
+
+    def lookup_game(self,game):
+        return self.lookup(game.core.x_mask,game.core.o_mask,game.bm_state,game.c,game.r)
+
+def solve_to_file(path):
+    solver = Solver()
+    solver.solve()
+    write_table(path,solver.table)
+    return solver
+
+def open_table(path):
+    #SolvedTable of path, solved and written first when the file is missing or from another version
+    try:
+        return SolvedTable(path)
+    except (FileNotFoundError,ValueError):
+        solve_to_file(path)
+        return SolvedTable(path)
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "finfacfoe_solved.bin"
+    solver = solve_to_file(path)
+    print(f"Solved {len(solver.table)} positions, value for X from the start: {solver.table[canonical(0,0,FREE,NO_LOCK,NO_LOCK)[0]][0]}")
+    print(f"Table written to {path}")
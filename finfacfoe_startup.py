@@ -0,0 +1,68 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+#Startup helpers: command tree fingerprints so unchanged trees are not re-synced on every
+#restart, and a phase timer for the time-to-ready report
+#
+#Sync state file format:
+#{"<application id>:global": "<sha256>", "<application id>:<guild id>": "<sha256>"}
+
+def tree_fingerprint(tree,guild=None):
+    #Hash of the payload tree.sync would upload for this scope
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),key=lambda c: (c.get("type",1),c["name"]))
+    return hashlib.sha256(json.dumps(payload,sort_keys=True,default=str).encode()).hexdigest()
+
+class SyncState():
+    def __init__(self,path="finfacfoe_sync.json"):
+        self.path = path
+        self.fingerprints = {}
+        try:
+            with open(path) as f:
+                self.fingerprints = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError,ValueError) as e:
+            logging.warning(f"Ignoring unreadable command sync state {path}: {e}")
+
+    @staticmethod
+    def scope(application_id,guild=None):
+        return f"{application_id}:{'global' if guild is None else guild.id}"
+
+    def is_current(self,scope,fingerprint):
+        return self.fingerprints.get(scope) == fingerprint
+
+    def record(self,scope,fingerprint):
+        self.fingerprints[scope] = fingerprint
+        #write then rename so a crash never leaves half a file
+        tmp = f"{self.path}.tmp"
+        with open(tmp,"w") as f:
+            json.dump(self.fingerprints,f,indent=1,sort_keys=True)
+        os.replace(tmp,self.path)
+
+class StartupTimer():
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        #phase -> seconds, in the order the phases finished
+        self.phases = {}
+        self.notes = {}
+        self.reported = False
+
+    def mark(self,phase,note=None):
+        #End the current phase, it ran from the previous mark until now
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase,0.0)+now-self.last
+        self.last = now
+        if note is not None:
+            self.notes[phase] = note
+
+    @property
+    def total(self):
+        return self.last-self.started
+
+    def report(self):
+        parts = [f"{phase} {seconds:.3f}s" + (f" ({self.notes[phase]})" if phase in self.notes else "") for phase, seconds in self.phases.items()]
+        return f"Startup took {self.total:.3f}s: " + ", ".join(parts)
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import finfacfoe_core as core
+import finfacfoe_rules as rules
+
+#SQLite store for in-flight games
+#Games are marked dirty on the event loop and written in batches by a single writer thread,
+#so a click never waits on disk. On startup every stored row is read in one query and kept
+#dormant until a click on one of its messages brings the game back
+#Boards larger than 5x5 are sent as several tile messages, tile_msg_ids holds the ids of the
+#tiles after the first as JSON: [[public ids], [private ids]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    challenger_id INTEGER NOT NULL,
+    boardmaster_id INTEGER NOT NULL,
+    board INTEGER NOT NULL,
+    revealed INTEGER NOT NULL,
+    public_msg_id INTEGER,
+    private_msg_id INTEGER,
+    application_id INTEGER,
+    token TEXT,
+    updated REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 3,
+    win_length INTEGER NOT NULL DEFAULT 3,
+    tile_msg_ids TEXT,
+    moves BLOB
+)
+"""
+
+#columns added after the first schema, ALTERed into older databases on connect
+ADDED_COLUMNS = (
+    ("size","INTEGER NOT NULL DEFAULT 3"),
+    ("win_length","INTEGER NOT NULL DEFAULT 3"),
+    ("tile_msg_ids","TEXT"),
+    ("moves","BLOB"),
+)
+
+COLUMNS = ("game_id","guild_id","channel_id","challenger_id","boardmaster_id","board","revealed",
+    "public_msg_id","private_msg_id","application_id","token","updated","size","win_length","tile_msg_ids","moves")
+
+UPSERT = f"INSERT OR REPLACE INTO games ({','.join(COLUMNS)}) VALUES ({','.join('?'*len(COLUMNS))})"
+DELETE = "DELETE FROM games WHERE game_id = ?"
+
+#Compact board encoding, one integer per 3x3 game
+#bits 0-8 X mask, 9-17 O mask, 18-23 packed lock state (see finfacfoe_rules), 24-27 piece count
+#Larger boards do not fit an SQLite integer and are stored as a little-endian BLOB of
+#X mask | O mask << n | state index << 2n | column << 2n+2 | row << 2n+6 | piece count << 2n+10
+#with n cells, and 15 for no lock
+
+GRID_NO_LOCK = 15
+
+def encode_board(state):
+    if not state.is_classic:
+        return _encode_grid(state)
+    packed = rules.encode_state(state.bm_state,state.c,state.r)
+    return state.core.x_mask | (state.core.o_mask << 9) | (packed << 18) | (state.count << 24)
+
+def _encode_grid(state):
+    n = state.geometry.cells
+    c = GRID_NO_LOCK if state.c is None else state.c
+    r = GRID_NO_LOCK if state.r is None else state.r
+    packed = (state.bm_state.value-1) | c << 2 | r << 6 | state.count << 10
+    value = state.core.x_mask | state.core.o_mask << n | packed << 2*n
+    return value.to_bytes((value.bit_length()+7)//8 or 1,"little")
+
+def decode_board(board,state):
+    #Restores board, lock and turn into a FinFacFoeState of the stored size
+    if isinstance(board,bytes):
+        return _decode_grid(board,state)
+    state.core.x_mask = board & 0x1FF
+    state.core.o_mask = board >> 9 & 0x1FF
+    state.bm_state, state.c, state.r = rules.decode_state(board >> 18 & 0x3F)
+    state.count = board >> 24 & 0xF
+    state.current_player = state.X if state.count % 2 == 0 else state.O
+    state.result = state.is_won()
+    return state
+
+def _decode_grid(board,state):
+    n = state.geometry.cells
+    value = int.from_bytes(board,"little")
+    cells = (1 << n)-1
+    #rebuilt through GridBoard so its line counters match the stored pieces
+    state.core = core.GridBoard(state.geometry,value & cells,value >> n & cells)
+    packed = value >> 2*n
+    state.bm_state = rules.STATE_LIST[packed & 3]
+    c, r = packed >> 2 & 0xF, packed >> 6 & 0xF
+    state.c = None if c == GRID_NO_LOCK else c
+    state.r = None if r == GRID_NO_LOCK else r
+    state.count = packed >> 10
+    state.current_player = state.X if state.count % 2 == 0 else state.O
+    state.result = state.is_won()
+    return state
+
+class GameStore():
+    def __init__(self,path="finfacfoe_games.db",flush_interval=0.5,batch_size=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        #game_id -> game to write, or None to delete
+        self.dirty = {}
+        #game_id -> row loaded at startup and not yet restored
+        self.dormant = {}
+        #board message id -> game_id of a dormant row, clicks find their game through this
+        self.dormant_messages = {}
+
+        #one thread owns the connection
+        self.executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix="finfacfoe-store")
+        self.conn = None
+        self.flusher = None
+        self.wakeup = None
+
+    def _run(self,func,*args):
+        return asyncio.get_running_loop().run_in_executor(self.executor,func,*args)
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path,check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(games)")}
+        for name, definition in ADDED_COLUMNS:
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE games ADD COLUMN {name} {definition}")
+        self.conn.commit()
+
+    def _load(self):
+        return self.conn.execute(f"SELECT {','.join(COLUMNS)} FROM games").fetchall()
+
+    def _write(self,upserts,deletes):
+        with self.conn:
+            if upserts:
+                self.conn.executemany(UPSERT,upserts)
+            if deletes:
+                self.conn.executemany(DELETE,deletes)
+
+    async def open(self):
+        #Connect and read every stored game, returns the number of dormant games
+        await self._run(self._connect)
+        start = time.perf_counter()
+        rows = await self._run(self._load)
+        self.dormant = {row[0]: row for row in rows}
+        self.dormant_messages = {message_id: row[0] for row in rows for message_id in self._message_ids(row) if message_id}
+        logging.info(f"Loaded {len(rows)} stored games in {time.perf_counter()-start:.3f}s")
+        self.wakeup = asyncio.Event()
+        self.flusher = asyncio.create_task(self._flush_loop())
+        return len(self.dormant)
+
+    def row_for(self,game):
+        return (
+            game.game_id,
+            game.guild_id,
+            game.channel_id,
+            game.challenger.id,
+            game.boardmaster.id,
+            encode_board(game),
+            game.revealed,
+            getattr(game.public_msg,"id",None),
+            getattr(game.private_msg,"id",None),
+            game.application_id,
+            game.token,
+            time.time(),
+            game.geometry.size,
+            game.geometry.win_length,
+            json.dumps([[msg.id for view, msg in tiles] for tiles in (game.public_tiles,game.private_tiles)]) if game.public_tiles else None,
+            bytes(game.moves),
+        )
+
+    def mark_dirty(self,game):
+        self.dirty[game.game_id] = game
+        if len(self.dirty) >= self.batch_size and self.wakeup is not None:
+            self.wakeup.set()
+
+    @staticmethod
+    def tile_message_ids(row):
+        #([public ids], [private ids]) of the tiles after the first
+        tiles = row[COLUMNS.index("tile_msg_ids")]
+        return tuple(json.loads(tiles)) if tiles else ([],[])
+
+    @classmethod
+    def _message_ids(cls,row):
+        public_tiles, private_tiles = cls.tile_message_ids(row)
+        return (row[COLUMNS.index("public_msg_id")],row[COLUMNS.index("private_msg_id")],*public_tiles,*private_tiles)
+
+    def take_dormant(self,message_id):
+        #Row of the dormant game a board message belongs to, removed from the dormant set
+        game_id = self.dormant_messages.get(message_id)
+        if game_id is None:
+            return None
+        row = self.dormant.pop(game_id)
+        for message_id in self._message_ids(row):
+            self.dormant_messages.pop(message_id,None)
+        return row
+
+    def forget(self,game_id):
+        row = self.dormant.pop(game_id,None)
+        if row is not None:
+            for message_id in self._message_ids(row):
+                self.dormant_messages.pop(message_id,None)
+        self.dirty[game_id] = None
+
+    def expire_dormant(self,older_than):
+        #Drop stored games that were never resumed and have been idle since before older_than
+        expired = [game_id for game_id, row in self.dormant.items() if row[COLUMNS.index("updated")] < older_than]
+        for game_id in expired:
+            self.forget(game_id)
+        return len(expired)
+
+    async def flush(self):
+        if not self.dirty or self.conn is None:
+            return
+        batch, self.dirty = self.dirty, {}
+        #Rows are built on the loop so the writer thread never reads live game objects
+        upserts = [self.row_for(game) for game in batch.values() if game is not None]
+        deletes = [(game_id,) for game_id, game in batch.items() if game is None]
+        try:
+            await self._run(self._write,upserts,deletes)
+        except sqlite3.Error:
+            logging.exception(f"Failed to write {len(batch)} games, retrying with the next flush")
+            #games marked or forgotten since the batch was taken are newer, they stay as they are
+            for game_id, game in batch.items():
+                self.dirty.setdefault(game_id,game)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(),self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self.conn = None
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,466 @@
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from finfacfoe_metrics import TOURNAMENT_GAMES, TOURNAMENT_QUEUE_WAIT
+
+#Tournaments: single elimination brackets and round robins, and the scheduler running their games
+#Discord-free, the bot hands the scheduler a coroutine that posts the boards of one game and
+#reports back through game_over when the game ends
+#
+#A pairing is played in legs with the roles swapped every leg, the boardmaster has the stronger
+#side so a match is only decided once both players had it. A leg won scores 1, a tie 0.5 each
+#Round robin pairings play two legs. Bracket matches are decided once an even number of legs
+#has been played with the scores apart, after MAX_LEGS legs the higher seed goes through
+#The scheduler never puts a player in two games at once and caps games per channel and overall
+
+MAX_LEGS = 6
+
+#winner of a drawn round robin pairing
+DRAW = 0
+
+class TournamentError(Exception):
+    pass
+
+class Match():
+    __slots__ = ("id","tournament","round","players","scores","legs","winner","channel_id","attempts","ready_at","next","slot")
+
+    def __init__(self,id,tournament,round,players):
+        self.id = id
+        self.tournament = tournament
+        self.round = round
+        #player ids, None until a bracket feeder match is decided
+        self.players = list(players)
+        self.scores = [0.0,0.0]
+        self.legs = 0
+        self.winner = None
+        #channel of the running leg, None while no leg is running
+        self.channel_id = None
+        #failed attempts to start the current leg
+        self.attempts = 0
+        #time.monotonic() when the next leg could first have started
+        self.ready_at = None
+        #bracket match the winner moves on to, and which of its slots
+        self.next = None
+        self.slot = 0
+
+    @property
+    def decided(self):
+        return self.winner is not None
+
+    @property
+    def running(self):
+        return self.channel_id is not None
+
+    def roles(self):
+        #(boardmaster, challenger) of the next leg, swapped every leg
+        a, b = self.players
+        return (a,b) if self.legs % 2 == 0 else (b,a)
+
+    def record_leg(self,winner_id):
+        #winner_id None is a tie
+        self.legs += 1
+        if winner_id is None:
+            self.scores[0] += 0.5
+            self.scores[1] += 0.5
+        else:
+            self.scores[self.players.index(winner_id)] += 1
+
+    def __repr__(self):
+        return f"Match(id={self.id}, round={self.round}, players={self.players}, scores={self.scores}, winner={self.winner})"
+
+def seed_order(size):
+    #Bracket positions of seeds 0..size-1, so the top seeds meet as late as possible
+    order = [0]
+    while len(order) < size:
+        count = len(order)*2
+        order = [seed for position in order for seed in (position,count-1-position)]
+    return order
+
+class Bracket():
+    kind = "bracket"
+
+    def __init__(self,tournament,players):
+        if len(players) < 2:
+            raise TournamentError("A bracket needs at least 2 players")
+        #seed = position in players
+        self.seeds = {player: seed for seed, player in enumerate(players)}
+        size = 1 << (len(players)-1).bit_length()
+        order = seed_order(size)
+        self.rounds = size.bit_length()-1
+        self.matches = []
+
+        previous = []
+        for round in range(1,self.rounds+1):
+            current = []
+            for i in range(size >> round):
+                if round == 1:
+                    pair = [players[seed] if seed < len(players) else None for seed in (order[2*i],order[2*i+1])]
+                else:
+                    pair = [None,None]
+                match = Match(len(self.matches),tournament,round,pair)
+                self.matches.append(match)
+                current.append(match)
+            for i, match in enumerate(previous):
+                match.next = current[i//2]
+                match.slot = i % 2
+            previous = current
+
+        #a top seed without an opponent goes straight through
+        for match in self.matches[:size//2]:
+            if None in match.players:
+                self._advance(match,next(player for player in match.players if player is not None))
+
+    def _advance(self,match,winner_id):
+        match.winner = winner_id
+        if match.next is not None:
+            match.next.players[match.slot] = winner_id
+            if None not in match.next.players:
+                match.next.ready_at = time.monotonic()
+
+    def ready(self,busy=frozenset()):
+        #matches are kept in round order
+        return (match for match in self.matches if not match.decided and None not in match.players and busy.isdisjoint(match.players))
+
+    def record(self,match,winner_id):
+        #Returns True when the leg decided the match
+        match.record_leg(winner_id)
+        a, b = match.players
+        if match.legs % 2 == 0 and match.scores[0] != match.scores[1]:
+            self._advance(match,a if match.scores[0] > match.scores[1] else b)
+        elif match.legs >= MAX_LEGS:
+            self._advance(match,min(match.players,key=self.seeds.get))
+        return match.decided
+
+    @property
+    def finished(self):
+        return self.matches[-1].decided
+
+    def standings(self):
+        #[(player, round reached)], champion first
+        reached = {player: 1 for player in self.seeds}
+        for match in self.matches:
+            for player in match.players:
+                if player is not None:
+                    reached[player] = max(reached[player],match.round)
+        if self.finished:
+            reached[self.matches[-1].winner] = self.rounds+1
+        return sorted(reached.items(),key=lambda item: (-item[1],self.seeds[item[0]]))
+
+class RoundRobin():
+    kind = "roundrobin"
+
+    def __init__(self,tournament,players):
+        if len(players) < 2:
+            raise TournamentError("A round robin needs at least 2 players")
+        self.players = list(players)
+        self.points = {player: 0.0 for player in players}
+        self.matches = []
+
+        #circle method, one player stays put and the rest rotate around it
+        circle = list(players) + ([None] if len(players) % 2 else [])
+        half = len(circle)//2
+        for round in range(1,len(circle)):
+            for i in range(half):
+                a, b = circle[i], circle[-1-i]
+                if a is not None and b is not None:
+                    self.matches.append(Match(len(self.matches),tournament,round,(a,b)))
+            circle = [circle[0],circle[-1],*circle[1:-1]]
+        #round -> undecided matches of the round, in round order. Pairings are released round by
+        #round: a round starts once every match of the rounds before it is decided, so only the
+        #lowest round's at most players/2 matches are looked at however many rounds are left
+        self.open = {}
+        for match in self.matches:
+            self.open.setdefault(match.round,{})[match.id] = match
+
+    def ready(self,busy=frozenset()):
+        #busy is read as matches are started from this generator
+        if not self.open:
+            return
+        for match in next(iter(self.open.values())).values():
+            if not match.running and busy.isdisjoint(match.players):
+                yield match
+
+    def record(self,match,winner_id):
+        match.record_leg(winner_id)
+        if match.legs >= 2:
+            a, b = match.players
+            match.winner = a if match.scores[0] > match.scores[1] else b if match.scores[1] > match.scores[0] else DRAW
+            self.points[a] += match.scores[0]
+            self.points[b] += match.scores[1]
+            round = self.open[match.round]
+            del round[match.id]
+            if not round:
+                #the round is over, the next one is released
+                del self.open[match.round]
+                now = time.monotonic()
+                for released in next(iter(self.open.values()),{}).values():
+                    released.ready_at = now
+        return match.decided
+
+    @property
+    def finished(self):
+        return not self.open
+
+    def standings(self):
+        #[(player, points)], best first, ties in join order
+        order = {player: i for i, player in enumerate(self.players)}
+        return sorted(self.points.items(),key=lambda item: (-item[1],order[item[0]]))
+
+FORMATS = {"bracket": Bracket,"roundrobin": RoundRobin}
+
+class Tournament():
+    def __init__(self,id,kind,channel_ids,guild_id=None,creator_id=None,size=3,win_length=3):
+        if kind not in FORMATS:
+            raise TournamentError(f"Unknown format {kind}")
+        self.id = id
+        self.kind = kind
+        self.channel_ids = list(channel_ids)
+        self.guild_id = guild_id
+        self.creator_id = creator_id
+        self.size = size
+        self.win_length = win_length
+        #signups in join order, which is the seeding
+        self.players = []
+        self.structure = None
+
+    @property
+    def started(self):
+        return self.structure is not None
+
+    @property
+    def finished(self):
+        return self.started and self.structure.finished
+
+    def join(self,player_id):
+        if self.started:
+            raise TournamentError("The tournament has already started")
+        if player_id in self.players:
+            raise TournamentError("You are already signed up")
+        self.players.append(player_id)
+
+    def leave(self,player_id):
+        if self.started:
+            raise TournamentError("The tournament has already started")
+        if player_id not in self.players:
+            raise TournamentError("You are not signed up")
+        self.players.remove(player_id)
+
+    def start(self):
+        if self.started:
+            raise TournamentError("The tournament has already started")
+        self.structure = FORMATS[self.kind](self,self.players)
+        now = time.monotonic()
+        for match in self.structure.ready():
+            match.ready_at = now
+
+    def ready_matches(self,busy=frozenset()):
+        #undecided matches with both players known, free and no leg running, earliest round first
+        return (match for match in self.structure.ready(busy) if not match.running)
+
+    def record(self,match,winner_id):
+        return self.structure.record(match,winner_id)
+
+    def standings(self):
+        return self.structure.standings()
+
+class TournamentScheduler():
+    def __init__(self,start_game,max_per_channel=5,max_active=50,announce=None,retry_delay=5.0,max_attempts=3):
+        #start_game(tournament, match, boardmaster_id, challenger_id, channel_id) posts one leg's boards
+        #announce(tournament, text), optional, called when matches and tournaments are decided
+        self.start_game = start_game
+        self.announce = announce
+        self.max_per_channel = max_per_channel
+        self.max_active = max_active
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+
+        self.tournaments = []
+        self.channel_load = Counter()
+        #players in a running leg
+        self.busy = set()
+        self.active = 0
+        self.started = 0
+        #running start_game and announce tasks
+        self.tasks = set()
+
+    def add(self,tournament):
+        self.tournaments.append(tournament)
+        self.pump()
+
+    def remove(self,tournament):
+        #Stop scheduling a tournament, running legs still report back and are ignored
+        if tournament in self.tournaments:
+            self.tournaments.remove(tournament)
+
+    def _spawn(self,coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def pump(self):
+        #Start every leg that fits under the limits, tournaments take turns in the order they were added
+        for tournament in list(self.tournaments):
+            for match in tournament.ready_matches(self.busy):
+                if self.active >= self.max_active:
+                    return
+                channel_id = min(tournament.channel_ids,key=self.channel_load.__getitem__)
+                if self.channel_load[channel_id] >= self.max_per_channel:
+                    break
+                self._start(tournament,match,channel_id)
+
+    def _start(self,tournament,match,channel_id):
+        match.channel_id = channel_id
+        self.channel_load[channel_id] += 1
+        self.active += 1
+        self.started += 1
+        self.busy.update(match.players)
+        TOURNAMENT_GAMES.inc()
+        TOURNAMENT_QUEUE_WAIT.observe(time.monotonic()-match.ready_at)
+        boardmaster_id, challenger_id = match.roles()
+        self._spawn(self._run(tournament,match,boardmaster_id,challenger_id,channel_id))
+
+    def _release(self,match):
+        self.channel_load[match.channel_id] -= 1
+        if not self.channel_load[match.channel_id]:
+            del self.channel_load[match.channel_id]
+        match.channel_id = None
+        self.active -= 1
+        self.busy.difference_update(match.players)
+
+    async def _run(self,tournament,match,boardmaster_id,challenger_id,channel_id):
+        try:
+            await self.start_game(tournament,match,boardmaster_id,challenger_id,channel_id)
+        except Exception:
+            match.attempts += 1
+            logging.exception(f"Tournament {tournament.id} match {match.id} failed to start, attempt {match.attempts}")
+            if match.attempts >= self.max_attempts:
+                #usually the boardmaster's DMs are closed, the leg goes to the challenger
+                self.game_over(match,challenger_id)
+                return
+            self._release(match)
+            asyncio.get_running_loop().call_later(self.retry_delay,self.pump)
+
+    def game_over(self,match,winner_id):
+        #A leg ended, winner_id None for a tie
+        tournament = match.tournament
+        self._release(match)
+        match.attempts = 0
+        if tournament not in self.tournaments:
+            return
+        if not tournament.record(match,winner_id):
+            match.ready_at = time.monotonic()
+        elif match.winner == DRAW:
+            self._announce(tournament,f"Round {match.round}: <@{match.players[0]}> and <@{match.players[1]}> draw {match.scores[0]:g}-{match.scores[1]:g}")
+        else:
+            self._announce(tournament,f"Round {match.round}: <@{match.winner}> wins {match.scores[0]:g}-{match.scores[1]:g}")
+        if tournament.finished:
+            self.remove(tournament)
+            winner = tournament.standings()[0][0]
+            self._announce(tournament,f"🏆 <@{winner}> wins the tournament")
+        self.pump()
+
+    def _announce(self,tournament,text):
+        if self.announce is not None:
+            self._spawn(self.announce(tournament,text))
+
+    async def wait(self):
+        #Until no game is running or starting, for benchmarks and shutdown
+        while self.tasks or self.active:
+            await asyncio.sleep(0.01)
+
+#------------------------------
+#Throughput against a fake Discord, boards are posted through the real SendPacer
+
+class FakeChannel():
+    def __init__(self,id,latency):
+        self.id = id
+        self.latency = latency
+        self.sent = 0
+
+    async def send(self,**kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        return self
+
+async def bench(players=64,kind="bracket",channels=4,max_per_channel=5,max_active=50,latency=0.02,think=0.01,time_scale=10.0,seed=0):
+    #Discord's 5 per 5 seconds per channel and 50 per second globally, time_scale times faster
+    from finfacfoe_edits import SendPacer, BucketRegistry, RateLimitBucket
+    from finfacfoe_engine import FinFacFoeState
+    pacer = SendPacer(BucketRegistry(5,5.0/time_scale),RateLimitBucket(50,1.0/time_scale))
+    rng = random.Random(seed)
+    fake_channels = {}
+    def channel(id):
+        if id not in fake_channels:
+            fake_channels[id] = FakeChannel(id,latency)
+        return fake_channels[id]
+
+    start_delays = []
+    peak = 0
+
+    async def play(match,boardmaster_id,challenger_id):
+        state = FinFacFoeState(tournament.size,tournament.win_length)
+        n = tournament.size
+        while state.result == state.CONTINUE:
+            await asyncio.sleep(think)
+            legal = state.legal_moves()
+            index = rng.choice([i for i in range(n*n) if legal >> i & 1])
+            state.play(state.current_player,index % n,index // n)
+        winner = {state.X: challenger_id,state.O: boardmaster_id}.get(state.result)
+        scheduler.game_over(match,winner)
+
+    async def start_game(tournament,match,boardmaster_id,challenger_id,channel_id):
+        nonlocal peak
+        peak = max(peak,scheduler.active)
+        await pacer.send(channel(channel_id),content="board")
+        #the private board goes to the boardmaster's DMs, a channel of its own
+        await pacer.send(channel(boardmaster_id),content="board")
+        start_delays.append(time.monotonic()-match.ready_at)
+        asyncio.create_task(play(match,boardmaster_id,challenger_id))
+
+    scheduler = TournamentScheduler(start_game,max_per_channel,max_active)
+    tournament = Tournament(1,kind,range(10**6,10**6+channels))
+    for player in range(1,players+1):
+        tournament.join(player)
+    tournament.start()
+
+    started = time.perf_counter()
+    scheduler.add(tournament)
+    while not tournament.finished:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter()-started
+    await scheduler.wait()
+
+    start_delays.sort()
+    return {
+        "players": players,
+        "format": kind,
+        "games": scheduler.started,
+        "seconds": elapsed,
+        "games_per_second": scheduler.started/elapsed,
+        "peak_active": peak,
+        "messages": sum(c.sent for c in fake_channels.values()),
+        "start_delay_p50_ms": 1000*start_delays[len(start_delays)//2],
+        "start_delay_p95_ms": 1000*start_delays[int(len(start_delays)*0.95)],
+        "champion": tournament.standings()[0][0],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tournament scheduler throughput against a fake Discord")
+    parser.add_argument("--players",type=int,default=64)
+    parser.add_argument("--format",choices=tuple(FORMATS),default="bracket")
+    parser.add_argument("--channels",type=int,default=4)
+    parser.add_argument("--max-per-channel",type=int,default=5)
+    parser.add_argument("--max-active",type=int,default=50)
+    parser.add_argument("--latency",type=float,default=0.02,help="seconds per fake message create")
+    parser.add_argument("--think",type=float,default=0.01,help="seconds per move")
+    parser.add_argument("--time-scale",type=float,default=10.0,help="rate limit windows run this much faster")
+    parser.add_argument("--seed",type=int,default=0)
+    args = parser.parse_args()
+    result = asyncio.run(bench(args.players,args.format,args.channels,args.max_per_channel,args.max_active,
+        args.latency,args.think,args.time_scale,args.seed))
+    for key, value in result.items():
+        print(f"{key}: {value:.3f}" if isinstance(value,float) else f"{key}: {value}")
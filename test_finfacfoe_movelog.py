@@ -0,0 +1,68 @@
+import asyncio
+import os
+from finfacfoe_core import X
+from finfacfoe_movelog import MoveLog, GameRecord, read_records
+
+def game_record(game_id):
+    return GameRecord(game_id,1,2,3,0.0,3,3,X,bytes([0,1,3,2,6]))
+
+async def append(path,game_ids):
+    log = MoveLog(path)
+    await log.open()
+    log.pending.extend(game_record(game_id).encode() for game_id in game_ids)
+    await log.close()
+
+def test_partial_record_is_cut_before_appending(tmp_path):
+    path = str(tmp_path/"moves.fml")
+    asyncio.run(append(path,[1,2]))
+    with open(path,"r+b") as f:
+        f.truncate(os.path.getsize(path)-20)
+    asyncio.run(append(path,[3,4,5]))
+    assert [record.game_id for record in read_records(path)] == [1,3,4,5]
+
+class FullDisk():
+    #File whose next write lands half its bytes, then fails
+    def __init__(self,file):
+        self.file = file
+
+    def write(self,data):
+        self.file.write(data[:len(data)//2])
+        raise OSError(28,"No space left on device")
+
+    def __getattr__(self,name):
+        return getattr(self.file,name)
+
+def test_failed_append_is_cut_back(tmp_path):
+    path = str(tmp_path/"moves.fml")
+    asyncio.run(append(path,[1]))
+
+    async def append_to_full_disk():
+        log = MoveLog(path)
+        await log.open()
+        log.file = FullDisk(log.file)
+        log.pending.append(game_record(2).encode())
+        await log.flush()
+        log.file = log.file.file
+        await log.close()
+    asyncio.run(append_to_full_disk())
+    asyncio.run(append(path,[3]))
+    #the failed game is retried when the log closes
+    assert [record.game_id for record in read_records(path)] == [1,2,3]
+
+def test_failed_append_is_retried_in_order(tmp_path):
+    path = str(tmp_path/"moves.fml")
+
+    async def fail_then_flush():
+        log = MoveLog(path)
+        await log.open()
+        log.file = FullDisk(log.file)
+        log.pending.append(game_record(1).encode())
+        await log.flush()
+        log.file = log.file.file
+        assert len(log.pending) == 1
+        log.pending.append(game_record(2).encode())
+        await log.flush()
+        assert not log.pending
+        await log.close()
+    asyncio.run(fail_then_flush())
+    assert [record.game_id for record in read_records(path)] == [1,2]